@@ -54,6 +54,7 @@ from .client import spin, myargv, init_node, \
     get_param, get_param_names, set_param, delete_param, has_param, search_param,\
     DEBUG, INFO, WARN, ERROR, FATAL
 from .timer import sleep, Rate, Timer
+from .callback_queue import CallbackQueue, get_callback_queue
 from .core import is_shutdown, signal_shutdown, \
     get_node_uri, get_ros_root, \
     logdebug, logwarn, loginfo, logout, logerr, logfatal, \
@@ -91,6 +92,8 @@ __all__ = [
     'search_param',
     'sleep',
     'Rate',
+    'CallbackQueue',
+    'get_callback_queue',
     'DEBUG',
     'INFO',
     'WARN',
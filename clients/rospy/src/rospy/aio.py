@@ -0,0 +1,391 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2008, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Revision $Id$
+
+"""
+asyncio API for rospy (Python 3.5+).
+
+Service calls, topic subscriptions and publishing that can be used
+from coroutines running on an asyncio event loop::
+
+  import rospy.aio
+
+  async def main():
+      add_two_ints = rospy.aio.ServiceProxy('add_two_ints', AddTwoInts)
+      resp = await add_two_ints(1, 2)
+
+      pub = rospy.aio.Publisher('echo', String)
+      async for msg in rospy.aio.Subscriber('chatter', String):
+          pub.publish(msg)
+
+Service calls are made with asyncio streams using the TCPROS service
+framing, so any number of calls can be in flight without a thread
+per call. Subscriptions use the regular rospy transports and hand
+messages over to the event loop that created them.
+
+rospy.init_node() must be called, with disable_signals=True when the
+event loop runs in the main thread, before using this API.
+"""
+
+import asyncio
+import io
+import struct
+
+import rosgraph
+import rosgraph.network
+
+import rospy.core
+import rospy.msg
+import rospy.names
+import rospy.topics
+import rospy.impl.validators
+
+from rospy.exceptions import ROSException, ROSInterruptException
+from rospy.service import _Service, ServiceException
+from rospy.impl.tcpros_service import TCPROSServiceClient, wait_for_service as _wait_for_service
+
+__all__ = ['ServiceProxy', 'Publisher', 'Subscriber', 'wait_for_service', 'wait_for_message']
+
+def _lookup_service(resolved_name):
+    """
+    Blocking lookup of a service URI with the master
+    @raise ServiceException: if the service is unavailable
+    """
+    try:
+        master = rosgraph.Master(rospy.names.get_caller_id())
+        uri = master.lookupService(resolved_name)
+    except (IOError, OSError):
+        raise ServiceException("unable to contact master")
+    except rosgraph.MasterError:
+        raise ServiceException("service [%s] unavailable"%resolved_name)
+    try:
+        rospy.core.parse_rosrpc_uri(uri)
+    except rospy.impl.validators.ParameterInvalid:
+        raise ServiceException("master returned invalid ROSRPC URI: %s"%uri)
+    return uri
+
+async def _read_header(reader):
+    """
+    Read a TCPROS handshake header from a stream
+    @return: header fields
+    @rtype: dict
+    """
+    size = await reader.readexactly(4)
+    (length,) = struct.unpack('<I', size)
+    return rosgraph.network.decode_ros_handshake_header(size + await reader.readexactly(length))
+
+class _Connection(object):
+    """
+    Stream connection to a service
+    """
+
+    def __init__(self, reader, writer, header):
+        self.reader = reader
+        self.writer = writer
+        self.header = header
+        self.write_buff = io.BytesIO()
+        # persistent connections can only have one call in flight
+        self.lock = asyncio.Lock()
+
+    async def call(self, request, seq, response_class, resolved_name):
+        b = self.write_buff
+        b.seek(0)
+        b.truncate(0)
+        rospy.msg.serialize_message(b, seq, request)
+        self.writer.write(b.getvalue())
+        await self.writer.drain()
+
+        ok = await self.reader.readexactly(1)
+        (length,) = struct.unpack('<I', await self.reader.readexactly(4))
+        data = await self.reader.readexactly(length)
+        if not struct.unpack('<B', ok)[0]:
+            raise ServiceException("service [%s] responded with an error: %s"%(resolved_name, data.decode('utf-8', 'replace')))
+        response = response_class()
+        response.deserialize(data)
+        response._connection_header = self.header
+        return response
+
+    def close(self):
+        self.writer.close()
+
+class ServiceProxy(_Service):
+    """
+    Create a handle to a ROS service for invoking calls from coroutines::
+
+      add_two_ints = rospy.aio.ServiceProxy('add_two_ints', AddTwoInts)
+      resp = await add_two_ints(1, 2)
+
+    Calls on a persistent proxy share one connection and are made one
+    at a time; calls on other proxies each use their own connection and
+    may run concurrently.
+    """
+
+    def __init__(self, name, service_class, persistent=False, headers=None):
+        """
+        ctor.
+        @param name: name of service to call
+        @type  name: str
+        @param service_class: auto-generated service class
+        @type  service_class: Service class
+        @param persistent: (optional) if True, proxy maintains a persistent
+        connection to service.
+        @type  persistent: bool
+        @param headers: (optional) arbitrary headers
+        @type  headers: dict
+        """
+        super(ServiceProxy, self).__init__(name, service_class)
+        self.seq = 0
+        self.persistent = persistent
+        if persistent:
+            if not headers:
+                headers = {}
+            headers['persistent'] = '1'
+        self.protocol = TCPROSServiceClient(self.resolved_name, self.service_class, headers=headers)
+        self._connection = None
+        self._connect_lock = asyncio.Lock()
+        self._lookup = None
+
+    async def wait_for_service(self, timeout=None):
+        await wait_for_service(self.resolved_name, timeout=timeout)
+
+    async def __call__(self, *args, **kwds):
+        return await self.call(*args, **kwds)
+
+    async def _get_service_uri(self):
+        """
+        Look up the service URI with the master. The lookup is blocking
+        XML-RPC so it is run in the loop's executor, and concurrent calls
+        share the same lookup.
+        """
+        if self._lookup is None:
+            loop = asyncio.get_event_loop()
+            self._lookup = loop.run_in_executor(None, _lookup_service, self.resolved_name)
+            self._lookup.add_done_callback(self._lookup_done)
+        self.uri = await asyncio.shield(self._lookup)
+        return self.uri
+
+    def _lookup_done(self, future):
+        if self._lookup is future:
+            self._lookup = None
+
+    async def _connect(self):
+        dest_addr, dest_port = rospy.core.parse_rosrpc_uri(await self._get_service_uri())
+        try:
+            reader, writer = await asyncio.open_connection(dest_addr, dest_port)
+        except (IOError, OSError) as e:
+            raise ServiceException("unable to connect to service: %s"%e)
+        try:
+            fields = self.protocol.get_header_fields()
+            writer.write(rosgraph.network.encode_ros_handshake_header(fields))
+            header = await _read_header(reader)
+        except (IOError, OSError, EOFError, rosgraph.network.ROSHandshakeException) as e:
+            writer.close()
+            raise ServiceException("unable to connect to service: %s"%e)
+        if 'error' in header:
+            writer.close()
+            raise ServiceException("unable to connect to service: remote error reported: %s"%header['error'])
+        return _Connection(reader, writer, header)
+
+    async def call(self, *args, **kwds):
+        """
+        Call the service. This accepts either a request message instance,
+        or you can call directly with arguments to create a new request
+        instance, as with L{rospy.ServiceProxy.call()}.
+
+        @raise TypeError: if request is not of the valid type (Message)
+        @raise ServiceException: if communication with remote service fails
+        @raise ROSInterruptException: if node shutdown (e.g. ctrl-C) interrupts service call
+        @raise ROSSerializationException: If unable to serialize
+        message. This is usually a type error with one of the fields.
+        """
+        request = rospy.msg.args_kwds_to_message(self.request_class, args, kwds)
+        if not self.request_class._type == request._type:
+            raise TypeError("request object type [%s] does not match service type [%s]"%(request.__class__, self.request_class))
+
+        if self.persistent:
+            async with self._connect_lock:
+                if self._connection is None:
+                    self._connection = await self._connect()
+            connection = self._connection
+        else:
+            connection = await self._connect()
+
+        self.seq += 1
+        try:
+            async with connection.lock:
+                return await connection.call(request, self.seq, self.response_class, self.resolved_name)
+        except (IOError, OSError, EOFError) as e:
+            if self.persistent and self._connection is connection:
+                self._connection = None
+            connection.close()
+            if rospy.core.is_shutdown():
+                raise ROSInterruptException("node shutdown interrupted service call")
+            raise ServiceException("transport error completing service call: %s"%e)
+        finally:
+            if not self.persistent:
+                connection.close()
+
+    def close(self):
+        """Close this ServiceProxy. This only has an effect on persistent ServiceProxy instances."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+class Publisher(rospy.topics.Publisher):
+    """
+    L{rospy.Publisher} whose publish() never blocks the event loop:
+    messages are always queued and sent by the connections' own
+    threads, dropping the oldest ones if a subscriber cannot keep up.
+    """
+
+    def __init__(self, name, data_class, queue_size=10, **kwds):
+        """
+        Constructor. Takes the same arguments as L{rospy.Publisher},
+        except that queue_size cannot be None.
+        @param queue_size: maximum number of messages queued for each
+        subscriber before the oldest are dropped
+        @type  queue_size: int
+        """
+        if queue_size is None or queue_size < 1:
+            raise ValueError("queue_size must be a positive integer")
+        super(Publisher, self).__init__(name, data_class, queue_size=queue_size, **kwds)
+
+class Subscriber(object):
+    """
+    Asynchronous iterator over the messages received on a topic::
+
+      async for msg in rospy.aio.Subscriber('chatter', String):
+          ...
+
+    Messages are received by the regular rospy transports and handed
+    over to the event loop the subscriber was created on.
+    """
+
+    def __init__(self, name, data_class, queue_size=None, **kwds):
+        """
+        Constructor. Takes the same arguments as L{rospy.Subscriber},
+        except for callback and callback_args.
+        @param queue_size: maximum number of messages waiting to be
+        consumed before the oldest are dropped. None for no limit.
+        @type  queue_size: int
+        """
+        self._loop = asyncio.get_event_loop()
+        self._queue_size = queue_size
+        self._queue = asyncio.Queue()
+        self._closed = False
+        self._subscriber = rospy.topics.Subscriber(name, data_class, self._callback, queue_size=queue_size, **kwds)
+        self.resolved_name = self._subscriber.resolved_name
+
+    def _callback(self, msg):
+        # called from the transport threads
+        if not self._closed:
+            self._call_soon(self._put, msg)
+
+    def _call_soon(self, fn, *args):
+        # messages arriving after the event loop has been closed are dropped
+        if self._loop.is_closed():
+            return
+        try:
+            self._loop.call_soon_threadsafe(fn, *args)
+        except RuntimeError:
+            pass # loop closed in the meantime
+
+    def _put(self, msg):
+        q = self._queue
+        if self._queue_size and msg is not None:
+            while q.qsize() >= self._queue_size:
+                q.get_nowait()
+        q.put_nowait(msg)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed and self._queue.empty():
+            raise StopAsyncIteration
+        msg = await self._queue.get()
+        if msg is None:
+            raise StopAsyncIteration
+        return msg
+
+    async def get(self):
+        """
+        Wait for the next message
+        @return: message
+        @rtype: L{rospy.Message}
+        @raise ROSInterruptException: if the subscriber has been unregistered
+        """
+        try:
+            return await self.__anext__()
+        except StopAsyncIteration:
+            raise ROSInterruptException("subscriber unregistered")
+
+    def unregister(self):
+        """
+        Unsubscribe from the topic. Iteration stops once the messages
+        already received have been consumed.
+        """
+        if not self._closed:
+            self._closed = True
+            self._subscriber.unregister()
+            self._call_soon(self._put, None)
+
+async def wait_for_service(service, timeout=None):
+    """
+    Wait until a service becomes available, as L{rospy.wait_for_service()}.
+    @raise ROSException: if specified timeout is exceeded
+    @raise ROSInterruptException: if shutdown interrupts wait
+    """
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, _wait_for_service, service, timeout)
+
+async def wait_for_message(topic, topic_type, timeout=None):
+    """
+    Receive one message from topic, as L{rospy.wait_for_message()}.
+    @param topic: name of topic
+    @type  topic: str
+    @param topic_type: topic type
+    @type  topic_type: L{rospy.Message} class
+    @param timeout: timeout time in seconds
+    @type  timeout: double
+    @return: Message
+    @rtype: L{rospy.Message}
+    @raise ROSException: if specified timeout is exceeded
+    """
+    s = Subscriber(topic, topic_type)
+    try:
+        return await asyncio.wait_for(s.get(), timeout)
+    except asyncio.TimeoutError:
+        raise ROSException("timeout exceeded while waiting for message on topic %s"%topic)
+    finally:
+        s.unregister()
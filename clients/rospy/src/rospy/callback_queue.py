@@ -0,0 +1,266 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2008, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Revision $Id$
+
+"""
+Callback queues for subscriber callbacks.
+
+By default, subscriber callbacks are invoked on the thread reading
+the connection the message arrived on. A Subscriber can instead be
+bound to a L{CallbackQueue}, in which case received messages are
+queued and the callbacks are invoked by the queue's own threads::
+
+  queue = rospy.get_callback_queue('perception', num_threads=4)
+  rospy.Subscriber('image', Image, callback, queue_size=2, callback_queue=queue)
+
+Callbacks of the same subscriber may then run concurrently. The
+subscriber's queue_size bounds the number of its messages waiting in
+the queue; the oldest are dropped when it is exceeded.
+"""
+
+import collections
+import threading
+import time
+import traceback
+
+import rospy.core
+
+class _Subscription(object):
+    """
+    Messages of one subscriber waiting in a L{CallbackQueue}
+    """
+
+    def __init__(self, queue, name, cb, cb_args, queue_size):
+        self.queue = queue
+        self.name = name
+        self.cb = cb
+        self.cb_args = cb_args
+        # deque drops the oldest message itself once queue_size is reached
+        self.msgs = collections.deque(maxlen=queue_size)
+        self.closed = False
+
+    def put(self, msg):
+        """
+        Queue msg for the callback. Called by the subscriber's connections.
+        """
+        self.queue._put(self, msg)
+
+    def close(self):
+        self.queue._close(self)
+
+class CallbackQueue(object):
+    """
+    Queue of pending subscriber callbacks serviced by a pool of threads.
+    """
+
+    def __init__(self, name, num_threads=1, executor=None):
+        """
+        @param name: name of the queue, for logging and statistics
+        @type  name: str
+        @param num_threads: number of threads invoking callbacks
+        @type  num_threads: int
+        @param executor: (optional) executor to run the callbacks in,
+          e.g. a concurrent.futures.ProcessPoolExecutor. The queue's
+          threads then only dispatch callbacks to the executor and
+          wait for them, so num_threads bounds the number of callbacks
+          in flight. Callbacks and messages must be picklable to use
+          a process pool.
+        @type  executor: concurrent.futures.Executor
+        @raise ValueError: if num_threads is less than one
+        """
+        if num_threads < 1:
+            raise ValueError("num_threads must be at least one")
+        self.name = name
+        self.executor = executor
+        self.cond = threading.Condition()
+        # one entry per queued message, in the order they arrived. The
+        # messages themselves are held by their subscription.
+        self._ready = collections.deque()
+        self._shutdown = False
+
+        # statistics
+        self._num_received = 0
+        self._num_dropped = 0
+        self._num_processed = 0
+        self._max_backlog = 0
+        self._total_latency = 0.
+        self._max_latency = 0.
+
+        self._threads = []
+        for i in range(num_threads):
+            t = threading.Thread(target=self._run, name='%s-%d'%(name, i))
+            t.daemon = True
+            self._threads.append(t)
+            t.start()
+
+    def subscribe(self, name, cb, cb_args, queue_size=None):
+        """
+        Create a subscription whose callback is invoked by this queue
+        @param name: topic name, for logging
+        @type  name: str
+        @param cb: callback function
+        @type  cb: fn(msg, cb_args)
+        @param cb_args: additional arguments to pass to callback or None
+        @type  cb_args: Any
+        @param queue_size: maximum number of messages of this
+          subscription waiting in the queue, or None for no limit
+        @type  queue_size: int
+        @return: subscription. Its put() method queues a message.
+        """
+        return _Subscription(self, name, cb, cb_args, queue_size)
+
+    def _put(self, subscription, msg):
+        with self.cond:
+            if subscription.closed or self._shutdown:
+                return
+            self._num_received += 1
+            msgs = subscription.msgs
+            if len(msgs) == msgs.maxlen:
+                # the oldest message is dropped and the new one takes
+                # over its slot in the ready queue
+                self._num_dropped += 1
+            else:
+                self._ready.append(subscription)
+                self._max_backlog = max(self._max_backlog, len(self._ready))
+                self.cond.notify()
+            msgs.append((msg, time.time()))
+
+    def _close(self, subscription):
+        with self.cond:
+            subscription.closed = True
+            if subscription.msgs:
+                subscription.msgs.clear()
+                self._ready = collections.deque(s for s in self._ready if s is not subscription)
+
+    def _get(self):
+        """
+        @return: next (subscription, msg, time queued), or None on shutdown
+        """
+        with self.cond:
+            while not self._ready and not self._shutdown:
+                self.cond.wait(1.0)
+                if rospy.core.is_shutdown():
+                    self._shutdown = True
+            if self._shutdown:
+                return None
+            subscription = self._ready.popleft()
+            msg, t = subscription.msgs.popleft()
+            return subscription, msg, t
+
+    def _run(self):
+        while True:
+            item = self._get()
+            if item is None:
+                return
+            subscription, msg, t = item
+            latency = time.time() - t
+            self._invoke_callback(subscription, msg)
+            with self.cond:
+                self._num_processed += 1
+                self._total_latency += latency
+                self._max_latency = max(self._max_latency, latency)
+
+    def _invoke_callback(self, subscription, msg):
+        cb, cb_args = subscription.cb, subscription.cb_args
+        args = (msg,) if cb_args is None else (msg, cb_args)
+        try:
+            if self.executor is not None:
+                self.executor.submit(cb, *args).result()
+            else:
+                cb(*args)
+        except Exception:
+            if not rospy.core.is_shutdown():
+                rospy.core.logerr("bad callback: %s\n%s"%(cb, traceback.format_exc()))
+
+    def get_backlog(self):
+        """
+        @return: number of messages waiting in the queue
+        @rtype: int
+        """
+        return len(self._ready)
+
+    def get_stats(self):
+        """
+        Get statistics for this queue
+        @return: dictionary with:
+          - received: messages put in the queue
+          - dropped: messages dropped because their subscription's queue_size was exceeded
+          - processed: callbacks invoked
+          - backlog: messages currently waiting
+          - max_backlog: largest number of messages waiting at once
+          - mean_latency, max_latency: seconds between a message being
+            queued and its callback starting
+        @rtype: dict
+        """
+        with self.cond:
+            processed = self._num_processed
+            return {
+                'received': self._num_received,
+                'dropped': self._num_dropped,
+                'processed': processed,
+                'backlog': len(self._ready),
+                'max_backlog': self._max_backlog,
+                'mean_latency': self._total_latency / processed if processed else 0.,
+                'max_latency': self._max_latency,
+            }
+
+    def shutdown(self, reason=''):
+        """
+        Stop the queue's threads. Pending callbacks are discarded.
+        @param reason: human-readable shutdown reason
+        @type  reason: str
+        """
+        with self.cond:
+            self._shutdown = True
+            self._ready.clear()
+            self.cond.notify_all()
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+def get_callback_queue(name, num_threads=1, executor=None):
+    """
+    Get the callback queue with the given name, creating it if it does
+    not exist. num_threads and executor are only used when the queue is
+    created. Queues are shut down with the node.
+    @param name: queue name
+    @type  name: str
+    @return: callback queue
+    @rtype: L{CallbackQueue}
+    """
+    with _queues_lock:
+        queue = _queues.get(name)
+        if queue is None:
+            queue = _queues[name] = CallbackQueue(name, num_threads=num_threads, executor=executor)
+            rospy.core.add_shutdown_hook(queue.shutdown)
+        return queue
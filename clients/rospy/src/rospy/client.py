@@ -187,7 +187,7 @@ def _init_node_params(argv, node_name):
 
 _init_node_args = None
 
-def init_node(name, argv=None, anonymous=False, log_level=None, disable_rostime=False, disable_rosout=False, disable_signals=False, xmlrpc_port=0, tcpros_port=0):
+def init_node(name, argv=None, anonymous=False, log_level=None, disable_rostime=False, disable_rosout=False, disable_signals=False, xmlrpc_port=0, tcpros_port=0, io_threads=0):
     """
     Register client node with the master under the specified name.
     This MUST be called from the main Python thread unless
@@ -248,6 +248,13 @@ def init_node(name, argv=None, anonymous=False, log_level=None, disable_rostime=
         connections on this port
     @type  tcpros_port: int
 
+    @param io_threads: If greater than zero, messages from all
+        publishers are received by this many shared I/O threads,
+        each waiting on many connections with a selector, instead of
+        by a thread per connection. This keeps the number of threads
+        constant for nodes with many subscriptions. (Python 3 only)
+    @type  io_threads: int
+
     @raise ROSInitException: if initialization/registration fails
     @raise ValueError: if parameters are invalid (e.g. name contains a namespace or is otherwise illegal)
     """
@@ -314,7 +321,7 @@ def init_node(name, argv=None, anonymous=False, log_level=None, disable_rostime=
     logger.info("init_node, name[%s], pid[%s]", resolved_node_name, os.getpid())
             
     # node initialization blocks until registration with master
-    node = rospy.impl.init.start_node(os.environ, resolved_node_name, port=xmlrpc_port, tcpros_port=tcpros_port) 
+    node = rospy.impl.init.start_node(os.environ, resolved_node_name, port=xmlrpc_port, tcpros_port=tcpros_port, io_threads=io_threads) 
     rospy.core.set_node_uri(node.uri)
     rospy.core.add_shutdown_hook(node.shutdown)    
     
@@ -447,7 +454,7 @@ def _init_param_server():
 class _Unspecified(object): pass
 _unspecified = _Unspecified()
 
-def get_param(param_name, default=_unspecified):
+def get_param(param_name, default=_unspecified, cached=False):
     """
     Retrieve a parameter from the param server
 
@@ -455,6 +462,12 @@ def get_param(param_name, default=_unspecified):
     
     @param default: (optional) default value to return if key is not set
     @type  default: any
+    @param cached: (optional) if True, subscribe to updates of the
+      parameter on first access, and return its cached value
+      afterwards without calling the master. Parameters in the
+      namespace of a cached parameter are cached as well. The
+      returned value must not be modified.
+    @type  cached: bool
     @return: parameter value
     @rtype: XmlRpcLegalValue
     @raise ROSException: if parameter server reports an error
@@ -462,6 +475,8 @@ def get_param(param_name, default=_unspecified):
     """
     try:
         _init_param_server()
+        if cached:
+            return _param_server.get_cached(param_name)
         return _param_server[param_name] #MasterProxy does all the magic for us
     except KeyError:
         if default != _unspecified:
@@ -68,7 +68,7 @@ def _node_run_error(e):
     rospyerr(traceback.format_exc())
     signal_shutdown('error in XML-RPC server: %s'%(e))
 
-def start_node(environ, resolved_name, master_uri=None, port=0, tcpros_port=0):
+def start_node(environ, resolved_name, master_uri=None, port=0, tcpros_port=0, io_threads=0):
     """
     Load ROS slave node, initialize from environment variables
     @param environ: environment variables
@@ -81,11 +81,13 @@ def start_node(environ, resolved_name, master_uri=None, port=0, tcpros_port=0):
     @type  port: int
     @param tcpros_port: override the port of the TCP server
     @type  tcpros_port: int
+    @param io_threads: number of I/O threads receiving on subscriber connections, or 0 for a thread per connection
+    @type  io_threads: int
     @return: node server instance
     @rtype rosgraph.xmlrpc.XmlRpcNode
     @raise ROSInitException: if node has already been started
     """
-    init_tcpros(tcpros_port)
+    init_tcpros(tcpros_port, io_threads)
     if not master_uri:
         master_uri = rosgraph.get_master_uri()
     if not master_uri:
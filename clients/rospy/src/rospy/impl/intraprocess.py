@@ -0,0 +1,186 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2008, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Revision $Id$
+
+"""
+Internal use: intra-process transport for topics that are both
+published and subscribed to by this node.
+
+Instead of serializing messages and sending them over a loopback
+TCPROS connection, the publisher hands the message objects to the
+subscriber. Delivery happens on the shared sender pool (see
+L{rospy.impl.tcpros_pubsub.QueuedConnection}), so publish() does
+not run the subscriber callbacks itself.
+
+The publisher's intraprocess policy controls what subscribers get:
+ - COPY: a copy of the published message, made when it is published
+   and shared by all subscribers in this process
+ - REFERENCE: the published message itself. The publisher must not
+   modify a message after publishing it, and subscribers must not
+   modify the messages they receive.
+ - NONE: use TCPROS as for remote subscribers
+"""
+
+import copy
+import logging
+
+import rospy.names
+from rospy.exceptions import TransportTerminated
+from rospy.impl.registration import get_topic_manager
+from rospy.impl.transport import Transport, INBOUND, OUTBOUND
+
+logger = logging.getLogger('rospy.intraprocess')
+
+COPY = 'copy'
+REFERENCE = 'reference'
+NONE = 'none'
+
+TRANSPORT_TYPE = 'INTRAPROCESS'
+
+def prepare_message(message, policy):
+    """
+    @param message: message being published
+    @type  message: L{genpy.Message}
+    @param policy: COPY or REFERENCE
+    @type  policy: str
+    @return: message to deliver to the subscribers in this process
+    @rtype: L{genpy.Message}
+    """
+    if policy == COPY:
+        return copy.deepcopy(message)
+    return message
+
+class _IntraProcessTransport(Transport):
+    """
+    One end of an intra-process topic connection
+    """
+    transport_type = TRANSPORT_TYPE
+
+    def __init__(self, direction, name, endpoint_id):
+        super(_IntraProcessTransport, self).__init__(direction, name)
+        self.endpoint_id = endpoint_id
+        self.peer = None
+
+    def close(self):
+        if not self.done:
+            super(_IntraProcessTransport, self).close()
+            if self.peer is not None:
+                self.peer.close()
+                self.peer = None
+
+    def get_transport_info(self):
+        return "%s connection to [%s]"%(self.transport_type, self.endpoint_id)
+
+class IntraProcessPub(_IntraProcessTransport):
+    """
+    Publisher end of an intra-process topic connection. write_data()
+    takes a message object instead of serialized data.
+    """
+
+    def __init__(self, name):
+        super(IntraProcessPub, self).__init__(OUTBOUND, name, rospy.names.get_caller_id())
+
+    def write_data(self, data):
+        peer = self.peer
+        if self.done or peer is None:
+            raise TransportTerminated("connection closed")
+        self.stat_num_msg += 1
+        peer.deliver(data)
+        return True
+
+class IntraProcessSub(_IntraProcessTransport):
+    """
+    Subscriber end of an intra-process topic connection
+    """
+
+    def __init__(self, name, pub_uri, sub, header, is_latched):
+        super(IntraProcessSub, self).__init__(INBOUND, name, pub_uri)
+        self.sub = sub
+        self.header = header
+        self.callerid_pub = rospy.names.get_caller_id()
+        self.is_latched = is_latched
+        self.latch = None
+
+    def deliver(self, msg):
+        """
+        Invoke the subscriber callbacks with msg
+        """
+        if self.done:
+            return
+        self.stat_num_msg += 1
+        msg._connection_header = self.header
+        # #1852: keep track of last latched message
+        if self.is_latched:
+            self.latch = msg
+        self.sub.receive_callback([msg], self)
+
+def connect(resolved_name, pub_uri):
+    """
+    Connect the subscriber of a topic to the publisher of the same
+    topic in this node, if possible.
+    @param resolved_name: resolved topic name
+    @type  resolved_name: str
+    @param pub_uri: XML-RPC URI of this node
+    @type  pub_uri: str
+    @return: [code, msg, numConnects] as for
+    L{rospy.impl.masterslave.ROSHandler._connect_topic()}, or
+    None if the connection has to be made with another transport
+    @rtype: [int, str, int]
+    """
+    tm = get_topic_manager()
+    pub = tm.get_publisher_impl(resolved_name)
+    sub = tm.get_subscriber_impl(resolved_name)
+    if pub is None or sub is None or pub.closed or sub.closed or pub.intraprocess == NONE:
+        return None
+    # subscribers to any type expect serialized data, and publishers
+    # of any type have nothing else to give
+    data_class = pub.data_class
+    if data_class._md5sum != sub.data_class._md5sum or data_class._md5sum == rospy.names.TOPIC_ANYTYPE:
+        return None
+
+    header = {'callerid': rospy.names.get_caller_id(), 'topic': resolved_name,
+              'type': data_class._type, 'md5sum': data_class._md5sum,
+              'message_definition': data_class._full_text,
+              'latching': '1' if pub.is_latch else '0'}
+    sub_conn = IntraProcessSub(resolved_name, pub_uri, sub, header, pub.is_latch)
+    pub_conn = IntraProcessPub(resolved_name)
+    sub_conn.peer = pub_conn
+    pub_conn.peer = sub_conn
+    # the subscriber end has to be ready before the publisher sends any latched message
+    if not sub.add_connection(sub_conn):
+        return None
+    if not pub.add_connection(pub_conn):
+        sub_conn.close()
+        return None
+    logger.debug("connected [%s] intra-process", resolved_name)
+    return 1, "connected intra-process to [%s]"%resolved_name, 1
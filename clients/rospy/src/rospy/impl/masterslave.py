@@ -72,7 +72,9 @@ from rosgraph.xmlrpc import XmlRpcHandler
 import rospy.names
 import rospy.rostime
 
+import rospy.impl.intraprocess
 import rospy.impl.tcpros
+import rospy.impl.udpros
 
 from rospy.core import *
 from rospy.impl.paramserver import get_param_server_cache
@@ -191,6 +193,11 @@ class ROSHandler(XmlRpcHandler):
         self.protocol_handlers = []
         handler = rospy.impl.tcpros.get_tcpros_handler()
         if handler is not None:
+            # in order of preference: UDP, only requested by subscribers
+            # created with udp=True, then shared memory with nodes on
+            # this machine
+            self.protocol_handlers.append(rospy.impl.udpros.get_handler())
+            self.protocol_handlers.append(rospy.impl.tcpros.get_shmros_handler())
             self.protocol_handlers.append(handler)
             
         self.reg_man = RegManager(self)
@@ -419,15 +426,34 @@ class ROSHandler(XmlRpcHandler):
             return -1, "No subscriber for topic [%s]"%topic, 0
         elif sub.has_connection(pub_uri):
             return 1, "_connect_topic[%s]: subscriber already connected to publisher [%s]"%(topic, pub_uri), 0
+
+        # the publisher is this node: pass messages directly if possible
+        if pub_uri == self.uri:
+            result = rospy.impl.intraprocess.connect(topic, pub_uri)
+            if result is not None:
+                return result
         
         #Negotiate with source for connection
         # - collect supported protocols
         protocols = []
-        for h in self.protocol_handlers: #currently only TCPROS
-            protocols.extend(h.get_supported())
+        for h in self.protocol_handlers:
+            protocols.extend(h.get_supported_for(topic, pub_uri))
         if not protocols:
             return 0, "ERROR: no available protocol handlers", 0
+        try:
+            return self._request_topic(caller_id, topic, pub_uri, protocols)
+        finally:
+            # release resources of protocols the publisher did not choose
+            for h in self.protocol_handlers:
+                h.end_negotiation(topic, pub_uri)
 
+    def _request_topic(self, caller_id, topic, pub_uri, protocols):
+        """
+        Request topic from publisher and create the connection with
+        the protocol it chooses.
+        @return: [code, msg, numConnects]
+        @rtype: [int, str, int]
+        """
         _logger.debug("connect[%s]: calling requestTopic(%s, %s, %s)", topic, caller_id, topic, str(protocols))
         # 1) have to preserve original (unresolved) params as this may
         #    go outside our graph
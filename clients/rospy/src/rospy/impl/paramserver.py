@@ -35,22 +35,87 @@
 
 import threading
 
-#TODO: get rid of this routine entirely. It doesn't work with the current PS representation.
+from rosgraph.names import canonicalize_name, SEP
+
+def _split(key):
+    """
+    @return: namespaces of canonical key
+    @rtype: [str]
+    """
+    return [x for x in key.split(SEP) if x]
+
+def _is_related(namespaces, other_namespaces):
+    """
+    @return: True if either key is in the namespace of the other
+    @rtype: bool
+    """
+    n = min(len(namespaces), len(other_namespaces))
+    return namespaces[:n] == other_namespaces[:n]
+
+def _get_subkey(value, namespaces):
+    """
+    @return: value of namespaces within value
+    @raise KeyError: if value does not contain namespaces
+    """
+    for ns in namespaces:
+        if type(value) != dict:
+            raise KeyError(ns)
+        value = value[ns]
+    return value
+
+def _set_subkey(value, namespaces, subvalue):
+    """
+    @return: value with namespaces set to subvalue. value is
+    copied, as values returned by get() must not change.
+    @rtype: XmlRpcLegalValue
+    """
+    if not namespaces:
+        return subvalue
+    value = dict(value) if type(value) == dict else {}
+    value[namespaces[0]] = _set_subkey(value.get(namespaces[0]), namespaces[1:], subvalue)
+    return value
+
 class ParamServerCache(object):
     """
-    Cache of values on the parameter server. Implementation
-    is just a thread-safe dictionary.
+    Cache of values on the parameter server, for the keys that this
+    node is subscribed to. Values are updated by paramUpdate calls
+    from the master, which can be for the subscribed key, a key
+    within its namespace, or a namespace it belongs to.
+    
+    Following the master, an empty dictionary is the value of a
+    parameter that is not set.
+
+    stat_hits and stat_misses count the lookups of get_cached()
+    that were, and were not, answered from the cache.
     """
     
     def __init__(self):
         self.lock = threading.Lock()
         self.d = {}
         self.notifier = None
+        # updates received while subscribing, and the number of
+        # subscriptions in progress: { key : [count, [(key, value)]] }
+        self._subscribing = {}
+
+        #STATS
+        self.stat_hits = 0
+        self.stat_misses = 0
         
     ## Delete parameter from cache
     def delete(self, key):
         with self.lock:
-            del self.d[key]
+            del self.d[canonicalize_name(key)]
+
+    def clear(self):
+        """
+        Remove all parameters from the cache
+        @return: keys that were cached, i.e. subscribed to
+        @rtype: [str]
+        """
+        with self.lock:
+            keys = list(self.d.keys())
+            self.d.clear()
+            return keys
 
     def set_notifier(self, notifier):
         """
@@ -60,6 +125,34 @@ class ParamServerCache(object):
         lock and thus must not implement any lengthy computation.
         """
         self.notifier = notifier
+
+    def _update(self, key, value):
+        """
+        Apply update to the cached keys. Assumes lock is held.
+        @return: True if any cached key is affected by the update
+        @rtype: bool
+        """
+        namespaces = _split(key)
+        found = False
+        for cached_key in list(self.d.keys()):
+            cached_namespaces = _split(cached_key)
+            n = len(cached_namespaces)
+            if namespaces[:n] == cached_namespaces:
+                # update of key within cached namespace
+                self.d[cached_key] = _set_subkey(self.d[cached_key], namespaces[n:], value)
+            elif cached_namespaces[:len(namespaces)] == namespaces:
+                # update of namespace containing cached key. The
+                # master also sends an update for the cached key.
+                try:
+                    self.d[cached_key] = _get_subkey(value, cached_namespaces[len(namespaces):])
+                except KeyError:
+                    self.d[cached_key] = {}
+            else:
+                continue
+            found = True
+            if self.notifier is not None:
+                self.notifier(cached_key, self.d[cached_key])
+        return found
         
     def update(self, key, value):
         """
@@ -68,20 +161,55 @@ class ParamServerCache(object):
         @type  key: str
         @param value: parameter value
         @type  value: str
-        @raise: KeyError if key is not already in the cache.
-        """
-        # TODOXXX: remove this code, as it is wrong. It is remaining
-        # in place to maintain a unit test until the correct logic is
-        # implemented. update() needs to check all subscribed keys and
-        # do a prefix match. The best way to do this is probably to
-        # pull the paramserver implementation from rosmaster and use
-        # it here.
-        if not key in self.d:
-            raise KeyError(key)
+        @raise: KeyError if key is not in the namespace of, or
+        a namespace of, a cached key.
+        """
+        key = canonicalize_name(key)
+        namespaces = _split(key)
         with self.lock:
-            self.d[key] = value
-            if self.notifier is not None:
-                self.notifier(key, value)
+            found = False
+            for subscribing_key, (_, updates) in self._subscribing.items():
+                if _is_related(namespaces, _split(subscribing_key)):
+                    updates.append((key, value))
+                    found = True
+            if not self._update(key, value) and not found:
+                raise KeyError(key)
+
+    def subscribing(self, key):
+        """
+        Record updates to key, to be applied once set() is called
+        with the value returned by the subscription. Each call must be
+        followed by a call to set() or cancel_subscribing().
+        @param key: parameter key
+        @type  key: str
+        """
+        with self.lock:
+            self._subscribing.setdefault(canonicalize_name(key), [0, []])[0] += 1
+
+    def _end_subscribing(self, key):
+        """
+        End a subscription in progress. Assumes lock is held.
+        @return: updates received while subscribing, or None if no
+        subscription was in progress
+        @rtype: [(str, XmlRpcLegalValue)]
+        """
+        entry = self._subscribing.get(key)
+        if entry is None:
+            return None
+        entry[0] -= 1
+        if not entry[0]:
+            del self._subscribing[key]
+        return entry[1]
+
+
+    def cancel_subscribing(self, key):
+        """
+        Stop recording updates to key after a failed subscription.
+        @param key: parameter key
+        @type  key: str
+        """
+        with self.lock:
+            self._end_subscribing(canonicalize_name(key))
                 
     def set(self, key, value):
         """
@@ -92,18 +220,64 @@ class ParamServerCache(object):
         @param value: parameter value
         @type  value: str
         """
+        key = canonicalize_name(key)
         with self.lock:
+            updates = self._end_subscribing(key)
+            if updates is not None and key in self.d:
+                # set by a concurrent subscription, and updated since:
+                # value may be older
+                return
             self.d[key] = value
+            # updates received while subscribing are more recent
+            for update_key, update_value in updates or []:
+                self._update(update_key, update_value)
+            
+    def _get(self, key):
+        """
+        Get value of key. Assumes lock is held.
+        """
+        if key in self.d:
+            return self.d[key]
+        # look up key in the value of a cached namespace
+        namespaces = _split(key)
+        for i in range(len(namespaces) - 1, -1, -1):
+            ns = SEP + SEP.join(namespaces[:i])
+            if ns in self.d:
+                try:
+                    return _get_subkey(self.d[ns], namespaces[i:])
+                except KeyError:
+                    return {}
+        raise KeyError(key)
             
     def get(self, key):
         """
         @param key: parameter key
         @type  key: str
         @return: Current value for parameter
-        @raise: KeyError
+        @raise: KeyError if neither key nor any of its namespaces are cached
         """
+        key = canonicalize_name(key)
         with self.lock:
-            return self.d[key]
+            return self._get(key)
+
+    def get_cached(self, key):
+        """
+        Get the cached value of the parameter, counting cache hits
+        and misses.
+        @param key: parameter key
+        @type  key: str
+        @return: Current value for parameter
+        @raise: KeyError if key is not cached
+        """
+        key = canonicalize_name(key)
+        with self.lock:
+            try:
+                value = self._get(key)
+            except KeyError:
+                self.stat_misses += 1
+                raise
+            self.stat_hits += 1
+            return value
 
 _param_server_cache = None
 def get_param_server_cache():
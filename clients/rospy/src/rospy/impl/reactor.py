@@ -0,0 +1,270 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2008, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Revision $Id$
+
+"""
+Internal use: I/O reactor for receiving on many TCPROS connections
+with a small, fixed number of threads.
+
+By default each inbound topic connection is read by its own thread
+running L{TCPROSTransport.receive_loop()}. When the reactor is
+enabled (see L{rospy.init_node()} io_threads), established
+connections are instead registered with an L{IOReactor}, whose
+threads wait on all of their sockets with a selector (epoll where
+available) and read whatever data is ready without blocking.
+
+The same threads also send the data queued on outbound topic
+connections (see L{rospy.impl.tcpros_pubsub.AsyncConnection}),
+writing to each socket only when it can accept more data.
+"""
+
+import logging
+import socket
+import threading
+import traceback
+
+try:
+    import selectors
+except ImportError:
+    selectors = None  # Python 2.x
+
+from rospy.core import is_shutdown, logerr, rospydebug
+from rospy.exceptions import TransportException
+
+logger = logging.getLogger('rospy.reactor')
+
+# Seconds between checks for shutdown while waiting for I/O
+_SELECT_TIMEOUT = 1.0
+
+def is_reactor_supported():
+    """
+    @return: True if the I/O reactor is supported on this platform
+    @rtype: bool
+    """
+    return selectors is not None
+
+class _IOLoop(object):
+    """
+    A thread waiting on a selector for the sockets of its connections
+    """
+
+    def __init__(self, name):
+        self.selector = selectors.DefaultSelector()
+        self.connections = {} # { transport : msgs_callback }
+
+        # operations from other threads are queued, and the selector
+        # woken up to run them, as selectors are not thread-safe
+        self._lock = threading.Lock()
+        self._ops = []
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(0)
+        self._wakeup_send.setblocking(0)
+        self.selector.register(self._wakeup_recv, selectors.EVENT_READ, None)
+
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def call_soon(self, fn, *args):
+        """
+        Run fn(*args) on the loop thread
+        """
+        with self._lock:
+            # the loop has already been woken up if ops are pending
+            wakeup = not self._ops
+            self._ops.append((fn, args))
+        if wakeup:
+            try:
+                self._wakeup_send.send(b'\0')
+            except socket.error:
+                pass # wakeup already pending
+
+    def add(self, transport, msgs_callback):
+        if transport.done or transport.socket is None:
+            return
+        transport.socket.setblocking(0)
+        self.connections[transport] = msgs_callback
+        self.selector.register(transport.socket, selectors.EVENT_READ, lambda events: self._receive(transport))
+
+    def remove(self, transport, sock):
+        if self.connections.pop(transport, None) is not None:
+            self._unregister(sock)
+
+    def add_writer(self, writer):
+        """
+        Send the data queued on writer, waiting for its socket to
+        become writable if it cannot all be sent right away.
+        @param writer: must provide socket and handle_write(), which
+        sends as much as possible without blocking and returns True
+        if data remains to be sent.
+        """
+        sock = writer.socket
+        if sock is None or not writer.handle_write():
+            return
+        try:
+            self.selector.register(sock, selectors.EVENT_WRITE, lambda events: self._write(writer, sock))
+        except KeyError:
+            pass # already waiting for the socket
+        except ValueError:
+            pass # socket closed
+
+    def remove_writer(self, writer, sock):
+        self._unregister(sock)
+
+    def _write(self, writer, sock):
+        if not writer.handle_write():
+            self._unregister(sock)
+
+    def _unregister(self, sock):
+        if sock is None:
+            return
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def _run_ops(self):
+        try:
+            while self._wakeup_recv.recv(4096):
+                pass
+        except socket.error:
+            pass
+        with self._lock:
+            ops, self._ops = self._ops, []
+        for fn, args in ops:
+            fn(*args)
+
+    def _run(self):
+        try:
+            while not is_shutdown():
+                for key, events in self.selector.select(_SELECT_TIMEOUT):
+                    if key.data is None:
+                        self._run_ops()
+                    else:
+                        key.data(events)
+        except Exception:
+            # the selector may error out at interpreter shutdown
+            if not is_shutdown():
+                logerr("I/O reactor thread exited unexpectedly: %s", traceback.format_exc())
+        finally:
+            for transport in list(self.connections):
+                if not transport.done:
+                    transport.close()
+
+    def _receive(self, transport):
+        msgs_callback = self.connections.get(transport)
+        if msgs_callback is None or transport.done:
+            return
+
+        try:
+            msgs = transport.receive_ready()
+        except TransportException as e:
+            # the connection was broken: reconnect as receive_loop() would
+            rospydebug("[%s]: connection to [%s] lost, reconnecting: %s", transport.name, transport.endpoint_id, e)
+            sock = transport.socket
+            self.remove(transport, sock)
+            if sock is not None:
+                try:
+                    sock.close()
+                except Exception:
+                    pass
+            transport.socket = None
+            if not transport.done:
+                t = threading.Thread(target=_reconnect, args=(transport, msgs_callback, self))
+                t.daemon = True
+                t.start()
+            return
+        except Exception:
+            rospydebug("exception receiving on [%s], may be normal. Exception is %s", transport.name, traceback.format_exc())
+            return
+
+        if msgs and not transport.done and not is_shutdown():
+            try:
+                msgs_callback(msgs, transport)
+            except Exception:
+                logerr("error processing messages received on [%s]: %s", transport.name, traceback.format_exc())
+
+def _reconnect(transport, msgs_callback, loop):
+    transport._reconnect()
+    if not transport.done and transport.socket is not None:
+        loop.call_soon(loop.add, transport, msgs_callback)
+
+class IOReactor(object):
+    """
+    Receives on registered transports using a fixed number of I/O
+    threads, each multiplexing its share of the connections.
+    """
+
+    def __init__(self, num_threads=1):
+        """
+        @param num_threads: number of I/O threads
+        @type  num_threads: int
+        @raise ValueError: if num_threads is less than one
+        """
+        if num_threads < 1:
+            raise ValueError("num_threads must be at least one")
+        self._lock = threading.Lock()
+        self._loops = [_IOLoop('rospy.reactor-%d' % i) for i in range(num_threads)]
+        self._next_loop = 0
+
+    def register(self, transport, msgs_callback):
+        """
+        Receive messages on an established transport until it is
+        closed. Reconnection after errors is handled as in
+        L{TCPROSTransport.receive_loop()}.
+        @param transport: connected transport. Must provide
+        receive_ready(), which reads available data without blocking.
+        @type  transport: L{TCPROSTransport}
+        @param msgs_callback: callback to invoke for new messages received
+        @type  msgs_callback: fn([msg], transport)
+        """
+        loop = self.get_loop()
+        transport.reactor = loop
+        loop.call_soon(loop.add, transport, msgs_callback)
+
+    def get_loop(self):
+        """
+        @return: I/O loop to handle a new connection, in turn
+        @rtype: L{_IOLoop}
+        """
+        with self._lock:
+            loop = self._loops[self._next_loop]
+            self._next_loop = (self._next_loop + 1) % len(self._loops)
+        return loop
+
+    def get_num_threads(self):
+        """
+        @return: number of I/O threads
+        @rtype: int
+        """
+        return len(self._loops)
@@ -0,0 +1,569 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2008, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Revision $Id$
+
+"""
+Internal use: SHMROS, shared memory transport for topics between
+nodes on the same machine.
+
+A SHMROS connection is a TCPROS connection whose publisher also
+maps a ring buffer in shared memory (a file in /dev/shm) that the
+subscriber maps as well. The handshake is the same as for TCPROS,
+with the subscriber sending a 'protocol' field set to SHMROS, and the
+publisher answering with the 'shm_path' and 'shm_size' of the ring.
+
+Messages smaller than L{MIN_SHM_SIZE} are sent over the socket as
+with TCPROS. The body of larger messages is written to the ring, and
+only a descriptor of it is sent over the socket::
+
+  0xffffffff (uint32), position (uint64), length (uint32)
+
+The subscriber copies the message out of the ring and advances the
+ring's tail, making room for the publisher. The publisher falls back
+to sending messages over the socket whenever they do not fit, and
+until the subscriber has mapped the ring, so a subscriber that cannot
+map it (e.g. in another container) gets plain TCPROS.
+
+Subscribers offer SHMROS before TCPROS in requestTopic, along with
+an identifier of their machine. Publishers on another machine, or
+on a platform without /dev/shm, choose TCPROS instead.
+"""
+
+import errno
+import logging
+import mmap
+import os
+import socket
+import stat
+import struct
+import tempfile
+import threading
+import traceback
+
+import rosgraph
+import genpy
+
+import rospy.core
+import rospy.names
+import rospy.impl.registration
+
+from rospy.core import logwarn
+from rospy.msg import _struct_I
+from rospy.impl.tcpros_base import TCPROSTransport, TCPROS, \
+    get_tcpros_server_address, start_tcpros_server
+from rospy.impl.tcpros_pubsub import TCPROSPub, TCPROSSub
+from rospy.impl.transport import ProtocolHandler, INBOUND, OUTBOUND
+
+logger = logging.getLogger('rospy.shmros')
+
+SHMROS = 'SHMROS'
+
+## directory of the files backing the ring buffers
+_SHM_DIR = '/dev/shm'
+## prefix of the names of the files backing the ring buffers
+_SHM_PREFIX = 'rospy-shmros-'
+
+# size of the ring buffer of each connection (in bytes). Pages are
+# only allocated as they are used, i.e. once large messages are sent.
+DEFAULT_SEGMENT_SIZE = 32 * 1024 * 1024
+# the pages of the ring are allocated in steps of this many bytes
+_RESERVE_SIZE = 1024 * 1024
+
+# messages smaller than this (in bytes) are sent over the socket, as
+# loopback TCP is about as fast for them (see transport_benchmark.py
+# in test_rospy)
+MIN_SHM_SIZE = 128 * 1024
+
+# length word marking a descriptor of a message in the ring buffer
+_SHM_FRAME = 0xffffffff
+_struct_descriptor = struct.Struct('<IQI')
+_struct_Q = struct.Struct('<Q')
+
+# ring buffer header: tail position, written by the subscriber, and
+# whether the subscriber has mapped the ring. Data starts at _HEADER_SIZE.
+_TAIL = 0
+_ATTACHED = 8
+_HEADER_SIZE = 64
+
+_PARAM_SHMROS = '/shmros'
+_use_shmros = None
+_use_shmros_lock = threading.Lock()
+def _is_use_shmros():
+    global _use_shmros
+    if _use_shmros is not None:
+        return _use_shmros
+    with _use_shmros_lock:
+        if _use_shmros is not None:
+            return _use_shmros
+        # in order to prevent circular dependencies, this does not use the
+        # builtin libraries for interacting with the parameter server
+        m = rospy.core.xmlrpcapi(rosgraph.get_master_uri())
+        code, msg, val = m.getParam(rospy.names.get_caller_id(), _PARAM_SHMROS)
+        _use_shmros = bool(val) if code == 1 else True
+        return _use_shmros
+
+def is_shmros_supported():
+    """
+    @return: True if SHMROS is supported on this platform
+    @rtype: bool
+    """
+    return os.path.isdir(_SHM_DIR)
+
+_host_id = None
+def get_host_id():
+    """
+    @return: identifier of this machine, to tell whether a peer can
+    share memory with this node
+    @rtype: str
+    """
+    global _host_id
+    if _host_id is None:
+        try:
+            with open('/proc/sys/kernel/random/boot_id') as f:
+                boot_id = f.read().strip()
+        except IOError:
+            boot_id = ''
+        _host_id = '%s/%s'%(socket.gethostname(), boot_id)
+    return _host_id
+
+def _reserve(fd, offset, length):
+    """
+    Allocate the pages backing part of a segment. Touching pages of a
+    shared memory file that cannot be allocated, e.g. because /dev/shm
+    is full, kills the process with SIGBUS, so they are allocated
+    before they are first written to.
+    @raise EnvironmentError: if the pages cannot be allocated
+    """
+    if hasattr(os, 'posix_fallocate'):
+        os.posix_fallocate(fd, offset, length)
+    else:
+        # Python 2: write zeros, the pages have not been used yet
+        zeros = b'\0' * min(length, _RESERVE_SIZE)
+        os.lseek(fd, offset, os.SEEK_SET)
+        while length > 0:
+            length -= os.write(fd, zeros[:length])
+
+class _Segment(object):
+    """
+    Ring buffer in shared memory, written by a publisher and read by
+    a single subscriber. Positions in the ring grow monotonically, and
+    a message is always contiguous: one that does not fit before the
+    end of the ring starts over at its beginning.
+    """
+
+    def __init__(self, path, mm, size, fd=None):
+        self.path = path
+        self.mm = mm
+        self.size = size
+        # position of the end of the last message written (publisher only)
+        self.head = 0
+        self.attached = False
+        # file backing the ring and number of bytes of the ring
+        # allocated (publisher only)
+        self.fd = fd
+        self.reserved = 0
+
+    @classmethod
+    def create(cls, size=DEFAULT_SEGMENT_SIZE):
+        """
+        @param size: capacity of the ring in bytes
+        @type  size: int
+        @return: new ring buffer
+        @rtype: L{_Segment}
+        @raise EnvironmentError: if the ring cannot be created
+        """
+        fd, path = tempfile.mkstemp(prefix=_SHM_PREFIX, dir=_SHM_DIR)
+        try:
+            os.ftruncate(fd, _HEADER_SIZE + size)
+            # the header is written to by the subscriber as well
+            _reserve(fd, 0, _HEADER_SIZE)
+            mm = mmap.mmap(fd, _HEADER_SIZE + size)
+        except:
+            os.close(fd)
+            os.unlink(path)
+            raise
+        return cls(path, mm, size, fd)
+
+    @classmethod
+    def attach(cls, path, size):
+        """
+        Map the ring buffer created by a publisher, and remove its
+        file, which is no longer needed once both ends have mapped it.
+        @param path: path of the file backing the ring
+        @type  path: str
+        @param size: capacity of the ring in bytes
+        @type  size: int
+        @return: mapped ring buffer
+        @rtype: L{_Segment}
+        @raise EnvironmentError: if the ring cannot be mapped, or path
+        is not a file created by L{create}
+        """
+        # path is sent by the publisher: never open, write to or remove
+        # anything else than a ring buffer file
+        if os.path.dirname(path) != _SHM_DIR or not os.path.basename(path).startswith(_SHM_PREFIX):
+            raise IOError(errno.EINVAL, "not a shared memory segment", path)
+        fd = os.open(path, os.O_RDWR | getattr(os, 'O_NOFOLLOW', 0))
+        try:
+            st = os.fstat(fd)
+            if not stat.S_ISREG(st.st_mode):
+                raise IOError(errno.EINVAL, "not a shared memory segment", path)
+            if st.st_size != _HEADER_SIZE + size:
+                raise IOError(errno.EINVAL, "unexpected size of shared memory segment", path)
+            mm = mmap.mmap(fd, _HEADER_SIZE + size)
+        finally:
+            os.close(fd)
+        segment = cls(path, mm, size)
+        segment.unlink()
+        _struct_Q.pack_into(mm, _ATTACHED, 1)
+        return segment
+
+    def unlink(self):
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass # already removed by the other end
+            self.path = None
+
+    def write(self, data):
+        """
+        @param data: message to write
+        @type  data: bytes
+        @return: position of the message in the ring, or None if the
+        subscriber has not mapped the ring or there is no room for it
+        @rtype: int
+        """
+        if not self.attached:
+            if not _struct_Q.unpack_from(self.mm, _ATTACHED)[0]:
+                return None
+            self.attached = True
+            self.unlink()
+        n = len(data)
+        size = self.size
+        if n > size:
+            return None
+        start = self.head
+        offset = start % size
+        (tail,) = _struct_Q.unpack_from(self.mm, _TAIL)
+        restart = tail == start and offset
+        if restart:
+            # start over at the beginning of the ring once it is empty,
+            # which keeps reusing the same (already mapped, cached)
+            # pages. The subscriber has nothing to release, so the tail
+            # can be moved past the skipped space.
+            start = tail = start + size - offset
+            offset = 0
+        elif offset + n > size:
+            start += size - offset
+            offset = 0
+        if start + n - tail > size:
+            return None
+        if offset + n > self.reserved:
+            reserved = min(size, (offset + n + _RESERVE_SIZE - 1) // _RESERVE_SIZE * _RESERVE_SIZE)
+            try:
+                _reserve(self.fd, _HEADER_SIZE + self.reserved, reserved - self.reserved)
+            except EnvironmentError as e:
+                logger.debug("unable to allocate shared memory, sending over the socket: %s", e)
+                return None
+            self.reserved = reserved
+        if restart:
+            _struct_Q.pack_into(self.mm, _TAIL, tail)
+        self.mm[_HEADER_SIZE + offset:_HEADER_SIZE + offset + n] = data
+        self.head = start + n
+        return start
+
+    def read(self, pos, n):
+        """
+        @return: copy of the message at position pos
+        @rtype: bytes
+        """
+        offset = pos % self.size
+        if offset + n > self.size:
+            raise genpy.DeserializationError("invalid shared memory descriptor [%s, %s]"%(pos, n))
+        return self.mm[_HEADER_SIZE + offset:_HEADER_SIZE + offset + n]
+
+    def release(self, pos):
+        """
+        Let the publisher reuse the ring up to position pos
+        """
+        _struct_Q.pack_into(self.mm, _TAIL, pos)
+
+    def close(self):
+        self.unlink()
+        self.mm.close()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+def _deserialize_messages(b, msg_queue, data_class, segment, queue_size=None):
+    """
+    L{rospy.msg.deserialize_messages()} for SHMROS connections, which
+    also resolves the descriptors of messages in the ring buffer.
+    @param b: read buffer
+    @type  b: L{rospy.msg.ReceiveBuffer}
+    @param segment: ring buffer, or None if it is not mapped
+    @type  segment: L{_Segment}
+    """
+    try:
+        data = b.data
+        pos = 0
+        end = b.tell()
+        frames = []
+        b.expected = 0
+        while end - pos >= 4:
+            (size,) = _struct_I.unpack_from(data, pos)
+            if size == _SHM_FRAME:
+                if end - pos < _struct_descriptor.size:
+                    b.expected = _struct_descriptor.size
+                    break
+                _, offset, size = _struct_descriptor.unpack_from(data, pos)
+                if segment is None:
+                    raise genpy.DeserializationError("received shared memory descriptor without a shared memory segment")
+                frames.append((True, offset, size))
+                pos += _struct_descriptor.size
+            elif end - pos - 4 < size:
+                b.expected = 4 + size
+                break
+            else:
+                frames.append((False, pos + 4, size))
+                pos += 4 + size
+
+        if queue_size is not None and len(frames) > queue_size:
+            # the ring still has to be released past dropped messages
+            for in_shm, offset, size in frames[:len(frames) - queue_size]:
+                if in_shm:
+                    segment.release(offset + size)
+            frames = frames[-queue_size:]
+        if frames:
+            view = memoryview(data)
+            try:
+                for in_shm, offset, size in frames:
+                    if in_shm:
+                        buff = segment.read(offset, size)
+                        segment.release(offset + size)
+                    else:
+                        buff = view[offset:offset + size].tobytes()
+                    msg_queue.append(data_class().deserialize(buff))
+            finally:
+                del view
+        if queue_size is not None:
+            del msg_queue[:-queue_size]
+
+        b.consume(0, pos)
+    except genpy.DeserializationError:
+        raise
+    except Exception as e:
+        logger.error("cannot deserialize message: EXCEPTION %s", traceback.format_exc())
+        raise genpy.DeserializationError("cannot deserialize: %s"%str(e))
+
+class SHMROSSub(TCPROSSub):
+    """
+    Subscription transport implementation for receiving topic data
+    through a ring buffer in shared memory
+    """
+
+    def __init__(self, *args, **kwds):
+        super(SHMROSSub, self).__init__(*args, **kwds)
+        self.segment = None
+
+    def get_header_fields(self):
+        fields = super(SHMROSSub, self).get_header_fields()
+        fields['protocol'] = SHMROS
+        return fields
+
+    def read_messages(self, b, msg_queue, sock):
+        _deserialize_messages(b, msg_queue, self.recv_data_class, self.segment, queue_size=self.queue_size)
+
+class SHMROSPub(TCPROSPub):
+    """
+    Publisher transport implementation for publishing topic data
+    through a ring buffer in shared memory
+    """
+
+    def __init__(self, *args, **kwds):
+        super(SHMROSPub, self).__init__(*args, **kwds)
+        self.segment = None
+
+    def get_header_fields(self):
+        fields = super(SHMROSPub, self).get_header_fields()
+        if self.segment is not None:
+            fields['shm_path'] = self.segment.path
+            fields['shm_size'] = str(self.segment.size)
+        return fields
+
+class SHMROSTransport(TCPROSTransport):
+    """
+    TCPROS transport that passes large messages through a ring
+    buffer in shared memory
+    """
+    transport_type = SHMROS
+
+    def __init__(self, protocol, name, header=None):
+        super(SHMROSTransport, self).__init__(protocol, name, header=header)
+        self.segment = None
+        self._lock = threading.Lock()
+
+    def _set_segment(self, segment):
+        with self._lock:
+            if self.segment is not None:
+                self.segment.close()
+            self.segment = segment
+            if self.protocol is not None:
+                self.protocol.segment = segment
+
+    def write_header(self):
+        if self.direction == OUTBOUND and self.segment is None and self.protocol is not None:
+            try:
+                self._set_segment(_Segment.create())
+            except EnvironmentError as e:
+                # subscriber will get all messages over the socket
+                logwarn("[%s]: unable to create shared memory segment, using TCPROS: %s", self.name, e)
+        super(SHMROSTransport, self).write_header()
+
+    def _validate_header(self, header):
+        super(SHMROSTransport, self)._validate_header(header)
+        if self.direction != INBOUND:
+            return
+        segment = None
+        if 'shm_path' in header:
+            try:
+                segment = _Segment.attach(header['shm_path'], int(header['shm_size']))
+            except (EnvironmentError, ValueError, KeyError) as e:
+                # publisher will keep sending all messages over the socket
+                logger.info("[%s]: unable to map shared memory segment of [%s], using TCPROS: %s", self.name, self.endpoint_id, e)
+        # a new segment on every (re)connection
+        self._set_segment(segment)
+
+    def write_data(self, data):
+        with self._lock:
+            segment = self.segment
+            n = len(data) - 4
+            if segment is not None and n >= MIN_SHM_SIZE and not self.done:
+                pos = segment.write(memoryview(data)[4:])
+                if pos is not None:
+                    super(SHMROSTransport, self).write_data(_struct_descriptor.pack(_SHM_FRAME, pos, n))
+                    self.stat_bytes += n
+                    return True
+            return super(SHMROSTransport, self).write_data(data)
+
+    def close(self):
+        super(SHMROSTransport, self).close()
+        self._set_segment(None)
+
+class SHMROSHandler(ProtocolHandler):
+    """
+    ROS Protocol handler for SHMROS. Connections share the TCPROS
+    server socket and connection logic of tcpros_handler.
+    """
+
+    def __init__(self, tcpros_handler):
+        """
+        ctor
+        @param tcpros_handler: TCPROS handler
+        @type  tcpros_handler: L{rospy.impl.tcpros_pubsub.TCPROSHandler}
+        """
+        self.tcpros_handler = tcpros_handler
+        tcpros_handler.pub_transport_factories[SHMROS] = self._create_pub_transport
+
+    def _create_pub_transport(self, resolved_name, pub):
+        protocol = SHMROSPub(resolved_name, pub.data_class, is_latch=pub.is_latch, headers=pub.headers)
+        return SHMROSTransport(protocol, resolved_name)
+
+    def shutdown(self):
+        pass
+
+    def create_transport(self, resolved_name, pub_uri, protocol_params):
+        """
+        Connect to topic resolved_name on Publisher pub_uri using SHMROS.
+        @param resolved_name str: resolved topic name
+        @type  resolved_name: str
+        @param pub_uri: XML-RPC URI of publisher
+        @type  pub_uri: str
+        @param protocol_params: protocol parameters to use for connecting
+        @type protocol_params: [XmlRpcLegal]
+        @return: code, message, debug
+        @rtype: (int, str, int)
+        """
+        #Validate protocol params = [SHMROS, address, port]
+        if type(protocol_params) != list or len(protocol_params) != 3:
+            return 0, "ERROR: invalid SHMROS parameters", 0
+        if protocol_params[0] != SHMROS:
+            return 0, "INTERNAL ERROR: protocol id is not SHMROS: %s"%protocol_params[0], 0
+        _, dest_addr, dest_port = protocol_params
+
+        sub = rospy.impl.registration.get_topic_manager().get_subscriber_impl(resolved_name)
+        protocol = SHMROSSub(resolved_name, sub.data_class, \
+                             queue_size=sub.queue_size, buff_size=sub.buff_size,
+                             tcp_nodelay=sub.tcp_nodelay)
+        conn = SHMROSTransport(protocol, resolved_name)
+        return self.tcpros_handler.start_subscriber(conn, sub, pub_uri, dest_addr, dest_port)
+
+    def supports(self, protocol):
+        """
+        @param protocol: name of protocol
+        @type protocol: str
+        @return: True if protocol is supported
+        @rtype: bool
+        """
+        return protocol == SHMROS
+
+    def get_supported(self):
+        """
+        Get supported protocols
+        """
+        if not is_shmros_supported() or not _is_use_shmros():
+            return []
+        return [[SHMROS, get_host_id()]]
+
+    def init_publisher(self, resolved_name, protocol):
+        """
+        Initialize this node to receive an inbound SHMROS connection,
+        or a TCPROS connection if the subscriber is on another machine.
+
+        @param resolved_name: topic name
+        @type  resolved__name: str
+
+        @param protocol: negotiated protocol
+          parameters. protocol[0] must be the string 'SHMROS'
+        @type  protocol: [str, value*]
+        @return: (code, msg, [SHMROS, addr, port]) or the result of
+        L{TCPROSHandler.init_publisher()}
+        @rtype: (int, str, list)
+        """
+        if protocol[0] != SHMROS:
+            return 0, "Internal error: protocol does not match SHMROS: %s"%protocol, []
+        if len(protocol) != 2 or protocol[1] != get_host_id() or not is_shmros_supported():
+            return self.tcpros_handler.init_publisher(resolved_name, [TCPROS])
+        start_tcpros_server()
+        addr, port = get_tcpros_server_address()
+        return 1, "ready on %s:%s"%(addr, port), [SHMROS, addr, port]
@@ -46,17 +46,27 @@ import rospy.impl.tcpros_service
 
 from rospy.impl.tcpros_base import init_tcpros_server, DEFAULT_BUFF_SIZE
 from rospy.impl.tcpros_pubsub import TCPROSHandler
+from rospy.impl.shmros import SHMROSHandler
 
 _handler = TCPROSHandler()
+_shmros_handler = SHMROSHandler(_handler)
 
-def init_tcpros(port=0):
+def init_tcpros(port=0, io_threads=0):
     """
     @param tcpros_port: override the port of the TCP server
     @type  tcpros_port: int
+    @param io_threads: if greater than zero, receive on subscriber
+    connections using this many I/O threads rather than a thread per connection
+    @type  io_threads: int
     """
+    if io_threads > 0:
+        _handler.init_reactor(io_threads)
     server = init_tcpros_server(port)
     server.topic_connection_handler = _handler.topic_connection_handler
     server.service_connection_handler = rospy.impl.tcpros_service.service_connection_handler
 
 def get_tcpros_handler():
     return _handler
+
+def get_shmros_handler():
+    return _shmros_handler
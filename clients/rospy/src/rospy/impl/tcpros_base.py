@@ -59,7 +59,7 @@ from rosgraph.network import read_ros_handshake_header, write_ros_handshake_head
 from rospy.core import *
 from rospy.core import logwarn, loginfo, logerr, logdebug, rospydebug, rospyerr, rospywarn
 from rospy.exceptions import ROSInternalException, TransportException, TransportTerminated, TransportInitError
-from rospy.msg import deserialize_messages, serialize_message
+from rospy.msg import deserialize_messages, serialize_message, ReceiveBuffer
 from rospy.service import ServiceException
 
 from rospy.impl.transport import Transport, BIDIRECTIONAL
@@ -95,18 +95,24 @@ def recv_buff(sock, b, buff_size):
     @param sock: socket to read from
     @type  sock: socket.socket
     @param b: buffer to receive into
-    @type  b: StringIO
+    @type  b: L{ReceiveBuffer} or StringIO
     @param buff_size: recv read size
     @type  buff_size: int
     @return: number of bytes read
     @rtype: int
     """
-    d = sock.recv(buff_size)
-    if d:
-        b.write(d)
-        return len(d)
-    else: #bomb out
-        raise TransportTerminated("unable to receive data from sender, check sender's logs for details")
+    if isinstance(b, ReceiveBuffer):
+        # receive directly into the buffer
+        count = b.recv_from(sock, buff_size)
+        if count:
+            return count
+    else:
+        d = sock.recv(buff_size)
+        if d:
+            b.write(d)
+            return len(d)
+    #bomb out
+    raise TransportTerminated("unable to receive data from sender, check sender's logs for details")
 
 class TCPServer(object):
     """
@@ -439,11 +445,10 @@ class TCPROSTransport(Transport):
         self.callerid_pub = 'unknown'
         self.dest_address = None # for reconnection
         
+        self.read_buff = ReceiveBuffer()
         if python3 == 0: # Python 2.x
-            self.read_buff = StringIO()
             self.write_buff = StringIO()
         else: # Python 3.x
-            self.read_buff = BytesIO()
             self.write_buff = BytesIO()
                     	    
         #self.write_buff = StringIO()
@@ -467,6 +472,10 @@ class TCPROSTransport(Transport):
         self.local_endpoint = (None, None)
         self.remote_endpoint = (None, None)
 
+        # I/O loop receiving on this transport, if it has been
+        # registered with the I/O reactor instead of running receive_loop()
+        self.reactor = None
+
     def get_transport_info(self):
         """
         Get detailed connection information.
@@ -730,15 +739,7 @@ class TCPROSTransport(Transport):
                     p.read_messages(b, msg_queue, sock) 
                 if not msg_queue:
                     self.stat_bytes += recv_buff(sock, b, p.buff_size)
-            self.stat_num_msg += len(msg_queue) #STATS
-            # set the _connection_header field
-            for m in msg_queue:
-                m._connection_header = self.header
-                
-            # #1852: keep track of last latched message
-            if self.is_latched and msg_queue:
-                self.latch = msg_queue[-1]
-            
+            self._received_messages(msg_queue)
             return msg_queue
 
         except DeserializationError as e:
@@ -752,6 +753,52 @@ class TCPROSTransport(Transport):
             rospyerr(traceback.format_exc())
             raise TransportException("receive_once[%s]: unexpected error %s"%(self.name, str(e)))
         return retval
+
+    def receive_ready(self):
+        """
+        Read the data available on the socket without blocking, for
+        use when the socket has been reported as readable.
+        @return: list of newly received messages, which may be empty
+        if only part of a message is available
+        @rtype: [Msg]
+        @raise TransportException: if unable to receive message due to error
+        """
+        sock = self.socket
+        if sock is None:
+            raise TransportException("connection not initialized")
+        b = self.read_buff
+        msg_queue = []
+        p = self.protocol
+        try:
+            try:
+                self.stat_bytes += recv_buff(sock, b, p.buff_size)
+            except socket.error as se:
+                if se.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return msg_queue
+                raise
+            if b.tell() >= 4:
+                p.read_messages(b, msg_queue, sock)
+            self._received_messages(msg_queue)
+            return msg_queue
+
+        except DeserializationError as e:
+            rospyerr(traceback.format_exc())
+            raise TransportException("receive_ready[%s]: DeserializationError %s"%(self.name, str(e)))
+        except TransportTerminated as e:
+            raise #reraise
+        except Exception as e:
+            rospyerr(traceback.format_exc())
+            raise TransportException("receive_ready[%s]: unexpected error %s"%(self.name, str(e)))
+
+    def _received_messages(self, msg_queue):
+        self.stat_num_msg += len(msg_queue) #STATS
+        # set the _connection_header field
+        for m in msg_queue:
+            m._connection_header = self.header
+
+        # #1852: keep track of last latched message
+        if self.is_latched and msg_queue:
+            self.latch = msg_queue[-1]
         
     def _reconnect(self):
         # This reconnection logic is very hacky right now.  I need to
@@ -832,6 +879,8 @@ class TCPROSTransport(Transport):
         """close i/o and release resources"""
         if not self.done:
             try:
+                if self.reactor is not None:
+                    self.reactor.call_soon(self.reactor.remove, self, self.socket)
                 if self.socket is not None:
                     try:
                         self.socket.shutdown(socket.SHUT_RDWR)
@@ -34,6 +34,9 @@
 
 """Internal use: Topic-specific extensions for TCPROS support"""
 
+import collections
+import errno
+import itertools
 import socket
 import threading
 import time
@@ -47,6 +50,7 @@ from rospy.core import logwarn, logerr, logdebug, rospyerr
 import rospy.exceptions
 import rospy.names
 
+import rospy.impl.reactor
 import rospy.impl.registration
 import rospy.impl.transport
 
@@ -154,9 +158,10 @@ class TCPROSPub(TCPROSTransportProtocol):
             base.update(self.headers)
         return base
 
-def robust_connect_subscriber(conn, dest_addr, dest_port, pub_uri, receive_cb, resolved_topic_name):
+def robust_connect_subscriber(conn, dest_addr, dest_port, pub_uri, receive_cb, resolved_topic_name, reactor=None):
     """
-    Keeps trying to create connection for subscriber.  Then passes off to receive_loop once connected.
+    Keeps trying to create connection for subscriber.  Then passes off to receive_loop once connected,
+    or registers the connection with the I/O reactor if one is given.
     """
     # kwc: this logic is not very elegant.  I am waiting to rewrite
     # the I/O loop with async i/o to clean this up.
@@ -182,7 +187,10 @@ def robust_connect_subscriber(conn, dest_addr, dest_port, pub_uri, receive_cb, r
             conn.done = not check_if_still_publisher(resolved_topic_name, pub_uri)
 	
     if not conn.done:
-        conn.receive_loop(receive_cb)	    
+        if reactor is not None:
+            reactor.register(conn, receive_cb)
+        else:
+            conn.receive_loop(receive_cb)
 
 def check_if_still_publisher(resolved_topic_name, pub_uri):
     try:
@@ -206,6 +214,24 @@ class TCPROSHandler(rospy.impl.transport.ProtocolHandler):
     def __init__(self):
         """ctor"""
         self.tcp_nodelay_map = {} # { topic : tcp_nodelay}
+        self.reactor = None
+        # protocols layered on TCPROS connections, selected by the 'protocol'
+        # header field of subscribers: { protocol : fn(resolved_name, pub_impl) -> transport }
+        self.pub_transport_factories = {}
+
+    def init_reactor(self, num_threads):
+        """
+        Receive on subscriber connections using an I/O reactor with
+        num_threads threads, rather than a thread per connection.
+        Only affects connections created after this is called.
+        @param num_threads: number of I/O threads
+        @type  num_threads: int
+        """
+        if not rospy.impl.reactor.is_reactor_supported():
+            logwarn("I/O reactor is not supported on this platform, using a thread per connection")
+            return
+        if self.reactor is None:
+            self.reactor = rospy.impl.reactor.IOReactor(num_threads)
     
     def set_tcp_nodelay(self, resolved_name, tcp_nodelay):
         """
@@ -252,9 +278,25 @@ class TCPROSHandler(rospy.impl.transport.ProtocolHandler):
                              queue_size=sub.queue_size, buff_size=sub.buff_size,
                              tcp_nodelay=sub.tcp_nodelay)
         conn = TCPROSTransport(protocol, resolved_name)
+        return self.start_subscriber(conn, sub, pub_uri, dest_addr, dest_port)
+
+    def start_subscriber(self, conn, sub, pub_uri, dest_addr, dest_port):
+        """
+        Add a new subscriber connection to its subscription and start
+        connecting it to the publisher.
+        @param conn: unconnected subscriber transport
+        @type  conn: L{TCPROSTransport}
+        @param sub: subscription
+        @type  sub: L{rospy.topics._SubscriberImpl}
+        @param pub_uri: XML-RPC URI of publisher
+        @type  pub_uri: str
+        @return: code, message, debug
+        @rtype: (int, str, int)
+        """
+        resolved_name = conn.name
         conn.set_endpoint_id(pub_uri);
 
-        t = threading.Thread(name=resolved_name, target=robust_connect_subscriber, args=(conn, dest_addr, dest_port, pub_uri, sub.receive_callback,resolved_name))
+        t = threading.Thread(name=resolved_name, target=robust_connect_subscriber, args=(conn, dest_addr, dest_port, pub_uri, sub.receive_callback,resolved_name, self.reactor))
         # don't enable this just yet, need to work on this logic
         #rospy.core._add_shutdown_thread(t)
 
@@ -359,45 +401,159 @@ class TCPROSHandler(rospy.impl.transport.ProtocolHandler):
                     tcp_nodelay = self.tcp_nodelay_map.get(resolved_topic_name, False)
 
                 _configure_pub_socket(sock, tcp_nodelay)
-                protocol = TCPROSPub(resolved_topic_name, topic.data_class, is_latch=topic.is_latch, headers=topic.headers)
-                transport = TCPROSTransport(protocol, resolved_topic_name)
+                factory = self.pub_transport_factories.get(header.get('protocol'))
+                if factory is not None:
+                    transport = factory(resolved_topic_name, topic)
+                else:
+                    protocol = TCPROSPub(resolved_topic_name, topic.data_class, is_latch=topic.is_latch, headers=topic.headers)
+                    transport = TCPROSTransport(protocol, resolved_topic_name)
                 transport.set_socket(sock, header['callerid'])
                 transport.remote_endpoint = client_addr
                 transport.write_header()
                 topic.add_connection(transport)
             
 
+# maximum number of threads relaying the data of QueuedConnections
+DEFAULT_SENDER_THREADS = 8
+# maximum number of messages relayed for a connection before
+# moving on to the next connection with queued data
+_SENDER_BATCH_SIZE = 16
+# seconds without any connection drained, while others are waiting,
+# after which the pool threads are considered blocked
+_STALL_TIMEOUT = 0.5
+
+class _SenderPool(object):
+    """
+    Threads relaying the data queued on L{QueuedConnection}s. Connections
+    with queued data wait in a ready queue and are drained in turn, a
+    batch of messages at a time, by max_threads threads, which are
+    started as needed.
+
+    Writes to a subscriber that stops reading block the thread relaying
+    them. If all the threads are blocked, so that no connection is
+    drained for _STALL_TIMEOUT while others are waiting, one more thread
+    is started. Threads beyond max_threads exit once they are idle.
+    """
+
+    def __init__(self, max_threads=DEFAULT_SENDER_THREADS):
+        self.max_threads = max_threads
+        self._cond = threading.Condition()
+        self._ready = collections.deque()
+        self._num_threads = 0
+        self._num_idle = 0
+        # number of _drain() calls completed, to detect blocked threads
+        self._num_drained = 0
+        self._watching = False
+
+    def schedule(self, connection):
+        """
+        Queue connection for relaying. A connection must not be
+        scheduled again until its _drain() has returned.
+        @param connection: connection with queued data
+        @type  connection: L{QueuedConnection}
+        """
+        with self._cond:
+            self._ready.append(connection)
+            if self._num_idle:
+                self._cond.notify()
+                return
+            if self._num_threads >= self.max_threads:
+                if not self._watching:
+                    self._watching = True
+                    t = threading.Thread(target=self._watch, name='rospy.sender-watch')
+                    t.daemon = True
+                    t.start()
+                return
+        self._start_thread()
+
+    def _start_thread(self):
+        with self._cond:
+            self._num_threads += 1
+            name = 'rospy.sender-%d'%self._num_threads
+        t = threading.Thread(target=self._run, name=name)
+        t.daemon = True
+        t.start()
+
+    def _watch(self):
+        with self._cond:
+            num_drained = self._num_drained
+        while True:
+            time.sleep(_STALL_TIMEOUT)
+            with self._cond:
+                if not self._ready or self._num_idle:
+                    self._watching = False
+                    return
+                stalled = self._num_drained == num_drained
+                num_drained = self._num_drained
+            if stalled:
+                self._start_thread()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._ready:
+                    if self._num_threads > self.max_threads:
+                        self._num_threads -= 1
+                        return
+                    self._num_idle += 1
+                    self._cond.wait()
+                    self._num_idle -= 1
+                connection = self._ready.popleft()
+            more = connection._drain()
+            with self._cond:
+                self._num_drained += 1
+            if more:
+                # more data was queued, go to the back of the line
+                self.schedule(connection)
+
+_sender_pool = None
+_sender_pool_lock = threading.Lock()
+
+def get_sender_pool():
+    """
+    @return: shared pool relaying the data of L{QueuedConnection}s
+    @rtype: L{_SenderPool}
+    """
+    global _sender_pool
+    with _sender_pool_lock:
+        if _sender_pool is None:
+            _sender_pool = _SenderPool()
+        return _sender_pool
+
 class QueuedConnection(object):
     """
     It wraps a Transport instance and behaves like one
     but it queues the data written to it and relays them
-    asynchronously to the wrapped instance.
+    asynchronously to the wrapped instance, using the shared
+    sender pool.
     """
 
-    def __init__(self, connection, queue_size):
+    def __init__(self, connection, queue_size, pool=None):
         """
         ctor.
         @param connection: the wrapped transport instance
         @type  connection: Transport
         @param queue_size: the maximum size of the queue, zero means infinite
         @type  queue_size: int
+        @param pool: (optional) sender pool, defaults to the shared one
+        @type  pool: L{_SenderPool}
         """
         super(QueuedConnection, self).__init__()
         self._connection = connection
         self._queue_size = queue_size
+        self._pool = pool if pool is not None else get_sender_pool()
 
         self._lock = threading.Lock()
-        self._cond_data_available = threading.Condition(self._lock)
         self._connection.set_cleanup_callback(self._closed_connection_callback)
-        self._queue = []
+        # drops the oldest data itself when queue_size is reached
+        self._queue = collections.deque(maxlen=queue_size if queue_size > 0 else None)
         self._error = None
-
-        self._thread = threading.Thread(target=self._run)
-        self._thread.start()
+        # True while the connection is waiting in or being drained by the pool
+        self._scheduled = False
 
     def _closed_connection_callback(self, connection):
         with self._lock:
-            self._cond_data_available.notify()
+            self._queue.clear()
 
     def __getattr__(self, name):
         if name.startswith('__'):
@@ -411,30 +567,202 @@ class QueuedConnection(object):
                 error = self._error
                 self._error = None
                 raise error
-            # pop oldest data if queue limit is reached
-            if self._queue_size > 0 and len(self._queue) == self._queue_size:
-                del self._queue[0]
             self._queue.append(data)
-            self._cond_data_available.notify()
-        # effectively yields the rest of the thread quantum
-        time.sleep(0)
+            if self._scheduled:
+                return True
+            self._scheduled = True
+        self._pool.schedule(self)
         return True
 
-    def _run(self):
-        while not self._connection.done:
-            queue = []
-            with self._lock:
-                # wait for available data
-                while not self._queue and not self._connection.done:
-                    self._cond_data_available.wait()
-                # take all data from queue for processing outside of the lock
-                if self._queue:
-                    queue = self._queue
-                    self._queue = []
-            # relay all data
-            for data in queue:
-                try:
-                    self._connection.write_data(data)
-                except Exception as e:
-                    with self._lock:
-                        self._error = e
+    def _drain(self):
+        """
+        Relay a batch of queued data. Called by the sender pool.
+        @return: True if more data is queued, in which case the
+        connection must be scheduled again
+        @rtype: bool
+        """
+        with self._lock:
+            queue = self._queue
+            batch = [queue.popleft() for _ in range(min(len(queue), _SENDER_BATCH_SIZE))]
+        # relay data outside of the lock
+        for data in batch:
+            if self._connection.done:
+                break
+            try:
+                self._connection.write_data(data)
+            except Exception as e:
+                with self._lock:
+                    self._error = e
+        with self._lock:
+            if self._queue and not self._connection.done:
+                return True
+            self._queue.clear()
+            self._scheduled = False
+            return False
+
+# policies for outbound connections whose send queue is full
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+DISCONNECT = 'disconnect'
+
+# maximum number of buffers passed to a single sendmsg() call
+_IOV_MAX = 64
+
+class AsyncConnection(object):
+    """
+    It wraps a TCPROS transport instance and behaves like one, but
+    queues the data written to it, which an I/O reactor thread sends
+    with non-blocking writes as the socket accepts it. Unlike
+    L{QueuedConnection} it needs no thread of its own, and a slow
+    subscriber only fills its own queue.
+    """
+
+    def __init__(self, connection, loop, queue_size=None, max_queued_bytes=None, drop_policy=DROP_OLDEST):
+        """
+        ctor.
+        @param connection: the wrapped transport instance
+        @type  connection: L{TCPROSTransport}
+        @param loop: I/O reactor loop sending the data
+        @type  loop: L{rospy.impl.reactor._IOLoop}
+        @param queue_size: maximum number of queued messages, zero or None means infinite
+        @type  queue_size: int
+        @param max_queued_bytes: maximum number of queued bytes, zero
+        or None means infinite. A message larger than this is still
+        queued if the queue is otherwise empty.
+        @type  max_queued_bytes: int
+        @param drop_policy: what to do with new messages when the
+        queue is full: DROP_OLDEST drops the oldest messages not yet
+        being sent, DROP_NEWEST drops the new message, DISCONNECT
+        closes the connection
+        @type  drop_policy: str
+        @raise ValueError: if drop_policy is invalid
+        """
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST, DISCONNECT):
+            raise ValueError("invalid drop policy [%s]"%drop_policy)
+        super(AsyncConnection, self).__init__()
+        self._connection = connection
+        self._loop = loop
+        self._queue_size = queue_size or 0
+        self._max_queued_bytes = max_queued_bytes or 0
+        self._drop_policy = drop_policy
+
+        self._lock = threading.Lock()
+        self._queue = collections.deque()
+        self._queued_bytes = 0
+        # number of bytes of the first queued message already sent
+        self._offset = 0
+        # whether the loop has been asked to send the queue
+        self._pending = False
+        self._error = None
+        #STATS
+        self.stat_dropped = 0
+
+        self._sock = connection.socket
+        self._sock.setblocking(0)
+        self._connection.set_cleanup_callback(self._closed_connection_callback)
+
+    def _closed_connection_callback(self, connection):
+        with self._lock:
+            self._queue.clear()
+            self._queued_bytes = self._offset = 0
+        self._loop.call_soon(self._loop.remove_writer, self, self._sock)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self._connection, name)
+
+    def _is_full(self, size):
+        queue = self._queue
+        # a message that is partially sent no longer counts as queued
+        if self._queue_size and len(queue) - (1 if self._offset else 0) >= self._queue_size:
+            return True
+        return bool(self._max_queued_bytes and queue and self._queued_bytes - self._offset + size > self._max_queued_bytes)
+
+    def write_data(self, data):
+        disconnect = schedule = False
+        with self._lock:
+            # if there was previously an error within the I/O thread raise it
+            if self._error:
+                error = self._error
+                self._error = None
+                raise error
+            if self._connection.done:
+                raise rospy.exceptions.TransportTerminated("connection closed")
+            queue = self._queue
+            if self._is_full(len(data)):
+                if self._drop_policy == DROP_NEWEST:
+                    self.stat_dropped += 1
+                    return True
+                elif self._drop_policy == DISCONNECT:
+                    disconnect = True
+                else:
+                    # a message that is partially sent cannot be dropped
+                    first = 1 if self._offset else 0
+                    while len(queue) > first and self._is_full(len(data)):
+                        self._queued_bytes -= len(queue[first])
+                        del queue[first]
+                        self.stat_dropped += 1
+            if not disconnect:
+                queue.append(data)
+                self._queued_bytes += len(data)
+                schedule = not self._pending
+                self._pending = True
+        if disconnect:
+            logdebug("[%s]: closing connection [%s], send queue is full", self._connection.name, self._connection.endpoint_id)
+            self._connection.close()
+            raise rospy.exceptions.TransportTerminated("send queue of connection [%s] is full"%self._connection.endpoint_id)
+        if schedule:
+            self._loop.call_soon(self._loop.add_writer, self)
+        return True
+
+    def handle_write(self):
+        """
+        Send as much of the queued data as the socket accepts without
+        blocking. Called by the I/O loop.
+        @return: True if data remains to be sent
+        @rtype: bool
+        """
+        connection = self._connection
+        with self._lock:
+            queue = self._queue
+            if not queue or connection.done:
+                self._pending = False
+                return False
+            buffs = list(itertools.islice(queue, _IOV_MAX))
+            offset = self._offset
+            if offset:
+                buffs[0] = memoryview(buffs[0])[offset:]
+            try:
+                if hasattr(self._sock, 'sendmsg'):
+                    sent = self._sock.sendmsg(buffs)
+                else:
+                    sent = self._sock.send(buffs[0])
+            except socket.error as se:
+                if se.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return True
+                self._error = rospy.exceptions.TransportTerminated(str(se))
+                self._pending = False
+                queue.clear()
+                self._queued_bytes = self._offset = 0
+                error = se
+            else:
+                error = None
+                connection.stat_bytes += sent
+                while sent:
+                    left = len(queue[0]) - offset
+                    if sent < left:
+                        offset += sent
+                        break
+                    sent -= left
+                    self._queued_bytes -= len(queue.popleft())
+                    offset = 0
+                    connection.stat_num_msg += 1
+                self._offset = offset
+                if not queue:
+                    self._pending = False
+                    return False
+                return True
+        logdebug("[%s]: closing connection [%s] due to socket error: %s", connection.name, connection.endpoint_id, error)
+        connection.close()
+        return False
@@ -194,6 +194,25 @@ class ProtocolHandler(object): #interface
     ##     list where the first element is the string identifier for the protocol.
     def get_supported(self):
         return []
+
+    ## This method is called on subscribers and returns the protocol
+    ## list for a connection to \a pub_uri. Protocols that need
+    ## resources for each connection, e.g. a socket, allocate them
+    ## here and release them in end_negotiation().
+    ## @param self
+    ## @param topic str: name of topic
+    ## @param pub_uri str: publisher API URI
+    ## @return [[str, val*]]: list of supported protocol params
+    def get_supported_for(self, topic, pub_uri):
+        return self.get_supported()
+
+    ## Called on subscribers once negotiation with \a pub_uri is
+    ## over, whether or not a transport was created.
+    ## @param self
+    ## @param topic str: name of topic
+    ## @param pub_uri str: publisher API URI
+    def end_negotiation(self, topic, pub_uri):
+        pass
         
     ## Prepare a transport based on one of the supported protocols
     ## declared by a Subscriber. Subscribers supply a list of
@@ -32,68 +32,143 @@
 #
 # Revision $Id$
 
-from __future__ import print_function
-
 """
 UDPROS connection protocol.
+
+Implements U{http://ros.org/wiki/ROS/UDPROS}, compatible with roscpp.
+
+Subscribers ask for UDPROS in requestTopic with their connection
+header and the port of a UDP socket they opened for the connection.
+The publisher answers with a connection id and its own connection
+header, and then sends each message, as framed for TCPROS, in
+datagrams of at most max_datagram_size bytes. Each datagram starts
+with an 8-byte header::
+
+  connection id (uint32), op (uint8), message id (uint8), block (uint16)
+
+where op is DATA0 for the first datagram of a message, whose block
+is the number of datagrams of the message, and DATAN for the
+following ones, whose block is their index. A message that is missing
+any of its datagrams, or receives them out of order, is dropped.
 """
-## UDPROS connection protocol.
-#  http://ros.org/wiki/ROS/UDPROS
-# 
 
+import errno
+import logging
+import socket
+import struct
+import threading
+import traceback
+
+try:
+    from xmlrpc.client import Binary  # Python 3.x
+except ImportError:
+    from xmlrpclib import Binary  # Python 2.x
+
+import genpy
 import rosgraph.network
+from rosgraph.network import encode_ros_handshake_header, decode_ros_handshake_header
 
+import rospy.names
 import rospy.impl.registration
 import rospy.impl.transport
 
+from rospy.core import is_shutdown, logdebug, rospydebug, rospyerr
+from rospy.exceptions import TransportTerminated
+
+logger = logging.getLogger('rospy.udpros')
+
+UDPROS = 'UDPROS'
+
+# same default as roscpp
+DEFAULT_MAX_DATAGRAM_SIZE = 1500
+# UDP payload limit
+_MAX_DATAGRAM_SIZE = 65507
+
+# datagram header ops
+_DATA0 = 0
+_DATAN = 1
+
+_struct_header = struct.Struct('<IBBH')
+_struct_I = struct.Struct('<I')
+
+# Seconds between checks for shutdown while waiting for datagrams
+_RECV_TIMEOUT = 1.0
+
 def get_max_datagram_size():
-    #TODO
-    return 1024
+    """
+    @return: maximum size of the datagrams requested by subscribers, in bytes
+    @rtype: int
+    """
+    return DEFAULT_MAX_DATAGRAM_SIZE
+
+_connection_id = 0
+_connection_id_lock = threading.Lock()
+def _next_connection_id():
+    global _connection_id
+    with _connection_id_lock:
+        _connection_id = (_connection_id + 1) & 0xffffffff
+        return _connection_id
+
+def _encode_header(fields):
+    # XML-RPC parameters carry the header fields without the length of the whole header
+    return encode_ros_handshake_header(fields)[4:]
 
-class UDPROSHandler(rospy.transport.ProtocolHandler):
+def _decode_header(data):
+    data = getattr(data, 'data', data) # xmlrpc Binary
+    return decode_ros_handshake_header(_struct_I.pack(len(data)) + data)
+
+def _create_socket():
+    if rosgraph.network.use_ipv6():
+        return socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+    return socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+class UDPROSHandler(rospy.impl.transport.ProtocolHandler):
     """
-    rospy protocol handler for UDPROS. Stores the datagram server if necessary.
+    rospy protocol handler for UDPROS. Subscribers only request
+    UDPROS if they were created with udp=True.
     """
-    
-    def __init__(self, port=0):
+
+    def __init__(self):
         """
         ctor
         """
-        self.port = port
-        self.buff_size = get_max_datagram_size()
-        
-    def init_server(self):
+        self._lock = threading.Lock()
+        # sockets of subscriber connections being negotiated: { (topic, pub_uri) : socket }
+        self._pending = {}
+
+    def shutdown(self):
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for sock in pending:
+            sock.close()
+
+    def get_supported_for(self, resolved_name, pub_uri):
         """
-        Initialize and start the server thread, if not already initialized.
+        Open the UDP socket of a new subscriber connection, if the
+        subscriber asked for UDPROS.
         """
-        if self.server is not None:
-            return
-        if rosgraph.network.use_ipv6():
-            s = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
-        else:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) 
-        s.bind((rosgraph.network.get_bind_address(), self.port))
-        if self.port == 0:
-            self.port = s.getsockname()[1]
-        self.server = s
-        threading.start_new_thread(self.run, ())
-
-    def run(self):
-        buff_size = self.buff_size
-        try:
-            while not rospy.core.is_shutdown():
-                data = self.server.recvfrom(self.buff_size)
-                print("received packet")
-                #TODO
-        except:
-            #TODO: log
-            pass
+        sub = rospy.impl.registration.get_topic_manager().get_subscriber_impl(resolved_name)
+        if sub is None or not sub.udp:
+            return []
+        sock = _create_socket()
+        sock.bind((rosgraph.network.get_bind_address(), 0))
+        self.end_negotiation(resolved_name, pub_uri)
+        with self._lock:
+            self._pending[(resolved_name, pub_uri)] = sock
+        header = _encode_header({'topic': resolved_name,
+                                 'md5sum': sub.data_class._md5sum,
+                                 'type': sub.data_class._type,
+                                 'callerid': rospy.names.get_caller_id()})
+        return [[UDPROS, Binary(header), rosgraph.network.get_host_name(), sock.getsockname()[1], get_max_datagram_size()]]
 
-    def shutdown(self):
-        if self.sock is not None:
-            self.sock.close()
+    def end_negotiation(self, resolved_name, pub_uri):
+        with self._lock:
+            sock = self._pending.pop((resolved_name, pub_uri), None)
+        if sock is not None:
+            sock.close()
 
-    def create_transport(self, topic_name, pub_uri, protocol_params):
+    def create_transport(self, resolved_name, pub_uri, protocol_params):
         """
         Connect to topic resolved_name on Publisher pub_uri using UDPROS.
         @param resolved_name str: resolved topic name
@@ -106,33 +181,46 @@ class UDPROSHandler(rospy.transport.ProtocolHandler):
         @rtype: (int, str, int)
         """
 
-        #Validate protocol params = [UDPROS, address, port, headers]
-        if type(protocol_params) != list or len(protocol_params) != 4:
+        #Validate protocol params = [UDPROS, address, port, connection_id, max_datagram_size, header]
+        if type(protocol_params) != list or len(protocol_params) != 6:
             return 0, "ERROR: invalid UDPROS parameters", 0
         if protocol_params[0] != UDPROS:
-            return 0, "INTERNAL ERROR: protocol id is not UDPROS: %s"%id, 0
+            return 0, "INTERNAL ERROR: protocol id is not UDPROS: %s"%protocol_params[0], 0
+        _, dest_addr, dest_port, connection_id, max_datagram_size, header = protocol_params
 
-        #TODO: get connection_id and buffer size from params
-        id, dest_addr, dest_port, headers = protocol_params
-
-        self.init_server()
-        
-        #TODO: parse/validate headers
+        with self._lock:
+            sock = self._pending.pop((resolved_name, pub_uri), None)
+        if sock is None:
+            return 0, "ERROR: no UDPROS connection to [%s] was requested for [%s]"%(pub_uri, resolved_name), 0
+        try:
+            header = _decode_header(header)
+        except Exception as e:
+            sock.close()
+            return 0, "ERROR: invalid UDPROS connection header: %s"%e, 0
+        sub = rospy.impl.registration.get_topic_manager().get_subscriber_impl(resolved_name)
+        error = None
+        if 'error' in header:
+            error = "remote error reported: %s"%header['error']
+        elif sub is None:
+            error = "no subscriber for topic [%s]"%resolved_name
+        elif header.get('md5sum') not in (sub.data_class._md5sum, rospy.names.TOPIC_ANYTYPE) and \
+                sub.data_class._md5sum != rospy.names.TOPIC_ANYTYPE:
+            error = "md5sums do not match: [%s] vs. [%s]"%(header.get('md5sum'), sub.data_class._md5sum)
+        if error:
+            sock.close()
+            return 0, "ERROR: %s"%error, 0
 
-        sub = rospy.registration.get_topic_manager().get_subscriber_impl(topic_name)
-        # Create Transport
-        
-        # TODO: create just a single 'connection' instance to represent
-        # all UDP connections. 'connection' can take care of unifying
-        # publication if addresses are the same
-        transport = UDPTransport(protocol, topic_name, sub.receive_callback) 
-        
-        # Attach connection to _SubscriberImpl
-        if sub.add_connection(transport): #pass udp connection to handler
-            return 1, "Connected topic[%s]. Transport impl[%s]"%(topic_name, transport.__class__.__name__), dest_port
+        transport = UDPROSTransport(rospy.impl.transport.INBOUND, resolved_name, sock, connection_id, max_datagram_size, sub.data_class, header)
+        transport.endpoint_id = pub_uri
+        transport.remote_endpoint = (dest_addr, dest_port)
+        t = threading.Thread(name=resolved_name, target=transport.receive_loop, args=(sub.receive_callback,))
+        t.daemon = True
+        if sub.add_connection(transport):
+            t.start()
+            return 1, "Connected topic[%s]. Transport impl[%s]"%(resolved_name, transport.__class__.__name__), dest_port
         else:
             transport.close()
-            return 0, "ERROR: Race condition failure: duplicate topic subscriber [%s] was created"%(topic_name), 0
+            return 0, "ERROR: Race condition failure: duplicate topic subscriber [%s] was created"%(resolved_name), 0
 
     def supports(self, protocol):
         """
@@ -145,11 +233,12 @@ class UDPROSHandler(rospy.transport.ProtocolHandler):
     
     def get_supported(self):
         """
-        Get supported protocols
+        Get supported protocols. UDPROS parameters are specific to
+        each connection, see L{get_supported_for()}.
         """
-        return [[UDPROS]]
+        return []
         
-    def init_publisher(self, topic_name, protocol_params): 
+    def init_publisher(self, resolved_name, protocol_params):
         """
         Initialize this node to start publishing to a new UDP location.
         
@@ -159,147 +248,269 @@ class UDPROSHandler(rospy.transport.ProtocolHandler):
         @param protocol_params: requested protocol
           parameters. protocol[0] must be the string 'UDPROS'
         @type  protocol_params: [str, value*]
-        @return: (code, msg, [UDPROS, addr, port])
+        @return: (code, msg, [UDPROS, addr, port, connection_id, max_datagram_size, header])
         @rtype: (int, str, list)
         """
-
         if protocol_params[0] != UDPROS:
-            return 0, "Internal error: protocol does not match UDPROS: %s"%protocol, []
-        #TODO
-        _, header, host, port, max_datagram_size = protocol_params
-        #TODO: connection_id, max_datagraph_size
-        return 1, "ready", [UDPROS]
-
-    def topic_connection_handler(self, sock, client_addr, header):
-        """
-        Process incoming topic connection. Reads in topic name from
-        handshake and creates the appropriate L{TCPROSPub} handler for the
-        connection.
-        @param sock: socket connection
-        @type sock: socket.socket
-        @param client_addr: client address
-        @type client_addr: (str, int)
-        @param header: key/value pairs from handshake header
-        @type header: dict
-        @return: error string or None 
-        @rtype: str
-        """
-        for required in ['topic', 'md5sum', 'callerid']:
+            return 0, "Internal error: protocol does not match UDPROS: %s"%protocol_params[0], []
+        #Validate protocol params = [UDPROS, header, address, port, max_datagram_size]
+        if len(protocol_params) != 5:
+            return 0, "ERROR: invalid UDPROS parameters", []
+        _, header, dest_addr, dest_port, max_datagram_size = protocol_params
+        try:
+            header = _decode_header(header)
+        except Exception as e:
+            return 0, "ERROR: invalid UDPROS connection header: %s"%e, []
+        for required in ['md5sum', 'callerid']:
             if not required in header:
-                return "Missing required '%s' field"%required
-        else:
-            resolved_topic_name = header['topic']
-            md5sum = header['md5sum']
-            tm = rospy.registration.get_topic_manager()
-            topic = tm.get_publisher_impl(resolved_topic_name)
-            if not topic:
-                return "[%s] is not a publisher of  [%s]. Topics are %s"%(rospy.names.get_caller_id(), resolved_topic_name, tm.get_publications())
-            elif md5sum != rospy.names.TOPIC_ANYTYPE and md5sum != topic.data_class._md5sum:
-
-                actual_type = topic.data_class._type
-
-                # check to see if subscriber sent 'type' header. If they did, check that
-                # types are same first as this provides a better debugging message
-                if 'type' in header:
-                    requested_type = header['type']
-                    if requested_type != actual_type:
-                        return "topic types do not match: [%s] vs. [%s]"%(requested_type, actual_type)
-                else:
-                    # defaults to actual type
-                    requested_type = actual_type
-
-                return "Client [%s] wants topic [%s] to have datatype/md5sum [%s/%s], but our version has [%s/%s] Dropping connection."%(header['callerid'], resolved_topic_name, requested_type, md5sum, actual_type, topic.data_class._md5sum)
-
-            else:
-                #TODO:POLLING if polling header is present, have to spin up receive loop as well
-
-                # #1334: tcp_nodelay support from subscriber option
-                if 'tcp_nodelay' in header:
-                    tcp_nodelay = True if header['tcp_nodelay'].strip() == '1' else False
-                else:
-                    tcp_nodelay = self.tcp_nodelay_map.get(resolved_topic_name, False)
-
-                _configure_pub_socket(sock, tcp_nodelay)
-                protocol = TCPROSPub(resolved_topic_name, topic.data_class, is_latch=topic.is_latch, headers=topic.headers)
-                transport = TCPROSTransport(protocol, resolved_topic_name)
-                transport.set_socket(sock, header['callerid'])
-                transport.write_header()
-                topic.add_connection(transport)
-            
-    
+                return 0, "Missing required '%s' field"%required, []
+
+        pub = rospy.impl.registration.get_topic_manager().get_publisher_impl(resolved_name)
+        if not pub or not pub.data_class or pub.closed:
+            return 0, "[%s] is not a publisher of [%s]"%(rospy.names.get_caller_id(), resolved_name), []
+        data_class = pub.data_class
+        md5sum = header['md5sum']
+        if md5sum != rospy.names.TOPIC_ANYTYPE and md5sum != data_class._md5sum:
+            return 0, "Client [%s] wants topic [%s] to have datatype/md5sum [%s/%s], but our version has [%s/%s] Dropping connection."%(header['callerid'], resolved_name, header.get('type', data_class._type), md5sum, data_class._type, data_class._md5sum), []
+        if not 8 < max_datagram_size <= _MAX_DATAGRAM_SIZE:
+            return 0, "ERROR: invalid max_datagram_size [%s]"%max_datagram_size, []
+
+        sock = _create_socket()
+        try:
+            sock.connect((dest_addr, dest_port))
+        except socket.error as e:
+            sock.close()
+            return 0, "ERROR: unable to connect to [%s:%s]: %s"%(dest_addr, dest_port, e), []
+        connection_id = _next_connection_id()
+        transport = UDPROSTransport(rospy.impl.transport.OUTBOUND, resolved_name, sock, connection_id, max_datagram_size)
+        transport.endpoint_id = header['callerid']
+        transport.remote_endpoint = (dest_addr, dest_port)
+        if not pub.add_connection(transport):
+            transport.close()
+            return 0, "ERROR: publisher of [%s] is closed"%resolved_name, []
+
+        reply = _encode_header({'topic': resolved_name,
+                                'md5sum': data_class._md5sum,
+                                'type': data_class._type,
+                                'callerid': rospy.names.get_caller_id(),
+                                'message_definition': data_class._full_text,
+                                'latching': '1' if pub.is_latch else '0'})
+        return 1, "ready", [UDPROS, rosgraph.network.get_host_name(), sock.getsockname()[1], connection_id, max_datagram_size, Binary(reply)]
 
 ## UDPROS communication routines
-class UDPROSTransport(rospy.transport.Transport):
+class UDPROSTransport(rospy.impl.transport.Transport):
+    """
+    One end of a UDPROS topic connection, using its own UDP socket
+    """
     transport_type = 'UDPROS'
     
-    def __init__(self, protocol, name, header):
+    def __init__(self, direction, name, sock, connection_id, max_datagram_size, recv_data_class=None, header=None):
         """
         ctor
+        @param direction: INBOUND (subscriber) or OUTBOUND (publisher)
+        @type  direction: str
         @param name: topic name    
-        @type  name: str:
-        @param protocol: protocol implementation    
-        @param protocol: UDPROSTransportProtocol 
-        @param header: handshake header if transport handshake header was
-        already read off of transport.
+        @type  name: str
+        @param sock: UDP socket of the connection. Outbound sockets must
+        be connected, and are made non-blocking.
+        @type  sock: socket.socket
+        @param connection_id: id of the connection in datagram headers
+        @type  connection_id: int
+        @param max_datagram_size: maximum size of datagrams, including their header
+        @type  max_datagram_size: int
+        @param recv_data_class: message class of inbound messages
+        @type  recv_data_class: L{rospy.Message} class
+        @param header: connection header of the publisher (inbound only)
         @type  header: dict
-        @throws TransportInitError: if transport cannot be initialized according to arguments
         """
-        super(UDPROSTransport, self).__init__(protocol.direction, name=name)
-        if not name:
-            raise TransportInitError("Unable to initialize transport: name is not set")
-
-        self.done = False
+        super(UDPROSTransport, self).__init__(direction, name=name)
+        if direction == rospy.impl.transport.OUTBOUND:
+            # drop messages when the send buffer is full rather than
+            # block the publisher
+            sock.setblocking(False)
+        self.socket = sock
+        self.connection_id = connection_id
+        self.max_datagram_size = max_datagram_size
+        self.recv_data_class = recv_data_class
         self.header = header
-            
-    def send_message(self, msg, seq):
-        """
-        Convenience routine for services to send a message across a
-        particular connection. NOTE: write_data is much more efficient
-        if same message is being sent to multiple connections. Not
-        threadsafe.
-        @param msg: message to send
-        @type  msg: Msg
-        @param seq: sequence number for message
-        @type  seq: int
-        @raise TransportException: if error occurred sending message
-        """
-        # this will call write_data(), so no need to keep track of stats
-        serialize_message(self.write_buff, seq, msg)
-        self.write_data(self.write_buff.getvalue())
-        self.write_buff.truncate(0)
+        self.local_endpoint = sock.getsockname()
+        self._fileno = sock.fileno()
+        self._lock = threading.Lock()
+
+        # publisher: id of the last message sent
+        self._message_id = 0
+        # subscriber: datagrams received of the current message
+        self._blocks = []
+        self._num_blocks = 0
+        self._current_id = None
+
+        # #1852 have to hold onto latched messages on subscriber side
+        self.is_latched = bool(header) and header.get('latching', '0') == '1'
+        self.latch = None
+        if header is not None:
+            self.callerid_pub = header.get('callerid', 'unknown')
+
+        #STATS
+        # messages dropped because they could not be sent, or some of
+        # their datagrams were lost
+        self.stat_dropped = 0
+
+    def get_transport_info(self):
+        return "%s connection on port %s to [%s:%s]"%(self.transport_type, self.local_endpoint[1], self.remote_endpoint[0], self.remote_endpoint[1])
+
+    def fileno(self):
+        return self._fileno
 
     def write_data(self, data):
         """
-        Write raw data to transport
-        @raise TransportInitialiationError: could not be initialized
+        Write raw data to transport, split into datagrams
         @raise TransportTerminated: no longer open for publishing
         """
-        # TODO
-        # - cut into packets
-        # write to address
-        pass
-    
+        if self.done:
+            raise TransportTerminated("connection closed")
+        payload_size = self.max_datagram_size - _struct_header.size
+        size = len(data)
+        num_blocks = (size + payload_size - 1) // payload_size
+        if num_blocks > 0xffff:
+            logdebug("[%s]: dropping message of %s bytes, too large for UDPROS", self.name, size)
+            self.stat_dropped += 1
+            return True
+        view = memoryview(data)
+        with self._lock:
+            sock = self.socket
+            # message ids are 1-255, as for roscpp
+            self._message_id = self._message_id % 255 + 1
+            try:
+                for block in range(num_blocks):
+                    header = _struct_header.pack(self.connection_id, _DATA0 if block == 0 else _DATAN,
+                                                 self._message_id, num_blocks if block == 0 else block)
+                    chunk = view[block * payload_size:(block + 1) * payload_size]
+                    if hasattr(sock, 'sendmsg'):
+                        sock.sendmsg([header, chunk])
+                    else:
+                        sock.send(header + chunk.tobytes())
+            except socket.error as se:
+                if se.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                    # the subscriber drops the incomplete message
+                    self.stat_dropped += 1
+                    return True
+                # e.g. ECONNREFUSED: the subscriber has gone away
+                logdebug("[%s]: closing connection [%s] due to socket error: %s", self.name, self.endpoint_id, se)
+                self.close()
+                raise TransportTerminated(str(se))
+            except (AttributeError, ValueError):
+                # socket closed concurrently
+                raise TransportTerminated("connection closed")
+            self.stat_bytes += size
+            self.stat_num_msg += 1
+        return True
+
+    def _receive_datagram(self, buff):
+        """
+        Process one datagram
+        @return: data of the message it completes, if any
+        @rtype: bytes
+        """
+        n = self.socket.recv_into(buff)
+        if n < _struct_header.size:
+            return None
+        connection_id, op, message_id, block = _struct_header.unpack_from(buff)
+        if connection_id != self.connection_id:
+            return None
+        self.stat_bytes += n
+        blocks = self._blocks
+        if op == _DATA0:
+            if blocks:
+                self.stat_dropped += 1
+            blocks = self._blocks = [buff[_struct_header.size:n]]
+            self._num_blocks = block
+            self._current_id = message_id
+        elif op == _DATAN:
+            if not blocks:
+                return None
+            if message_id != self._current_id or block != len(blocks):
+                # lost a datagram: drop the message
+                self.stat_dropped += 1
+                del blocks[:]
+                return None
+            blocks.append(buff[_struct_header.size:n])
+        else:
+            return None
+        if len(blocks) < self._num_blocks:
+            return None
+        data = b''.join(blocks)
+        del blocks[:]
+        return data
+
     def receive_once(self):
         """
-        block until messages are read off of socket
+        block until a message is received
         @return: list of newly received messages
         @rtype: [Msg]
         @raise TransportException: if unable to receive message due to error
         """
-        pass
+        buff = bytearray(self.max_datagram_size)
+        while not self.done and not is_shutdown():
+            try:
+                data = self._receive_datagram(buff)
+            except socket.timeout:
+                continue
+            except (socket.error, AttributeError, ValueError) as e:
+                if self.done:
+                    break
+                raise TransportTerminated("unable to receive data from sender: %s"%e)
+            if data is None:
+                continue
+            (size,) = _struct_I.unpack_from(data)
+            if size != len(data) - 4:
+                self.stat_dropped += 1
+                continue
+            try:
+                msg = self.recv_data_class().deserialize(data[4:])
+            except genpy.DeserializationError as e:
+                rospyerr("[%s]: dropping message from [%s] that cannot be deserialized: %s", self.name, self.endpoint_id, e)
+                self.stat_dropped += 1
+                continue
+            self.stat_num_msg += 1
+            msg._connection_header = self.header
+            # #1852: keep track of last latched message
+            if self.is_latched:
+                self.latch = msg
+            return [msg]
+        return []
 
-    ## Receive messages until shutdown
-    ## @param self
-    ## @param msgs_callback fn([msg]): callback to invoke for new messages received    
     def receive_loop(self, msgs_callback):
-        pass
-    
-    ## close i/o and release resources
-    def close(super):
-        self(UDPROSTransport, self).close()
-        #TODO
-        self.done = True
-    
+        """
+        Receive messages until shutdown
+        @param msgs_callback: callback to invoke for new messages received    
+        @type  msgs_callback: fn([msg])
+        """
+        logger.debug("receive_loop for [%s]", self.name)
+        try:
+            self.socket.settimeout(_RECV_TIMEOUT)
+            while not self.done and not is_shutdown():
+                msgs = self.receive_once()
+                if msgs and not self.done and not is_shutdown():
+                    msgs_callback(msgs, self)
+        except TransportTerminated as e:
+            rospydebug("receive_loop[%s]: %s", self.name, e)
+        except Exception:
+            rospydebug("exception in receive loop for [%s], may be normal. Exception is %s", self.name, traceback.format_exc())
+        finally:
+            if not self.done:
+                self.close()
+
+    def close(self):
+        """close i/o and release resources"""
+        if not self.done:
+            try:
+                with self._lock:
+                    if self.socket is not None:
+                        self.socket.close()
+            finally:
+                self.socket = None
+                super(UDPROSTransport, self).close()
+
 _handler = UDPROSHandler()
 
 def get_handler():
@@ -78,6 +78,120 @@ class AnyMsg(genpy.Message):
         self._buff = str
         return self
 
+_struct_I = struct.Struct('<I')
+
+class ReceiveBuffer(object):
+    """
+    Growable receive buffer backed by a bytearray. Data is received
+    directly into the buffer with socket.recv_into(), and complete
+    messages are deserialized from it by L{deserialize_messages()}
+    without intermediate copies.
+
+    It also provides the file API of the StringIO buffers it replaces
+    (write, read, seek, tell, truncate, getvalue), so handshake and
+    protocol code written against those keeps working. As with those,
+    tell() is the end of the data received so far.
+    """
+
+    def __init__(self, capacity=4096):
+        """
+        @param capacity: initial capacity in bytes
+        @type  capacity: int
+        """
+        self.data = bytearray(capacity)
+        self.size = 0
+        self.pos = 0
+        # total length the buffer must reach for the message at the start
+        # of the buffer to be complete, or 0 if unknown
+        self.expected = 0
+
+    def _reserve(self, n):
+        """
+        Grow the buffer so that it can hold at least n bytes
+        """
+        capacity = len(self.data)
+        if n > capacity:
+            self.data.extend(bytearray(max(n, 2 * capacity) - capacity))
+
+    def recv_from(self, sock, n):
+        """
+        Receive at least up to n bytes from sock at the current
+        position, more if needed to complete the current message.
+        @param sock: socket to read from
+        @type  sock: socket.socket
+        @param n: read size
+        @type  n: int
+        @return: number of bytes read
+        @rtype: int
+        """
+        pos = self.pos
+        n = max(n, self.expected - pos)
+        self._reserve(pos + n)
+        if not hasattr(sock, 'recv_into'):
+            # socket-like objects without recv_into()
+            d = sock.recv(n)
+            self.write(d)
+            return len(d)
+        view = memoryview(self.data)
+        try:
+            count = sock.recv_into(view[pos:pos + n], n)
+        finally:
+            del view
+        self.pos = pos + count
+        if self.pos > self.size:
+            self.size = self.pos
+        return count
+
+    def consume(self, start, pos):
+        """
+        Discard the data between start and pos, moving whatever
+        follows pos back to start.
+        """
+        left = self.pos - pos
+        if left > 0 and pos != start:
+            view = memoryview(self.data)
+            view[start:start + left] = view[pos:pos + left]
+            del view
+        self.pos = self.size = start + max(left, 0)
+
+    def write(self, d):
+        n = len(d)
+        pos = self.pos
+        self._reserve(pos + n)
+        self.data[pos:pos + n] = d
+        self.pos = pos + n
+        if self.pos > self.size:
+            self.size = self.pos
+
+    def read(self, n=-1):
+        pos = self.pos
+        end = self.size if n < 0 else min(self.size, pos + n)
+        if end <= pos:
+            return b''
+        self.pos = end
+        return memoryview(self.data)[pos:end].tobytes()
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += self.size
+        self.pos = pos
+        return pos
+
+    def tell(self):
+        return self.pos
+
+    def truncate(self, size=None):
+        if size is None:
+            size = self.pos
+        if size < self.size:
+            self.size = size
+        return size
+
+    def getvalue(self):
+        return memoryview(self.data)[:self.size].tobytes()
+
 def args_kwds_to_message(data_class, args, kwds):
     """
     Given a data class, take in the args and kwds of a function call and return the appropriate
@@ -180,6 +294,9 @@ def deserialize_messages(b, msg_queue, data_class, queue_size=None, max_msgs=Non
     @type  max_msgs: int
     @raise genpy.DeserializationError: if an error/exception occurs during deserialization
     """    
+    if isinstance(b, ReceiveBuffer):
+        _deserialize_receive_buffer(b, msg_queue, data_class, queue_size, max_msgs, start)
+        return
     try:
         pos = start
         btell = b.tell()
@@ -244,3 +361,42 @@ def deserialize_messages(b, msg_queue, data_class, queue_size=None, max_msgs=Non
         logging.getLogger('rospy.msg').error("cannot deserialize message: EXCEPTION %s", traceback.format_exc())
         raise genpy.DeserializationError("cannot deserialize: %s"%str(e))
 
+def _deserialize_receive_buffer(b, msg_queue, data_class, queue_size, max_msgs, start):
+    """
+    L{deserialize_messages()} for a L{ReceiveBuffer}: the frames are
+    located in place and each message is copied out of the buffer once,
+    as deserialize() may keep references to (slices of) the data.
+    """
+    try:
+        data = b.data
+        pos = start
+        end = b.tell()
+        frames = []
+        b.expected = 0
+        while end - pos >= 4:
+            (size,) = _struct_I.unpack_from(data, pos)
+            if end - pos - 4 < size:
+                # incomplete: once consumed below, this message will start at start
+                b.expected = start + 4 + size
+                break
+            frames.append((pos + 4, pos + 4 + size))
+            pos += 4 + size
+            if max_msgs and len(frames) >= max_msgs:
+                break
+
+        if queue_size is not None:
+            frames = frames[-queue_size:]
+        if frames:
+            view = memoryview(data)
+            try:
+                for first, last in frames:
+                    msg_queue.append(data_class().deserialize(view[first:last].tobytes()))
+            finally:
+                del view
+        if queue_size is not None:
+            del msg_queue[:-queue_size]
+
+        b.consume(start, pos)
+    except Exception as e:
+        logging.getLogger('rospy.msg').error("cannot deserialize message: EXCEPTION %s", traceback.format_exc())
+        raise genpy.DeserializationError("cannot deserialize: %s"%str(e))
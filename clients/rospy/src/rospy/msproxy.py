@@ -41,6 +41,11 @@ dictionary accessors on the parameter server.
 
 from threading import Lock
 
+try:
+    from xmlrpc.client import MultiCall
+except ImportError:
+    from xmlrpclib import MultiCall
+
 import rospy.core
 import rospy.exceptions
 import rospy.names
@@ -88,6 +93,7 @@ class MasterProxy(object):
         """
         self.target = rospy.core.xmlrpcapi(uri)        
         self._lock = Lock()
+        self._unsubscribe_hook_added = False
 
     def __getattr__(self, key): #forward api calls to target
         if key in _master_arg_remap:
@@ -108,34 +114,87 @@ class MasterProxy(object):
 
     def __getitem__(self, key):
         """
-        Fetch item from parameter server and subscribe to future updates so that
-        values can be cached.
+        Fetch item from parameter server.
         @param key: parameter key
         @type key: str
         @raise KeyError: if key is not set
         """
         #NOTE: remapping occurs here!
         resolved_key = rospy.names.resolve_name(key)
-        if 1: # disable param cache
-            with self._lock:
-                code, msg, value = self.target.getParam(rospy.names.get_caller_id(), resolved_key)
-            if code != 1: #unwrap value with Python semantics
-                raise KeyError(key)
-            return value
+        with self._lock:
+            code, msg, value = self.target.getParam(rospy.names.get_caller_id(), resolved_key)
+        if code != 1: #unwrap value with Python semantics
+            raise KeyError(key)
+        return value
 
+    def get_cached(self, key):
+        """
+        Fetch item from the parameter server cache. On first access,
+        subscribe to updates of the parameter so that it is cached.
+        Later accesses to the parameter, or to parameters in its
+        namespace, do not call the master.
+        @param key: parameter key
+        @type key: str
+        @raise KeyError: if key is not set
+        """
+        #NOTE: remapping occurs here!
+        resolved_key = rospy.names.resolve_name(key)
+        cache = rospy.impl.paramserver.get_param_server_cache()
         try:
             # check for value in the parameter server cache
-            return rospy.impl.paramserver.get_param_server_cache().get(resolved_key)
+            value = cache.get_cached(resolved_key)
         except KeyError:
-            # first access, make call to parameter server
-            with self._lock:
-                code, msg, value = self.target.subscribeParam(rospy.names.get_caller_id(), rospy.core.get_node_uri(), resolved_key)
-            if code != 1: #unwrap value with Python semantics
-                raise KeyError(key)
+            node_uri = rospy.core.get_node_uri()
+            if node_uri is None:
+                # cannot receive updates before the node is initialized
+                return self[key]
+            # first access, make call to parameter server. Updates
+            # received until the cache is set are applied to value.
+            cache.subscribing(resolved_key)
+            code = -1
+            try:
+                with self._lock:
+                    code, msg, value = self.target.subscribeParam(rospy.names.get_caller_id(), node_uri, resolved_key)
+            finally:
+                if code != 1:
+                    cache.cancel_subscribing(resolved_key)
+            if code != 1:
+                raise rospy.exceptions.ROSException("cannot subscribe to parameter: %s"%msg)
             # set the value in the cache so that it's marked as subscribed
-            rospy.impl.paramserver.get_param_server_cache().set(resolved_key, value)
-            return value
+            cache.set(resolved_key, value)
+            with self._lock:
+                add_hook = not self._unsubscribe_hook_added
+                self._unsubscribe_hook_added = True
+            if add_hook:
+                rospy.core.add_preshutdown_hook(self._unsubscribe_params)
+            value = cache.get(resolved_key)
+        # an empty dictionary is the value of a parameter that is not set
+        if value == {}:
+            raise KeyError(key)
+        return value
         
+    def _unsubscribe_params(self, reason):
+        """
+        Unsubscribe from the cached parameters on shutdown, so that
+        the master stops sending updates to this node.
+        @param reason: shutdown reason
+        @type  reason: str
+        """
+        keys = rospy.impl.paramserver.get_param_server_cache().clear()
+        node_uri = rospy.core.get_node_uri()
+        if not keys or node_uri is None:
+            return
+        caller_id = rospy.names.get_caller_id()
+        try:
+            multi = MultiCall(self.target)
+            for key in keys:
+                multi.unsubscribeParam(caller_id, node_uri, key)
+            with self._lock:
+                multi()
+        except Exception as e:
+            # e.g. the master has already exited
+            rospy.core.logdebug("unable to unsubscribe from cached parameters: %s", e)
+
     def __setitem__(self, key, val):
         """
         Set parameter value on Parameter Server
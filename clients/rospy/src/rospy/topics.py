@@ -90,11 +90,14 @@ from rospy.core import *
 from rospy.exceptions import ROSSerializationException, TransportTerminated
 from rospy.msg import serialize_message, args_kwds_to_message
 
+from rospy.callback_queue import get_callback_queue
 from rospy.impl.statistics import SubscriberStatisticsLogger
 
 from rospy.impl.registration import get_topic_manager, set_topic_manager, Registration, get_registration_listeners
 from rospy.impl.tcpros import get_tcpros_handler, DEFAULT_BUFF_SIZE
-from rospy.impl.tcpros_pubsub import QueuedConnection
+from rospy.impl.tcpros_pubsub import QueuedConnection, AsyncConnection, DROP_OLDEST, DROP_NEWEST, DISCONNECT
+from rospy.impl.intraprocess import COPY as INTRAPROCESS_COPY, REFERENCE as INTRAPROCESS_REFERENCE, NONE as INTRAPROCESS_NONE, \
+     TRANSPORT_TYPE as INTRAPROCESS, prepare_message as intraprocess_prepare_message
 
 _logger = logging.getLogger('rospy.topics')
 
@@ -512,7 +515,8 @@ class Subscriber(Topic):
     the messages are of a given type.
     """
     def __init__(self, name, data_class, callback=None, callback_args=None,
-                 queue_size=None, buff_size=DEFAULT_BUFF_SIZE, tcp_nodelay=False):
+                 queue_size=None, buff_size=DEFAULT_BUFF_SIZE, tcp_nodelay=False,
+                 callback_queue=None, udp=False):
         """
         Constructor.
 
@@ -558,14 +562,39 @@ class Subscriber(Topic):
           message data. Setting tcp_nodelay to True enables TCP_NODELAY
           for all subscribers in the same python process.
         @type  tcp_nodelay: bool
+        @param callback_queue: (optional) callback queue, or name of
+          the callback queue (see L{rospy.get_callback_queue()}), whose
+          threads invoke callback instead of the thread receiving the
+          message. queue_size then limits the number of messages of
+          this subscriber waiting in the callback queue rather than
+          being applied when messages are received, and only
+          affects this subscriber.
+        @type  callback_queue: L{rospy.CallbackQueue} or str
+        @param udp: if True, request UDPROS from publishers, falling
+          back to TCPROS with publishers that do not support it. UDPROS
+          has lower latency, but messages with lost datagrams are
+          dropped. Setting udp to True affects all subscribers to this
+          topic in this process.
+        @type  udp: bool
         @raise ROSException: if parameters are invalid
         """
         super(Subscriber, self).__init__(name, data_class, Registration.SUB)
         #add in args that factory cannot pass in
 
+        self._subscription = None
+        if callback_queue is not None and callback is not None:
+            if queue_size == -1:
+                queue_size = None
+            elif queue_size == 0:
+                raise ROSException("queue size may not be set to zero")
+            elif queue_size is not None and type(queue_size) != int:
+                raise ROSException("queue size must be an integer")
+            if isstring(callback_queue):
+                callback_queue = get_callback_queue(callback_queue)
+            self._subscription = callback_queue.subscribe(self.resolved_name, callback, callback_args, queue_size)
         # last person to set these to non-defaults wins, not much way
         # around this
-        if queue_size is not None:
+        elif queue_size is not None:
             self.impl.set_queue_size(queue_size)
         if buff_size != DEFAULT_BUFF_SIZE:
             self.impl.set_buff_size(buff_size)
@@ -574,7 +603,10 @@ class Subscriber(Topic):
             # #1852
             # it's important that we call add_callback so that the
             # callback can be invoked with any latched messages
-            self.impl.add_callback(callback, callback_args)
+            if self._subscription is not None:
+                self.impl.add_callback(self._subscription.put, None)
+            else:
+                self.impl.add_callback(callback, callback_args)
             # save arguments for unregister
             self.callback = callback
             self.callback_args = callback_args
@@ -583,6 +615,8 @@ class Subscriber(Topic):
             self.callback = self.callback_args = None            
         if tcp_nodelay:
             self.impl.set_tcp_nodelay(tcp_nodelay)        
+        if udp:
+            self.impl.set_udp(udp)
 
     def unregister(self):
         """
@@ -592,7 +626,11 @@ class Subscriber(Topic):
         if self.impl:
             # It's possible to have a Subscriber instance with no
             # associated callback
-            if self.callback is not None:
+            if self._subscription is not None:
+                self.impl.remove_callback(self._subscription.put, None)
+                self._subscription.close()
+                self._subscription = None
+            elif self.callback is not None:
                 self.impl.remove_callback(self.callback, self.callback_args)
             self.callback = self.callback_args = None
             super(Subscriber, self).unregister()
@@ -617,6 +655,7 @@ class _SubscriberImpl(_TopicImpl):
         self.queue_size = None
         self.buff_size = DEFAULT_BUFF_SIZE
         self.tcp_nodelay = False
+        self.udp = False
         self.statistics_logger = SubscriberStatisticsLogger(self) \
             if SubscriberStatisticsLogger.is_enabled() \
             else None
@@ -638,6 +677,13 @@ class _SubscriberImpl(_TopicImpl):
         supports it.
         """
         self.tcp_nodelay = tcp_nodelay
+
+    def set_udp(self, udp):
+        """
+        Request UDPROS for future topic connections, if the publisher
+        supports it.
+        """
+        self.udp = udp
         
     def set_queue_size(self, queue_size):
         """
@@ -809,7 +855,8 @@ class Publisher(Topic):
     Class for registering as a publisher of a ROS topic.
     """
 
-    def __init__(self, name, data_class, subscriber_listener=None, tcp_nodelay=False, latch=False, headers=None, queue_size=None):
+    def __init__(self, name, data_class, subscriber_listener=None, tcp_nodelay=False, latch=False, headers=None, queue_size=None,
+                 max_queued_bytes=None, drop_policy=DROP_OLDEST, intraprocess=INTRAPROCESS_COPY):
         """
         Constructor
         @param name: resource name of topic, e.g. 'laser'. 
@@ -837,6 +884,24 @@ class Publisher(Topic):
         publishing will happen synchronously and a warning message
         will be printed.
         @type  queue_size: int
+        @param max_queued_bytes: When the I/O reactor is enabled (see
+        L{rospy.init_node()} io_threads), publishing never blocks and
+        messages are queued for each subscriber. This bounds the
+        number of bytes queued per subscriber, in addition to
+        queue_size. None means no limit.
+        @type  max_queued_bytes: int
+        @param drop_policy: When the I/O reactor is enabled, what to do
+        when a subscriber's queue is full: 'drop_oldest' drops its
+        oldest queued messages, 'drop_newest' drops the new message,
+        'disconnect' closes the connection to the subscriber.
+        @type  drop_policy: str
+        @param intraprocess: How messages are passed to subscribers in
+        the same process, which receive them without serialization:
+        'copy' passes a copy of each published message, shared by
+        those subscribers; 'reference' passes the published message
+        itself, which must then not be modified after publishing it;
+        'none' sends them over TCPROS like to other subscribers.
+        @type  intraprocess: str
         @raise ROSException: if parameters are invalid     
         """
         super(Publisher, self).__init__(name, data_class, Registration.PUB)
@@ -849,6 +914,14 @@ class Publisher(Topic):
             self.impl.enable_latch()
         if headers:
             self.impl.add_headers(headers)
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST, DISCONNECT):
+            raise ROSException("invalid drop policy [%s]"%drop_policy)
+        if intraprocess not in (INTRAPROCESS_COPY, INTRAPROCESS_REFERENCE, INTRAPROCESS_NONE):
+            raise ROSException("invalid intraprocess policy [%s]"%intraprocess)
+        self.impl.intraprocess = intraprocess
+        # last person to set these wins
+        self.impl.max_queued_bytes = max_queued_bytes
+        self.impl.drop_policy = drop_policy
         if queue_size is not None:
             self.impl.set_queue_size(queue_size)
         else:
@@ -916,6 +989,11 @@ class _PublisherImpl(_TopicImpl):
         
         # maximum queue size for publishing messages
         self.queue_size = None
+        # per-connection send queue limit and policy when using the I/O reactor
+        self.max_queued_bytes = None
+        self.drop_policy = DROP_OLDEST
+        # how messages are passed to subscribers in this process
+        self.intraprocess = INTRAPROCESS_COPY
 
         #STATS
         self.message_data_sent = 0
@@ -993,7 +1071,15 @@ class _PublisherImpl(_TopicImpl):
         @return: True if connection was added
         @rtype: bool
         """
-        if self.queue_size is not None:
+        reactor = get_tcpros_handler().reactor
+        if c.transport_type == INTRAPROCESS:
+            # deliver from the sender pool, bounded like a TCPROS connection
+            sub = get_topic_manager().get_subscriber_impl(self.resolved_name)
+            queue_size = (sub.queue_size if sub is not None else None) or self.queue_size or 0
+            c = QueuedConnection(c, queue_size)
+        elif reactor is not None and c.transport_type == 'TCPROS':
+            c = AsyncConnection(c, reactor.get_loop(), self.queue_size, self.max_queued_bytes, self.drop_policy)
+        elif self.queue_size is not None:
             c = QueuedConnection(c, self.queue_size)
         super(_PublisherImpl, self).add_connection(c)
         def publish_single(data):
@@ -1055,6 +1141,14 @@ class _PublisherImpl(_TopicImpl):
         else:
             conns = [connection_override]
 
+        # subscribers in this process get the message itself
+        local_conns = [c for c in conns if c.transport_type == INTRAPROCESS]
+        if local_conns:
+            conns = [c for c in conns if c.transport_type != INTRAPROCESS]
+            self._publish_intraprocess(message, local_conns)
+            if not conns:
+                return True
+
         # #2128 test our buffer. I don't now how this got closed in
         # that case, but we can at least diagnose the problem.
         b = self.buff
@@ -1062,7 +1156,8 @@ class _PublisherImpl(_TopicImpl):
             b.tell()
 
             # serialize the message
-            self.seq += 1 #count messages published to the topic
+            if not local_conns:
+                self.seq += 1 #count messages published to the topic
             serialize_message(b, self.seq, message)
 
             # send the buffer to all connections
@@ -1112,6 +1207,29 @@ class _PublisherImpl(_TopicImpl):
             except:
                 pass
 
+    def _publish_intraprocess(self, message, conns):
+        """
+        Pass message to the intra-process connections conns. This
+        counts the message in self.seq.
+        """
+        self.seq += 1 #count messages published to the topic
+        # update Header as serialize_message() would
+        if getattr(message.__class__, "_has_header", False):
+            message.header.seq = self.seq
+            if message.header.frame_id is None:
+                message.header.frame_id = "0"
+        message = intraprocess_prepare_message(message, self.intraprocess)
+        for c in conns:
+            try:
+                if not is_shutdown():
+                    c.write_data(message)
+            except Exception:
+                logdebug("intra-process connection to [%s] terminated:\n%s"%(c.endpoint_id, traceback.format_exc()))
+                try:
+                    c.close()
+                except:
+                    pass
+
 #################################################################################
 # TOPIC MANAGER/LISTENER
 
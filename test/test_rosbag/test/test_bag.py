@@ -33,6 +33,7 @@
 #
 # test_bag.py
 
+import bisect
 import hashlib
 import heapq
 import os
@@ -41,11 +42,16 @@ import sys
 import tempfile
 import time
 import unittest
+try:
+    from cStringIO import StringIO  # Python 2.x
+except ImportError:
+    from io import BytesIO as StringIO  # Python 3.x
 
 import genpy
 
 import rosbag
 from rosbag import bag
+from rosbag import rosbag_main
 import rospy
 from std_msgs.msg import Int32
 from std_msgs.msg import ColorRGBA
@@ -76,7 +82,10 @@ class TestRosbag(unittest.TestCase):
         def fn3(): rosbag.Bag(f, 'z')        
         def fn4(): rosbag.Bag(f, 'r', compression='foobar')
         def fn5(): rosbag.Bag(f, 'r', chunk_threshold=-1000)
-        for fn in [fn1, fn2, fn3, fn4, fn5]:
+        def fn6(): rosbag.Bag(f, 'r', chunk_cache_size=-1)
+        def fn7(): rosbag.Bag(f, 'w', compression_threads=-1)
+        def fn8(): rosbag.Bag(f, 'w', max_pending_chunks=0)
+        for fn in [fn1, fn2, fn3, fn4, fn5, fn6, fn7, fn8]:
             self.failUnlessRaises(ValueError, fn)
 
     def test_io_on_close_fails(self):
@@ -157,7 +166,68 @@ class TestRosbag(unittest.TestCase):
         msgs = list(rosbag.Bag('/tmp/test_get_messages_time_range_works.bag').read_messages(topics='/ints', start_time=start_time, end_time=end_time))
 
         self.assertEquals(len(msgs), 5)
-        
+
+    def test_get_entries_time_range_works(self):
+        fn = '/tmp/test_get_entries_time_range_works.bag'
+        with rosbag.Bag(fn, 'w', chunk_threshold=256) as b:
+            for i in range(100):
+                b.write('/ints%d' % (i % 3), Int32(data=i), genpy.Time.from_sec(i))
+
+        with rosbag.Bag(fn) as b:
+            start_time = genpy.Time.from_sec(37)
+            end_time = genpy.Time.from_sec(62)
+
+            stamps = [e.time.to_sec() for e in b._get_entries(start_time=start_time, end_time=end_time)]
+            self.assertEquals(stamps, [float(i) for i in range(37, 63)])
+
+            stamps = [e.time.to_sec() for e in b._get_entries_reverse(start_time=start_time, end_time=end_time)]
+            self.assertEquals(stamps, [float(i) for i in range(62, 36, -1)])
+
+            stamps = [e.time.to_sec() for e in b._get_entries(start_time=genpy.Time.from_sec(95))]
+            self.assertEquals(stamps, [95.0, 96.0, 97.0, 98.0, 99.0])
+
+            stamps = [e.time.to_sec() for e in b._get_entries_reverse(end_time=genpy.Time.from_sec(2))]
+            self.assertEquals(stamps, [2.0, 1.0, 0.0])
+
+    def test_time_to_first_message_independent_of_bag_length(self):
+        def time_to_first_message(fn, msg_count):
+            with rosbag.Bag(fn, 'w') as b:
+                for i in range(msg_count):
+                    b.write('/ints', Int32(data=i), genpy.Time.from_sec(i))
+
+            visited = []
+            bisected = []
+            getitem = bag._ConnectionIndex200.__getitem__
+            bisect_left = bisect.bisect_left
+            def count_getitem(index, i):
+                visited.append(i)
+                return getitem(index, i)
+            def count_bisect_left(a, x, *args):
+                bisected.append(len(a))
+                return bisect_left(a, x, *args)
+
+            with rosbag.Bag(fn) as b:
+                start_time = genpy.Time.from_sec(msg_count - 10)
+                bag._ConnectionIndex200.__getitem__ = count_getitem
+                bisect.bisect_left = count_bisect_left
+                try:
+                    t0 = time.time()
+                    _, msg, _ = next(b.read_messages(start_time=start_time))
+                    elapsed = time.time() - t0
+                finally:
+                    bag._ConnectionIndex200.__getitem__ = getitem
+                    bisect.bisect_left = bisect_left
+                self.assertEquals(msg.data, msg_count - 10)
+
+            # The whole index is bisected, and only the entry of the first message is visited
+            self.assertEquals(bisected, [msg_count])
+            self.assertEquals(visited, [msg_count - 10])
+            return elapsed
+
+        short_elapsed = time_to_first_message('/tmp/test_time_to_first_message_short.bag', 1000)
+        long_elapsed = time_to_first_message('/tmp/test_time_to_first_message_long.bag', 50000)
+        print('time to first message: %.6fs (1000 msgs) vs %.6fs (50000 msgs)' % (short_elapsed, long_elapsed))
+
     def test_get_messages_filter_works(self):
         with rosbag.Bag('/tmp/test_get_messages_filter_works.bag', 'w') as b:
             for i in range(30):
@@ -327,6 +397,297 @@ class TestRosbag(unittest.TestCase):
             self.assertLess(info.compressed, 1050)
             self.assertGreater(info.compressed, 850)
         
+    def test_chunk_cache_decompresses_each_chunk_once(self):
+        fn = '/tmp/test_chunk_cache_decompresses_each_chunk_once.bag'
+
+        # Write each topic into its own run of chunks, so that reading in time order alternates between them
+        with rosbag.Bag(fn, 'w', compression=rosbag.Compression.BZ2, chunk_threshold=1024) as b:
+            for topic in ['/a', '/b', '/c']:
+                for i in range(200):
+                    b.write(topic, Int32(data=i), genpy.Time.from_sec(i))
+
+        with rosbag.Bag(fn) as b:
+            chunk_count = len(b._chunks)
+            self.assertGreater(chunk_count, 3)
+
+            msgs = list(b.read_messages())
+            self.assertEquals(len(msgs), 600)
+
+            info = b.get_chunk_cache_info()
+            self.assertEquals(info.misses, chunk_count)
+            self.assertEquals(info.hits, 600 - chunk_count)
+            self.assertLessEqual(info.size, info.capacity)
+
+        # A cache too small for more than one chunk degrades to decompressing on every chunk switch
+        with rosbag.Bag(fn, chunk_cache_size=0) as b:
+            msgs = list(b.read_messages())
+            self.assertEquals(len(msgs), 600)
+            self.assertGreater(b.get_chunk_cache_info().misses, len(b._chunks))
+
+    def test_read_messages_in_file_order_works(self):
+        fn = '/tmp/test_read_messages_in_file_order_works.bag'
+
+        for compression in [rosbag.Compression.NONE, rosbag.Compression.BZ2]:
+            with rosbag.Bag(fn, 'w', compression=compression, chunk_threshold=1024) as b:
+                for topic in ['/a', '/b', '/c']:
+                    for i in range(200):
+                        b.write(topic, Int32(data=i), genpy.Time.from_sec(i))
+
+            with rosbag.Bag(fn) as b:
+                msgs = list(b.read_messages(order='file'))
+                self.assertEquals([(topic, msg.data) for topic, msg, _ in msgs],
+                                  [(topic, i) for topic in ['/a', '/b', '/c'] for i in range(200)])
+
+                start_time = genpy.Time.from_sec(50)
+                end_time = genpy.Time.from_sec(149)
+                msgs = list(b.read_messages(topics=['/b'], start_time=start_time, end_time=end_time, order='file'))
+                self.assertEquals([(topic, msg.data) for topic, msg, _ in msgs], [('/b', i) for i in range(50, 150)])
+
+                time_ordered = sorted((msg[1], topic, t) for topic, msg, t in b.read_messages(raw=True))
+                file_ordered = sorted((msg[1], topic, t) for topic, msg, t in b.read_messages(raw=True, order='file'))
+                self.assertEquals(time_ordered, file_ordered)
+
+            self.failUnlessRaises(ValueError, lambda: rosbag.Bag(fn).read_messages(order='foobar'))
+
+    def test_read_messages_with_executor_works(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        fn = '/tmp/test_read_messages_with_executor_works.bag'
+
+        with rosbag.Bag(fn, 'w', compression=rosbag.Compression.BZ2, chunk_threshold=1024) as b:
+            for topic in ['/a', '/b', '/c']:
+                for i in range(200):
+                    b.write(topic, Int32(data=i), genpy.Time.from_sec(i))
+
+        with rosbag.Bag(fn) as b:
+            expected_time_order = [(topic, msg.data, t) for topic, msg, t in b.read_messages()]
+            expected_file_order = [(topic, msg.data, t) for topic, msg, t in b.read_messages(order='file')]
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            with rosbag.Bag(fn) as b:
+                msgs = [(topic, msg.data, t) for topic, msg, t in b.read_messages(executor=executor, prefetch_chunks=3)]
+                self.assertEquals(msgs, expected_time_order)
+                self.assertEquals(b.get_chunk_cache_info().misses, len(b._chunks))
+
+                msgs = [(topic, msg.data, t) for topic, msg, t in b.read_messages(order='file', executor=executor, prefetch_chunks=3)]
+                self.assertEquals(msgs, expected_file_order)
+
+                # Abandoning a prefetching read part way through shouldn't disturb later reads
+                msgs = b.read_messages(topics=['/b'], executor=executor)
+                next(msgs)
+                msgs.close()
+                self.assertEquals(len(list(b.read_messages(topics=['/c'], executor=executor))), 200)
+
+    def test_background_compression_works(self):
+        fn = '/tmp/test_background_compression_works.bag'
+
+        with rosbag.Bag(fn, 'w', compression=rosbag.Compression.BZ2, chunk_threshold=1024,
+                        compression_threads=2, max_pending_chunks=2) as b:
+            for i in range(1000):
+                b.write('/ints%d' % (i % 2), Int32(data=i), genpy.Time.from_sec(i))
+
+            # Flushing waits for the chunks being compressed to be written
+            b.flush()
+            self.assertEquals(sum(sum(c.connection_counts.values()) for c in b._chunks), 1000)
+
+            for i in range(1000, 2000):
+                b.write('/ints%d' % (i % 2), Int32(data=i), genpy.Time.from_sec(i))
+
+        with rosbag.Bag(fn) as b:
+            self.assertEquals(b.get_compression_info().compression, rosbag.Compression.BZ2)
+            self.assertEquals(len(b._chunks), len(b._chunk_headers))
+
+            msgs = list(b.read_messages())
+            self.assertEquals([msg.data for _, msg, _ in msgs], list(range(2000)))
+            self.assertEquals([t.to_sec() for _, _, t in msgs], [float(i) for i in range(2000)])
+
+            msgs = list(b.read_messages(topics=['/ints1'], start_time=genpy.Time.from_sec(1500)))
+            self.assertEquals([msg.data for _, msg, _ in msgs], list(range(1501, 2000, 2)))
+
+    def test_copy_messages_works(self):
+        inbag_filename = '/tmp/test_copy_messages_works_in.bag'
+        outbag_filename = '/tmp/test_copy_messages_works_out.bag'
+
+        with rosbag.Bag(inbag_filename, 'w', compression=rosbag.Compression.BZ2, chunk_threshold=1024) as b:
+            for i in range(1000):
+                b.write('/ints%d' % (i % 2), Int32(data=i), genpy.Time.from_sec(i))
+            for i in range(1000, 2000):
+                b.write('/ints0', Int32(data=i), genpy.Time.from_sec(i))
+
+        start_time, end_time = genpy.Time.from_sec(500), genpy.Time.from_sec(1500)
+        message_filter = lambda topic, t: not (1200 <= t.secs < 1210)
+
+        with rosbag.Bag(inbag_filename) as inbag:
+            with rosbag.Bag(outbag_filename, 'w') as outbag:
+                for _ in outbag.copy_messages(inbag, ['/ints0'], start_time, end_time, message_filter):
+                    pass
+
+            expected_msgs = [(topic, msg.data, t) for topic, msg, t in inbag.read_messages(['/ints0'], start_time, end_time)
+                             if message_filter(topic, t)]
+            compressed_chunks = set(self._read_chunk_data(inbag, chunk_info) for chunk_info in inbag._chunks)
+
+        with rosbag.Bag(outbag_filename) as outbag:
+            msgs = [(topic, msg.data, t) for topic, msg, t in outbag.read_messages()]
+            self.assertEquals(msgs, expected_msgs)
+            self.assertEquals(outbag.get_message_count(), len(expected_msgs))
+
+            # Chunks with only /ints0 messages in range are copied as they are
+            copied_chunks = [chunk_info for chunk_info in outbag._chunks if self._read_chunk_data(outbag, chunk_info) in compressed_chunks]
+            self.assertTrue(len(copied_chunks) > 0)
+            self.assertTrue(all(outbag._chunk_headers[c.pos].compression == rosbag.Compression.BZ2 for c in copied_chunks))
+
+        # The copied bag can be reindexed
+        shutil.copy(outbag_filename, outbag_filename + '.reindex')
+        with rosbag.Bag(outbag_filename + '.reindex', 'a', allow_unindexed=True) as b:
+            for _ in b.reindex():
+                pass
+        with rosbag.Bag(outbag_filename + '.reindex') as b:
+            self.assertEquals([(topic, msg.data, t) for topic, msg, t in b.read_messages()], expected_msgs)
+
+    def test_filter_nested_expression_works(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            inbag_filename = os.path.join(tempdir, 'test_filter_nested_expression_works_in.bag')
+            outbag_filename = os.path.join(tempdir, 'test_filter_nested_expression_works_out.bag')
+
+            with rosbag.Bag(inbag_filename, 'w') as b:
+                for i in range(10):
+                    b.write('/ints', Int32(data=i), genpy.Time.from_sec(i))
+
+            # m is only used inside the generator expression
+            rosbag_main.filter_cmd([inbag_filename, outbag_filename, 'any(m.data == x for x in [1, 2])'])
+
+            with rosbag.Bag(outbag_filename) as b:
+                self.assertEquals([msg.data for _, msg, _ in b.read_messages()], [1, 2])
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_filter_field_projection_works(self):
+        self.assertEquals(rosbag_main._get_message_fields('topic == "/ints" and t.secs > 10'), set())
+        self.assertEquals(rosbag_main._get_message_fields('m.header.stamp.secs > 10 and m.height == 480'), set(['header', 'height']))
+        self.assertEquals(rosbag_main._get_message_fields('m.a > 0 and str(m)'), None)
+
+        header_def = '=' * 80 + '\nMSG: std_msgs/Header\nuint32 seq\ntime stamp\nstring frame_id\n'
+        msg_def = 'uint8 MODE=1\nHeader header # stamped\nuint32 height\nuint8[] data\n' + header_def
+        self.assertEquals(rosbag_main._truncate_message_definition(msg_def, ['header']), 'uint8 MODE=1\nHeader header # stamped\n' + header_def)
+        self.assertEquals(rosbag_main._truncate_message_definition(msg_def, ['height', 'header']), 'uint8 MODE=1\nHeader header # stamped\nuint32 height\n' + header_def)
+        self.assertEquals(rosbag_main._truncate_message_definition(msg_def, ['width']), None)
+
+        msg = ColorRGBA(r=1.0, g=2.0, b=3.0, a=4.0)
+        projected_type = rosbag_main._get_projected_message_type(ColorRGBA, set(['g']))
+        self.assertEquals(projected_type.__slots__, ['r', 'g'])
+
+        buff = StringIO()
+        msg.serialize(buff)
+        projected_msg = projected_type()
+        projected_msg.deserialize(buff.getvalue())
+        self.assertEquals((projected_msg.r, projected_msg.g), (1.0, 2.0))
+
+    def test_connection_index_works(self):
+        fn = '/tmp/test_connection_index_works.bag'
+
+        with rosbag.Bag(fn, 'w', chunk_threshold=1024) as b:
+            for i in range(1000):
+                # Out of order, with messages at the same time on different topics
+                t = genpy.Time.from_sec(i // 2 if i % 10 else 1000 - i // 2)
+                b.write('/ints%d' % (i % 3), Int32(data=i), t)
+
+        with rosbag.Bag(fn) as b:
+            for index in b._connection_indexes.values():
+                self.assertTrue(isinstance(index, bag._ConnectionIndex200))
+                self.assertEquals([e.time for e in index], sorted(e.time for e in index))
+
+            entries = list(b._get_entries())
+            self.assertEquals(len(entries), 1000)
+            self.assertEquals([e.time for e in entries], sorted(e.time for e in entries))
+
+            start_time, end_time = genpy.Time.from_sec(100), genpy.Time.from_sec(200)
+            entries = [(e.time, e.position) for e in b._get_entries(None, start_time, end_time)]
+            reverse_entries = [(e.time, e.position) for e in b._get_entries_reverse(None, start_time, end_time)]
+            self.assertEquals([t for t, _ in reverse_entries], [t for t, _ in reversed(entries)])
+            self.assertEquals(sorted(reverse_entries), sorted(entries))
+
+            self.assertEquals(b._get_entry(genpy.Time.from_sec(100.5)).time, genpy.Time.from_sec(100))
+            self.assertEquals(b._get_entry_after(genpy.Time.from_sec(100)).time, genpy.Time.from_sec(101))
+            self.assertEquals(b._get_entry(genpy.Time(0, 0)).time, genpy.Time(0, 0))
+
+            # Each entry points at its message
+            for _, msg, t in b.read_messages():
+                self.assertEquals(t, genpy.Time.from_sec(msg.data // 2 if msg.data % 10 else 1000 - msg.data // 2))
+
+            # Each entry is packed into 20 bytes
+            index = list(b._connection_indexes.values())[0]
+            self.assertEquals(index.times.itemsize + index.chunk_positions.itemsize + index.offsets.itemsize, 20)
+
+        # Sorting is stable
+        index = bag._ConnectionIndex200()
+        for chunk_pos, secs in enumerate([3, 1, 2, 1]):
+            index.add(genpy.Time(secs, 5), chunk_pos, secs)
+        index.sort()
+        self.assertEquals(list(index.times), [1000000005, 1000000005, 2000000005, 3000000005])
+        self.assertEquals(list(index.chunk_positions), [1, 3, 2, 0])
+        self.assertEquals(list(index.offsets), [1, 1, 2, 3])
+
+    def test_index_cache_works(self):
+        fn = '/tmp/test_index_cache_works.bag'
+        idx_fn = fn + '.idx'
+        if os.path.exists(idx_fn):
+            os.remove(idx_fn)
+
+        with rosbag.Bag(fn, 'w', chunk_threshold=1024) as b:
+            for i in range(1000):
+                b.write('/ints%d' % (i % 3), Int32(data=i), genpy.Time.from_sec(i))
+
+        with rosbag.Bag(fn, index_cache=True) as b:
+            self.assertTrue(os.path.exists(idx_fn))
+            expected_msgs = [(topic, msg.data, t) for topic, msg, t in b.read_messages()]
+            expected_chunk_headers = dict((pos, (h.compression, h.compressed_size, h.uncompressed_size, h.data_pos))
+                                          for pos, h in b._chunk_headers.items())
+
+        for skip_index in [False, True]:
+            with rosbag.Bag(fn, index_cache=True, skip_index=skip_index) as b:
+                self.assertEquals(b._connection_indexes_read, not skip_index)
+                self.assertEquals(len(b._chunks), len(b._chunk_headers))
+                self.assertEquals(dict((pos, (h.compression, h.compressed_size, h.uncompressed_size, h.data_pos))
+                                       for pos, h in b._chunk_headers.items()), expected_chunk_headers)
+
+                msgs = [(topic, msg.data, t) for topic, msg, t in b.read_messages()]
+                self.assertEquals(msgs, expected_msgs)
+                self.assertEquals(b.get_message_count(), 1000)
+
+        # Modifying the bag invalidates the cache
+        with rosbag.Bag(fn, 'a') as b:
+            b.write('/ints0', Int32(data=1000), genpy.Time.from_sec(1000))
+
+        with rosbag.Bag(fn, index_cache=True) as b:
+            self.assertEquals(b.get_message_count(), 1001)
+            self.assertEquals([msg.data for _, msg, _ in b.read_messages(topics=['/ints0'])][-1], 1000)
+
+        # A cache written with another layout, e.g. on a big-endian machine, is rebuilt, and the rejected cache is closed
+        mmaps = []
+        mmap_fn = bag.mmap.mmap
+        def record_mmap(*args, **kwargs):
+            mmaps.append(mmap_fn(*args, **kwargs))
+            return mmaps[-1]
+        layout = bag._INDEX_CACHE_LAYOUT
+        bag._INDEX_CACHE_LAYOUT = 'other'
+        try:
+            rosbag.Bag(fn, index_cache=True).close()
+        finally:
+            bag._INDEX_CACHE_LAYOUT = layout
+        bag.mmap.mmap = record_mmap
+        try:
+            with rosbag.Bag(fn, index_cache=True) as b:
+                self.assertEquals(len(mmaps), 1)
+                self.assertTrue(mmaps[0].closed)
+                self.assertEquals(b.get_message_count(), 1001)
+            with rosbag.Bag(fn, index_cache=True) as b:
+                self.assertEquals(len(mmaps), 2)
+                self.assertEquals(b.get_message_count(), 1001)
+                self.assertEquals([msg.data for _, msg, _ in b.read_messages(topics=['/ints0'])][-1], 1000)
+        finally:
+            bag.mmap.mmap = mmap_fn
+
     def test_get_time(self):
         fn = '/tmp/test_get_time.bag'
         
@@ -416,6 +777,11 @@ class TestRosbag(unittest.TestCase):
             # topics should be empty
             self.assertEquals(len(topics), 0)
         
+    def _read_chunk_data(self, b, chunk_info):
+        chunk_header = b._chunk_headers[chunk_info.pos]
+        b._file.seek(chunk_header.data_pos)
+        return b._file.read(chunk_header.compressed_size)
+
     def _print_bag_records(self, fn):
         with open(fn) as f:
             f.seek(0, os.SEEK_END)
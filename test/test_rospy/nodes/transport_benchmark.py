@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2008, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+## Compares the throughput and latency of topics between two nodes on
+## this machine over TCPROS and SHMROS, for messages of 1KB to 10MB.
+##
+## Requires a running master. Usage:
+##   transport_benchmark.py [--count N] [--latency-count N]
+
+from __future__ import print_function
+
+import json
+import optparse
+import os
+import struct
+import subprocess
+import sys
+import time
+import warnings
+
+import rospy
+from std_msgs.msg import UInt8MultiArray
+
+SIZES = [1024, 10*1024, 100*1024, 1024*1024, 10*1024*1024]
+TRANSPORTS = ['TCPROS', 'SHMROS']
+
+# pause between the messages measuring latency, so that they don't queue up
+LATENCY_INTERVAL = 0.02
+
+def topic_name(transport, size):
+    # separate topics for each transport, so that the publisher does not
+    # mistake the connections of a previous subscriber for the current one
+    return '/transport_benchmark/%s/size_%d'%(transport.lower(), size)
+
+def subscriber(transport, count, latency_count):
+    """
+    Receive count + latency_count messages of each size, and print
+    the results for each size as a JSON line
+    """
+    rospy.init_node('transport_benchmark_sub', anonymous=True)
+    total = count + latency_count
+    received = dict((size, []) for size in SIZES)
+    done = []
+
+    def callback(msg, size):
+        now = time.time()
+        (stamp,) = struct.unpack('<d', msg.data[:8])
+        records = received[size]
+        records.append((msg.layout.data_offset, stamp, now))
+        if len(records) == total:
+            done.append(size)
+
+    subs = [rospy.Subscriber(topic_name(transport, size), UInt8MultiArray, callback, size) for size in SIZES]
+    reported = 0
+    while reported < len(SIZES) and not rospy.is_shutdown():
+        if reported < len(done):
+            size = done[reported]
+            records = received[size]
+            latencies = [now - stamp for i, stamp, now in records if i < latency_count]
+            times = [now for i, stamp, now in records if i >= latency_count]
+            duration = times[-1] - times[0]
+            transport_types = [c.transport_type for c in subs[SIZES.index(size)].impl.connections]
+            print(json.dumps({'size': size, 'transport': transport_types,
+                              'latency_mean': sum(latencies) / len(latencies),
+                              'latency_min': min(latencies),
+                              'throughput': (len(times) - 1) * size / duration if duration else 0.}))
+            sys.stdout.flush()
+            reported += 1
+        time.sleep(0.01)
+
+def publisher(count, latency_count):
+    """
+    Publish the messages of each size for a subscriber using each
+    transport in turn, and print the results
+    """
+    rospy.init_node('transport_benchmark_pub', anonymous=True)
+    # without a queue, publish() blocks while the subscriber catches up,
+    # which is what the throughput measurement needs
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        pubs = dict(((transport, size), rospy.Publisher(topic_name(transport, size), UInt8MultiArray, queue_size=None))
+                    for transport in TRANSPORTS for size in SIZES)
+    results = []
+    for transport in TRANSPORTS:
+        # the subscriber offers SHMROS unless disabled
+        rospy.set_param('/shmros', transport == 'SHMROS')
+        cmd = [sys.executable, os.path.abspath(__file__), '--subscribe', transport,
+               '--count', str(count), '--latency-count', str(latency_count)]
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        try:
+            for size in SIZES:
+                pub = pubs[transport, size]
+                while pub.get_num_connections() < 1 and not rospy.is_shutdown():
+                    time.sleep(0.1)
+                body = b'\0' * (size - 8)
+                msg = UInt8MultiArray()
+                for i in range(count + latency_count):
+                    msg.layout.data_offset = i
+                    msg.data = struct.pack('<d', time.time()) + body
+                    pub.publish(msg)
+                    if i < latency_count:
+                        time.sleep(LATENCY_INTERVAL)
+                result = json.loads(p.stdout.readline().decode())
+                result['requested'] = transport
+                results.append(result)
+                print("%-7s %9d bytes: latency %8.3f ms (min %8.3f ms), throughput %9.1f MB/s over %s"%(
+                    transport, size, result['latency_mean'] * 1000., result['latency_min'] * 1000.,
+                    result['throughput'] / 1e6, ','.join(result['transport'])))
+        finally:
+            p.wait()
+    rospy.delete_param('/shmros')
+    return results
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option('--count', type='int', default=50,
+                      help="number of messages of each size for measuring throughput")
+    parser.add_option('--latency-count', type='int', default=20,
+                      help="number of messages of each size for measuring latency")
+    parser.add_option('--subscribe', metavar='TRANSPORT', default=None,
+                      help=optparse.SUPPRESS_HELP)
+    options, _ = parser.parse_args(rospy.myargv()[1:])
+    if options.subscribe:
+        subscriber(options.subscribe, options.count, options.latency_count)
+    else:
+        publisher(options.count, options.latency_count)
+
+if __name__ == '__main__':
+    main()
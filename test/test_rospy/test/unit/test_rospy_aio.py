@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2008, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import socket
+import struct
+import sys
+import threading
+import unittest
+
+import rosgraph.network
+
+class FakeService(object):
+    """
+    AddTwoInts service speaking TCPROS on a blocking socket
+    """
+    def __init__(self, persistent_calls=1, error=None):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(5)
+        self.port = self.server.getsockname()[1]
+        self.headers = []
+        self.error = error
+        self.persistent_calls = persistent_calls
+
+    def start(self, connections):
+        t = threading.Thread(target=self.run, args=(connections,))
+        t.daemon = True
+        t.start()
+
+    def _read(self, sock, n):
+        data = b''
+        while len(data) < n:
+            d = sock.recv(n - len(data))
+            if not d:
+                raise EOFError()
+            data += d
+        return data
+
+    def run(self, connections):
+        for _ in range(connections):
+            sock, _ = self.server.accept()
+            (size,) = struct.unpack('<I', self._read(sock, 4))
+            header = rosgraph.network.decode_ros_handshake_header(struct.pack('<I', size) + self._read(sock, size))
+            self.headers.append(header)
+            sock.sendall(rosgraph.network.encode_ros_handshake_header(
+                {'callerid': '/fake', 'md5sum': header['md5sum'], 'type': 'test_rosmaster/AddTwoInts'}))
+            for _ in range(self.persistent_calls):
+                (size,) = struct.unpack('<I', self._read(sock, 4))
+                a, b = struct.unpack('<qq', self._read(sock, size))
+                if self.error:
+                    sock.sendall(struct.pack('<BI', 0, len(self.error)) + self.error.encode())
+                else:
+                    sock.sendall(struct.pack('<BIq', 1, 8, a + b))
+            sock.close()
+
+class TestRospyAio(unittest.TestCase):
+
+    def _proxy(self, service, **kwds):
+        import asyncio
+        import rospy.aio
+        from test_rosmaster.srv import AddTwoInts
+        class Proxy(rospy.aio.ServiceProxy):
+            def _get_service_uri(self):
+                f = asyncio.Future()
+                f.set_result('rosrpc://127.0.0.1:%s'%service.port)
+                return f
+        return Proxy('add_two_ints', AddTwoInts, **kwds)
+
+    def test_ServiceProxy(self):
+        if sys.version_info < (3, 5):
+            return
+        import asyncio
+        from rospy.service import ServiceException
+        from test_rosmaster.srv import AddTwoIntsRequest
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            service = FakeService()
+            service.start(3)
+            p = self._proxy(service)
+            self.assertEquals(3, loop.run_until_complete(p(1, 2)).sum)
+            self.assertEquals(7, loop.run_until_complete(p.call(AddTwoIntsRequest(3, 4))).sum)
+            self.assertEquals(11, loop.run_until_complete(p(a=5, b=6)).sum)
+            self.assertEquals(p.service_class._md5sum, service.headers[0]['md5sum'])
+            self.assertEquals('/add_two_ints', service.headers[0]['service'])
+            self.assert_('persistent' not in service.headers[0])
+
+            # concurrent calls on a persistent connection
+            service = FakeService(persistent_calls=10)
+            service.start(1)
+            p = self._proxy(service, persistent=True)
+            results = loop.run_until_complete(asyncio.gather(*[p(i, i) for i in range(10)]))
+            self.assertEquals([2 * i for i in range(10)], [r.sum for r in results])
+            self.assertEquals(1, len(service.headers))
+            self.assertEquals('1', service.headers[0]['persistent'])
+            p.close()
+
+            # service errors
+            service = FakeService(error='bad request')
+            service.start(1)
+            p = self._proxy(service)
+            try:
+                loop.run_until_complete(p(1, 2))
+                self.fail("should have raised ServiceException")
+            except ServiceException as e:
+                self.assert_('bad request' in str(e))
+        finally:
+            loop.close()
+
+    def _deliver(self, resolved_name, msgs):
+        # deliver messages from a transport thread
+        import rospy.impl.registration
+        impl = rospy.impl.registration.get_topic_manager().get_subscriber_impl(resolved_name)
+        t = threading.Thread(target=impl.receive_callback, args=(msgs, None))
+        t.start()
+        t.join()
+
+    def test_Subscriber(self):
+        if sys.version_info < (3, 5):
+            return
+        import asyncio
+        import rospy.aio
+        from rospy.exceptions import ROSInterruptException
+        from std_msgs.msg import String
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            s = rospy.aio.Subscriber('aio_sub', String)
+            self.assertEquals('/aio_sub', s.resolved_name)
+            self._deliver(s.resolved_name, [String('a'), String('b')])
+            self.assertEquals('a', loop.run_until_complete(s.get()).data)
+
+            # iteration ends once the queued messages are consumed
+            s.unregister()
+            async def consume():
+                return [msg.data async for msg in s]
+            self.assertEquals(['b'], loop.run_until_complete(consume()))
+            try:
+                loop.run_until_complete(s.get())
+                self.fail("should have raised ROSInterruptException")
+            except ROSInterruptException:
+                pass
+
+            # oldest messages are dropped beyond queue_size
+            s = rospy.aio.Subscriber('aio_sub_queue', String, queue_size=2)
+            for data in 'abcd':
+                self._deliver(s.resolved_name, [String(data)])
+            s.unregister()
+            self.assertEquals(['c', 'd'], loop.run_until_complete(consume()))
+        finally:
+            loop.close()
+
+    def test_Subscriber_closed_loop(self):
+        if sys.version_info < (3, 5):
+            return
+        import asyncio
+        import rospy.aio
+        from std_msgs.msg import String
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        s = rospy.aio.Subscriber('aio_sub_closed', String)
+        loop.close()
+        # messages received after the loop is closed are ignored
+        errors = []
+        def receive():
+            try:
+                s._callback(String('a'))
+            except Exception as e:
+                errors.append(e)
+        t = threading.Thread(target=receive)
+        t.start()
+        t.join()
+        self.assertEquals([], errors)
+        s.unregister()
+
+    def test_wait_for_message(self):
+        if sys.version_info < (3, 5):
+            return
+        import asyncio
+        import rospy.aio
+        from rospy.exceptions import ROSException
+        from std_msgs.msg import String
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.call_later(0.1, self._deliver, '/aio_wait', [String('a')])
+            msg = loop.run_until_complete(rospy.aio.wait_for_message('aio_wait', String, timeout=10.))
+            self.assertEquals('a', msg.data)
+            try:
+                loop.run_until_complete(rospy.aio.wait_for_message('aio_wait', String, timeout=0.1))
+                self.fail("should have raised ROSException")
+            except ROSException:
+                pass
+        finally:
+            loop.close()
+
+    def test_Publisher(self):
+        if sys.version_info < (3, 5):
+            return
+        import rospy.aio
+        from std_msgs.msg import String
+        for queue_size in [None, 0, -1]:
+            try:
+                rospy.aio.Publisher('aio_pub', String, queue_size=queue_size)
+                self.fail("should have raised ValueError for queue_size %s"%queue_size)
+            except ValueError:
+                pass
+        p = rospy.aio.Publisher('aio_pub', String, queue_size=5)
+        try:
+            self.assertEquals('/aio_pub', p.resolved_name)
+            self.assertEquals(5, p.impl.queue_size)
+        finally:
+            p.unregister()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2008, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import threading
+import time
+import unittest
+
+class TestRospyCallbackQueue(unittest.TestCase):
+
+    def test_CallbackQueue(self):
+        from rospy.callback_queue import CallbackQueue
+        try:
+            CallbackQueue('bad', num_threads=0)
+            self.fail("should have raised ValueError")
+        except ValueError:
+            pass
+
+        # block the single thread so that messages pile up
+        q = CallbackQueue('test', num_threads=1)
+        gate = threading.Event()
+        received = []
+        done = threading.Event()
+        def cb(msg, args):
+            gate.wait()
+            received.append((msg, args))
+            if msg == 'last':
+                done.set()
+        blocker = q.subscribe('/blocker', lambda msg: gate.wait(), None)
+        s1 = q.subscribe('/s1', cb, 's1', queue_size=2)
+        s2 = q.subscribe('/s2', cb, 's2')
+        blocker.put('block')
+        time.sleep(0.1)
+        for i in range(5):
+            s1.put(i)
+        for i in range(3):
+            s2.put(i)
+        s2.put('last')
+        # s1 only keeps its latest two messages
+        self.assertEquals(6, q.get_backlog())
+        stats = q.get_stats()
+        self.assertEquals(10, stats['received'])
+        self.assertEquals(3, stats['dropped'])
+        self.assertEquals(6, stats['backlog'])
+
+        gate.set()
+        done.wait(5)
+        self.assertEquals([(3, 's1'), (4, 's1'), (0, 's2'), (1, 's2'), (2, 's2'), ('last', 's2')], received)
+        stats = q.get_stats()
+        self.assertEquals(7, stats['processed'])
+        self.assertEquals(0, stats['backlog'])
+        self.assert_(stats['max_latency'] >= stats['mean_latency'] > 0)
+
+        # closed subscriptions drop their pending messages
+        gate.clear()
+        blocker.put('block')
+        time.sleep(0.1)
+        s1.put(5)
+        s2.put(5)
+        s1.close()
+        s1.put(6)
+        self.assertEquals(1, q.get_backlog())
+        q.shutdown()
+        gate.set()
+
+    def test_CallbackQueue_concurrent(self):
+        from rospy.callback_queue import CallbackQueue
+        q = CallbackQueue('concurrent', num_threads=4)
+        lock = threading.Lock()
+        state = {'active': 0, 'max': 0, 'count': 0}
+        done = threading.Event()
+        def cb(msg):
+            with lock:
+                state['active'] += 1
+                state['max'] = max(state['max'], state['active'])
+            time.sleep(0.05)
+            with lock:
+                state['active'] -= 1
+                state['count'] += 1
+                if state['count'] == 8:
+                    done.set()
+        s = q.subscribe('/s', cb, None)
+        for i in range(8):
+            s.put(i)
+        done.wait(5)
+        self.assertEquals(8, state['count'])
+        self.assertEquals(4, state['max'])
+        q.shutdown()
+
+    def test_get_callback_queue(self):
+        from rospy.callback_queue import get_callback_queue, CallbackQueue
+        q = get_callback_queue('named', num_threads=2)
+        self.assert_(isinstance(q, CallbackQueue))
+        self.assert_(q is get_callback_queue('named'))
+        self.assert_(q is not get_callback_queue('other'))
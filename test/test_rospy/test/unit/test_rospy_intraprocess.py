@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2008, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+class TestRospyIntraProcess(unittest.TestCase):
+
+    def test_prepare_message(self):
+        from std_msgs.msg import String
+        from rospy.impl.intraprocess import prepare_message, COPY, REFERENCE
+        m = String('hello')
+        copied = prepare_message(m, COPY)
+        self.failIf(copied is m)
+        self.assertEquals(m, copied)
+        self.assert_(prepare_message(m, REFERENCE) is m)
+
+    def test_IntraProcessPubSub(self):
+        from std_msgs.msg import String
+        from rospy.exceptions import TransportTerminated
+        from rospy.impl.intraprocess import IntraProcessPub, IntraProcessSub, TRANSPORT_TYPE
+        from rospy.impl.transport import INBOUND, OUTBOUND
+
+        class FakeSub(object):
+            def __init__(self):
+                self.received = []
+            def receive_callback(self, msgs, connection):
+                self.received.append((msgs, connection))
+
+        sub = FakeSub()
+        header = {'callerid': '/node', 'topic': '/chatter', 'latching': '1'}
+        sub_conn = IntraProcessSub('/chatter', 'http://localhost:1234/', sub, header, True)
+        pub_conn = IntraProcessPub('/chatter')
+        sub_conn.peer = pub_conn
+        pub_conn.peer = sub_conn
+        self.assertEquals(TRANSPORT_TYPE, sub_conn.transport_type)
+        self.assertEquals(INBOUND, sub_conn.direction)
+        self.assertEquals(OUTBOUND, pub_conn.direction)
+        self.assertEquals('http://localhost:1234/', sub_conn.endpoint_id)
+
+        m = String('hello')
+        self.assert_(pub_conn.write_data(m))
+        self.assertEquals([([m], sub_conn)], sub.received)
+        self.assert_(sub.received[0][0][0] is m)
+        self.assertEquals(header, m._connection_header)
+        self.assert_(sub_conn.latch is m)
+        self.assertEquals(1, pub_conn.stat_num_msg)
+        self.assertEquals(1, sub_conn.stat_num_msg)
+
+        # closing either end closes the connection
+        sub_conn.close()
+        self.assert_(pub_conn.done)
+        try:
+            pub_conn.write_data(m)
+            self.fail("should have raised TransportTerminated")
+        except TransportTerminated:
+            pass
+        self.assertEquals(1, len(sub.received))
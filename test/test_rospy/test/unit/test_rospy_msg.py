@@ -41,6 +41,7 @@ except ImportError:
     from io import StringIO
 import time
 import random
+import threading
 
 import genpy
 
@@ -273,3 +274,77 @@ class TestRospyMsg(unittest.TestCase):
             b2.write(v)
         self.assertEquals(b.getvalue(), b2.getvalue())
 
+
+    def test_ReceiveBuffer(self):
+        import socket
+        import rospy.msg
+        from rospy.msg import ReceiveBuffer, deserialize_messages, serialize_message
+        from std_msgs.msg import String
+        from rosgraph.network import read_ros_handshake_header, encode_ros_handshake_header
+
+        try:
+            from io import BytesIO
+        except ImportError:
+            BytesIO = StringIO
+        out = BytesIO()
+        strs = ['x' * i for i in [0, 1, 10, 5000, 100000, 3]]
+        for i, s in enumerate(strs):
+            serialize_message(out, i, String(s))
+        header = encode_ros_handshake_header({'type': 'std_msgs/String', 'md5sum': String._md5sum})
+        data = header + out.getvalue()
+
+        a, c = socket.socketpair()
+        try:
+            a.sendall(data[:len(header) + 7])
+            b = ReceiveBuffer(16)
+            # file API used by the handshake
+            self.assertEquals('std_msgs/String', read_ros_handshake_header(c, b, 64)['type'])
+            self.assertEquals(7, b.tell())
+
+            # send the rest in pieces
+            t = threading.Thread(target=lambda: [a.sendall(data[i:i + 3000]) for i in range(len(header) + 7, len(data), 3000)])
+            t.start()
+            msgs = []
+            while len(msgs) < len(strs):
+                b.recv_from(c, 1024)
+                deserialize_messages(b, msgs, String)
+            t.join()
+            self.assertEquals(strs, [m.data for m in msgs])
+            self.assertEquals(0, b.tell())
+            self.assert_(len(b.data) >= 100004)
+        finally:
+            a.close()
+            c.close()
+
+        # queue_size, max_msgs and start
+        b = ReceiveBuffer()
+        b.write(b'\x01')
+        b.write(out.getvalue()[:-1])
+        msgs = []
+        deserialize_messages(b, msgs, String, max_msgs=1, start=1)
+        self.assertEquals([''], [m.data for m in msgs])
+        self.assertEquals(1 + len(out.getvalue()) - 1 - 8, b.tell())
+        self.assertEquals(b'\x01', b.getvalue()[:1])
+        msgs = []
+        deserialize_messages(b, msgs, String, queue_size=2, start=1)
+        self.assertEquals(['x' * 5000, 'x' * 100000], [m.data for m in msgs])
+        # the last message is incomplete
+        self.assertEquals(1 + 4 + 4 + 3 - 1, b.tell())
+        self.assertEquals(1 + 4 + 4 + 3, b.expected)
+        b.write(b'x')
+        msgs = []
+        deserialize_messages(b, msgs, String, start=1)
+        self.assertEquals(['xxx'], [m.data for m in msgs])
+        self.assertEquals(1, b.tell())
+
+        # file API
+        b = ReceiveBuffer(2)
+        b.write(b'hello world')
+        self.assertEquals(11, b.tell())
+        b.seek(6)
+        self.assertEquals(b'world', b.read())
+        b.seek(0)
+        self.assertEquals(b'hello', b.read(5))
+        b.truncate(5)
+        self.assertEquals(b'hello', b.getvalue())
+        self.assertEquals(b'', b.read())
@@ -73,3 +73,124 @@ class TestRospyParamServer(unittest.TestCase):
                 ps.get(k)
                 self.fail('get should fail on deleted key')
             except KeyError: pass
+
+    def test_ParamServerCache_updates(self):
+        from rospy.impl.paramserver import ParamServerCache
+        ps = ParamServerCache()
+        notified = []
+        ps.set_notifier(lambda k, v: notified.append((k, v)))
+        ps.set('/a/b', {'c': 1, 'd': {'e': 2}})
+        ps.set('/x', 1)
+        self.assertEquals(1, ps.get('/a/b/c'))
+        self.assertEquals(2, ps.get('/a/b/d/e'))
+        # not set within a cached namespace
+        self.assertEquals({}, ps.get('/a/b/f'))
+        try:
+            ps.get('/a')
+            self.fail("/a is not cached")
+        except KeyError: pass
+
+        # update within the cached namespace, with trailing slash as sent by the master
+        value = ps.get('/a/b')
+        ps.update('/a/b/d/e/', 3)
+        self.assertEquals({'c': 1, 'd': {'e': 3}}, ps.get('/a/b'))
+        self.assertEquals([('/a/b', {'c': 1, 'd': {'e': 3}})], notified)
+        # values returned earlier are not modified
+        self.assertEquals(2, value['d']['e'])
+        # update of a namespace containing the cached key
+        ps.update('/a/', {'b': {'c': 4}})
+        self.assertEquals({'c': 4}, ps.get('/a/b'))
+        self.assertEquals(1, ps.get('/x'))
+        # deletion
+        ps.update('/a/b/', {})
+        self.assertEquals({}, ps.get('/a/b'))
+        ps.update('/', {'x': 2})
+        self.assertEquals(2, ps.get('/x'))
+        self.assertEquals({}, ps.get('/a/b'))
+        # keys the cache is not subscribed to
+        try:
+            ps.update('/y/', 1)
+            self.fail("should have raised")
+        except KeyError: pass
+        try:
+            ps.update('/ab/', 1)
+            self.fail("should have raised")
+        except KeyError: pass
+
+        # updates received while subscribing are applied once subscribed
+        ps.subscribing('/s')
+        ps.update('/s/t/', 5)
+        ps.set('/s', {'t': 1, 'u': 2})
+        self.assertEquals({'t': 5, 'u': 2}, ps.get('/s'))
+        ps.subscribing('/z')
+        ps.cancel_subscribing('/z')
+        try:
+            ps.update('/z/', 1)
+            self.fail("should have raised")
+        except KeyError: pass
+        # concurrent subscriptions: the value of the last one to be
+        # set may be older than updates applied since the first one
+        ps.subscribing('/r')
+        ps.subscribing('/r')
+        ps.subscribing('/r')
+        ps.update('/r/', 1)
+        ps.cancel_subscribing('/r')
+        ps.update('/r/', 2)
+        ps.set('/r', 2)
+        ps.update('/r/', 3)
+        ps.set('/r', 2)
+        self.assertEquals(3, ps.get('/r'))
+        self.failIf(ps._subscribing)
+
+        # hits and misses
+        self.assertEquals(5, ps.get_cached('/s/t'))
+        self.assertEquals(2, ps.get_cached('/x'))
+        try:
+            ps.get_cached('/q')
+            self.fail("should have raised")
+        except KeyError: pass
+        self.assertEquals(2, ps.stat_hits)
+        self.assertEquals(1, ps.stat_misses)
+
+    def test_MasterProxy_unsubscribe(self):
+        import rospy.core
+        import rospy.impl.paramserver
+        from rospy.msproxy import MasterProxy
+
+        test = self
+        class Master(object):
+            def __init__(self):
+                self.subscribed = set()
+                # system.multicall
+                self.system = self
+            def subscribeParam(self, caller_id, caller_api, key):
+                self.subscribed.add(key)
+                return 1, '', {'b': 1}
+            def multicall(self, calls):
+                for call in calls:
+                    test.assertEquals('unsubscribeParam', call['methodName'])
+                    self.subscribed.discard(call['params'][2])
+                return [[[1, '', 1]] for call in calls]
+
+        master = Master()
+        proxy = MasterProxy('http://localhost:11311')
+        proxy.target = master
+        cache = rospy.impl.paramserver.get_param_server_cache()
+        cache.clear()
+        uri = rospy.core.get_node_uri()
+        rospy.core.set_node_uri('http://localhost:1234/')
+        try:
+            self.assertEquals({'b': 1}, proxy.get_cached('/unsub/a'))
+            self.assertEquals(1, proxy.get_cached('/unsub/a/b'))
+            self.assertEquals({'b': 1}, proxy.get_cached('/unsub/c'))
+            self.assertEquals(set(['/unsub/a', '/unsub/c']), master.subscribed)
+            self.assert_(proxy._unsubscribe_params in rospy.core._preshutdown_hooks)
+            self.assertEquals(1, rospy.core._preshutdown_hooks.count(proxy._unsubscribe_params))
+
+            # cached parameters are unsubscribed on shutdown
+            proxy._unsubscribe_params('test')
+            self.assertEquals(set(), master.subscribed)
+            self.assertEquals([], cache.clear())
+        finally:
+            rospy.core._preshutdown_hooks.remove(proxy._unsubscribe_params)
+            rospy.core.set_node_uri(uri)
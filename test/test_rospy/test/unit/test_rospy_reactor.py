@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2008, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import socket
+import threading
+import unittest
+
+import rospy.exceptions
+from rospy.exceptions import TransportTerminated
+
+class FakeTransport(object):
+    def __init__(self, sock):
+        self.socket = sock
+        self.done = False
+        self.name = 'fake'
+        self.endpoint_id = 'fake'
+        self.reactor = None
+    def receive_ready(self):
+        d = self.socket.recv(4096)
+        if not d:
+            raise TransportTerminated("closed")
+        return list(d.decode())
+    def _reconnect(self):
+        pass
+    def close(self):
+        self.done = True
+
+class TestRospyReactor(unittest.TestCase):
+
+    def test_IOReactor(self):
+        from rospy.impl.reactor import IOReactor, is_reactor_supported
+        if not is_reactor_supported():
+            return
+        try:
+            IOReactor(0)
+            self.fail("should have raised ValueError")
+        except ValueError:
+            pass
+
+        r = IOReactor(2)
+        self.assertEquals(2, r.get_num_threads())
+
+        received = {}
+        cond = threading.Condition()
+        def callback(msgs, transport):
+            with cond:
+                received.setdefault(transport, []).extend(msgs)
+                cond.notify_all()
+        def wait_for(transport, count):
+            with cond:
+                for _ in range(50):
+                    if len(received.get(transport, [])) >= count:
+                        break
+                    cond.wait(0.1)
+
+        pairs = [socket.socketpair() for _ in range(4)]
+        transports = [FakeTransport(a) for a, b in pairs]
+        for t in transports:
+            r.register(t, callback)
+        # connections are shared across the I/O threads
+        self.assertEquals(2, len(set(t.reactor for t in transports)))
+
+        for i, (a, b) in enumerate(pairs):
+            b.sendall(('%d' % i).encode())
+        for i, t in enumerate(transports):
+            wait_for(t, 1)
+            self.assertEquals(['%d' % i], received[t])
+
+        # messages arriving in pieces are delivered as they are read
+        t = transports[0]
+        pairs[0][1].sendall(b'ab')
+        wait_for(t, 3)
+        pairs[0][1].sendall(b'c')
+        wait_for(t, 4)
+        self.assertEquals(['0', 'a', 'b', 'c'], received[t])
+
+        # removed connections are no longer read
+        t.reactor.call_soon(t.reactor.remove, t, t.socket)
+        pairs[1][1].sendall(b'x')
+        wait_for(transports[1], 2)
+        pairs[0][1].sendall(b'd')
+        self.assertEquals(['1', 'x'], received[transports[1]])
+        self.assertEquals(['0', 'a', 'b', 'c'], received[t])
+
+        for a, b in pairs:
+            a.close()
+            b.close()
+
+class FakePubTransport(object):
+    def __init__(self, sock):
+        self.socket = sock
+        self.done = False
+        self.name = 'fake'
+        self.endpoint_id = 'fake'
+        self.stat_bytes = 0
+        self.stat_num_msg = 0
+        self.cleanup_cb = None
+    def set_cleanup_callback(self, cb):
+        self.cleanup_cb = cb
+    def close(self):
+        if not self.done:
+            self.done = True
+            self.socket.close()
+            self.socket = None
+            if self.cleanup_cb:
+                self.cleanup_cb(self)
+
+class TestRospyAsyncConnection(unittest.TestCase):
+
+    def _read(self, sock, n):
+        data = b''
+        while len(data) < n:
+            data += sock.recv(n - len(data))
+        return data
+
+    def _wait(self, fn):
+        import time
+        for _ in range(50):
+            if fn():
+                return
+            time.sleep(0.1)
+
+    def test_AsyncConnection(self):
+        from rospy.impl.reactor import IOReactor, is_reactor_supported
+        from rospy.impl.tcpros_pubsub import AsyncConnection, DROP_OLDEST, DROP_NEWEST, DISCONNECT
+        if not is_reactor_supported():
+            return
+        loop = IOReactor(1).get_loop()
+        try:
+            AsyncConnection(FakePubTransport(socket.socketpair()[0]), loop, drop_policy='bad')
+            self.fail("should have raised ValueError")
+        except ValueError:
+            pass
+
+        # data is sent in order
+        a, b = socket.socketpair()
+        t = FakePubTransport(a)
+        c = AsyncConnection(t, loop)
+        msgs = [(b'%d' % i) * 1000 for i in range(100)]
+        for m in msgs:
+            c.write_data(m)
+        self.assertEquals(b''.join(msgs), self._read(b, sum(len(m) for m in msgs)))
+        self._wait(lambda: t.stat_num_msg == 100)
+        self.assertEquals(100, t.stat_num_msg)
+        self.assertEquals(sum(len(m) for m in msgs), t.stat_bytes)
+        self.assertEquals('fake', c.endpoint_id)
+        b.close()
+        c.close()
+
+        # slow subscriber: the socket is not read while publishing
+        big = b'x' * 1000000
+        for policy in [DROP_OLDEST, DROP_NEWEST]:
+            a, b = socket.socketpair()
+            t = FakePubTransport(a)
+            c = AsyncConnection(t, loop, queue_size=2, drop_policy=policy)
+            c.write_data(big)
+            self._wait(lambda: c._offset > 0)
+            c.write_data(b'1' * 10)
+            c.write_data(b'2' * 10)
+            c.write_data(b'3' * 10)
+            self.assertEquals(1, c.stat_dropped)
+            expected = b'2' * 10 + b'3' * 10 if policy == DROP_OLDEST else b'1' * 10 + b'2' * 10
+            self.assertEquals(big + expected, self._read(b, len(big) + 20))
+            b.close()
+            c.close()
+
+        a, b = socket.socketpair()
+        t = FakePubTransport(a)
+        c = AsyncConnection(t, loop, max_queued_bytes=100, drop_policy=DISCONNECT)
+        c.write_data(big)
+        try:
+            c.write_data(b'1' * 10)
+            self.fail("should have raised TransportTerminated")
+        except rospy.exceptions.TransportTerminated:
+            pass
+        self.assert_(t.done)
+        b.close()
+
+        # peer closed
+        a, b = socket.socketpair()
+        t = FakePubTransport(a)
+        c = AsyncConnection(t, loop)
+        b.close()
+        c.write_data(big)
+        self._wait(lambda: t.done)
+        self.assert_(t.done)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2008, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import struct
+import unittest
+
+class TestRospyShmros(unittest.TestCase):
+
+    def test_Segment(self):
+        from rospy.impl.shmros import _Segment
+        if not os.path.isdir('/dev/shm'):
+            return
+        pub = _Segment.create(size=100)
+        path = pub.path
+        self.assert_(os.path.exists(path))
+        # nothing is written until the subscriber has mapped the ring
+        self.assertEquals(None, pub.write(b'x' * 10))
+        sub = _Segment.attach(path, 100)
+        self.failIf(os.path.exists(path))
+        try:
+            _Segment.attach(path, 100)
+            self.fail("should have raised")
+        except EnvironmentError:
+            pass
+
+        self.assertEquals(0, pub.write(b'a' * 40))
+        self.assertEquals(40, pub.write(b'b' * 40))
+        # too large, and no room until the subscriber releases
+        self.assertEquals(None, pub.write(b'c' * 101))
+        self.assertEquals(None, pub.write(b'c' * 30))
+        self.assertEquals(b'a' * 40, sub.read(0, 40))
+        sub.release(40)
+        # does not fit before the end of the ring: starts over at its beginning
+        self.assertEquals(100, pub.write(b'c' * 30))
+        self.assertEquals(b'c' * 30, sub.read(100, 30))
+        self.assertEquals(b'b' * 40, sub.read(40, 40))
+        sub.release(130)
+        # starts over at the beginning of the ring once it is empty
+        self.assertEquals(200, pub.write(b'd' * 20))
+        self.assertEquals(220, pub.write(b'e' * 70))
+        self.assertEquals(b'd' * 20, sub.read(200, 20))
+        self.assertEquals(b'e' * 70, sub.read(220, 70))
+        pub.close()
+        sub.close()
+
+    def test_Segment_attach(self):
+        import tempfile
+        from rospy.impl.shmros import _Segment
+        if not os.path.isdir('/dev/shm'):
+            return
+        d = tempfile.mkdtemp()
+        try:
+            # only files created by _Segment.create are opened
+            paths = [os.path.join(d, 'rospy-shmros-x'),
+                     '/dev/shm/../' + os.path.relpath(d, '/') + '/rospy-shmros-x',
+                     '/dev/shm/rospy-shmros-x/../../' + os.path.relpath(d, '/') + '/rospy-shmros-x']
+            with open(paths[0], 'wb') as f:
+                f.write(b'\0' * 164)
+            for path in paths:
+                try:
+                    _Segment.attach(path, 100)
+                    self.fail("should have raised: %s" % path)
+                except EnvironmentError:
+                    pass
+            # nor symbolic links or special files in /dev/shm
+            fd, link = tempfile.mkstemp(prefix='rospy-shmros-', dir='/dev/shm')
+            os.close(fd)
+            os.unlink(link)
+            os.symlink(paths[0], link)
+            try:
+                _Segment.attach(link, 100)
+                self.fail("should have raised")
+            except EnvironmentError:
+                pass
+            finally:
+                os.unlink(link)
+            fifo = link + 'fifo'
+            os.mkfifo(fifo)
+            try:
+                _Segment.attach(fifo, 100)
+                self.fail("should have raised")
+            except EnvironmentError:
+                pass
+            finally:
+                os.unlink(fifo)
+            with open(paths[0], 'rb') as f:
+                self.assertEquals(b'\0' * 164, f.read())
+        finally:
+            shutil.rmtree(d)
+
+    def test_Segment_reserve(self):
+        import errno
+        import glob
+        import rospy.impl.shmros
+        from rospy.impl.shmros import _Segment, _RESERVE_SIZE
+        if not os.path.isdir('/dev/shm'):
+            return
+        reserve = rospy.impl.shmros._reserve
+        def no_space(fd, offset, length):
+            raise OSError(errno.ENOSPC, 'No space left on device')
+
+        # running out of space is an error, not SIGBUS on first write
+        files = glob.glob('/dev/shm/rospy-shmros-*')
+        rospy.impl.shmros._reserve = no_space
+        try:
+            _Segment.create(size=100)
+            self.fail("should have raised")
+        except EnvironmentError:
+            pass
+        finally:
+            rospy.impl.shmros._reserve = reserve
+        self.assertEquals(files, glob.glob('/dev/shm/rospy-shmros-*'))
+
+        # pages are allocated as the ring is used
+        size = 4 * _RESERVE_SIZE
+        pub = _Segment.create(size=size)
+        sub = _Segment.attach(pub.path, size)
+        self.assertEquals(0, pub.reserved)
+        self.assertEquals(0, pub.write(b'a' * 10))
+        self.assertEquals(_RESERVE_SIZE, pub.reserved)
+        rospy.impl.shmros._reserve = no_space
+        try:
+            # messages that do not fit in the allocated pages are not written
+            self.assertEquals(None, pub.write(b'b' * (_RESERVE_SIZE + 1)))
+            self.assertEquals(10, pub.write(b'c' * 10))
+            sub.release(20)
+            # nor when starting over at the beginning of the ring
+            self.assertEquals(None, pub.write(b'b' * (_RESERVE_SIZE + 1)))
+            self.assertEquals(20, struct.unpack_from('<Q', sub.mm, 0)[0])
+        finally:
+            rospy.impl.shmros._reserve = reserve
+        self.assertEquals(size, pub.write(b'b' * (_RESERVE_SIZE + 1)))
+        self.assertEquals(2 * _RESERVE_SIZE, pub.reserved)
+        self.assertEquals(b'b' * (_RESERVE_SIZE + 1), sub.read(size, _RESERVE_SIZE + 1))
+        pub.close()
+        sub.close()
+        self.assertEquals(None, pub.fd)
+
+    def test_deserialize_messages(self):
+        from std_msgs.msg import String
+        from rospy.msg import ReceiveBuffer
+        from rospy.impl.shmros import _Segment, _deserialize_messages, _SHM_FRAME
+        if not os.path.isdir('/dev/shm'):
+            return
+        pub = _Segment.create(size=1000)
+        sub = _Segment.attach(pub.path, 1000)
+        def frame(s):
+            return struct.pack('<II', len(s) + 4, len(s)) + s
+        def descriptor(s):
+            body = frame(s)[4:]
+            return struct.pack('<IQI', _SHM_FRAME, pub.write(body), len(body))
+
+        b = ReceiveBuffer()
+        b.write(frame(b'inline') + descriptor(b'shm1') + descriptor(b'shm2') + frame(b'inline2'))
+        last = descriptor(b'shm3')
+        b.write(last[:6])
+        msg_queue = []
+        _deserialize_messages(b, msg_queue, String, sub)
+        self.assertEquals(['inline', 'shm1', 'shm2', 'inline2'], [m.data for m in msg_queue])
+        self.assertEquals(6, b.tell())
+        self.assertEquals(len(last), b.expected)
+
+        # dropped messages still release the ring
+        b.write(last[6:])
+        b.write(descriptor(b'shm4'))
+        msg_queue = []
+        _deserialize_messages(b, msg_queue, String, sub, queue_size=1)
+        self.assertEquals(['shm4'], [m.data for m in msg_queue])
+        self.assertEquals(0, b.tell())
+        self.assertEquals(pub.head, struct.unpack_from('<Q', sub.mm, 0)[0])
+
+        import genpy
+        b.write(descriptor(b'shm5'))
+        try:
+            _deserialize_messages(b, [], String, None)
+            self.fail("should have raised")
+        except genpy.DeserializationError:
+            pass
+        pub.close()
+        sub.close()
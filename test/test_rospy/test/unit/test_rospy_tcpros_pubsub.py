@@ -235,3 +235,110 @@ class TestRospyTcprosPubsub(unittest.TestCase):
         self.assertEquals('fuga', fields['hoge'])
         self.assertEquals('baz', fields['foo'])        
             
+
+    def test_QueuedConnection(self):
+        import threading
+        import rospy.exceptions
+        from rospy.impl.tcpros_pubsub import QueuedConnection, _SenderPool
+
+        class FakeConnection(object):
+            def __init__(self):
+                self.done = False
+                self.data = []
+                self.gate = threading.Event()
+                self.gate.set()
+                self.cleanup_cb = None
+            def set_cleanup_callback(self, cb):
+                self.cleanup_cb = cb
+            def write_data(self, data):
+                self.gate.wait()
+                if data == b'error':
+                    raise rospy.exceptions.TransportTerminated('error')
+                self.data.append(data)
+
+        def wait_for(fn):
+            for _ in range(50):
+                if fn():
+                    return
+                time.sleep(0.1)
+
+        # many connections share the pool's threads
+        pool = _SenderPool(max_threads=2)
+        conns = [FakeConnection() for _ in range(10)]
+        qcs = [QueuedConnection(c, 0, pool=pool) for c in conns]
+        for i in range(100):
+            for qc in qcs:
+                qc.write_data(i)
+        for c in conns:
+            wait_for(lambda: len(c.data) == 100)
+            self.assertEquals(list(range(100)), c.data)
+        self.assertEquals(2, pool._num_threads)
+        self.assertEquals(conns[0].done, qcs[0].done)
+
+        # drop-oldest at queue_size
+        c = FakeConnection()
+        c.gate.clear()
+        qc = QueuedConnection(c, 3, pool=pool)
+        qc.write_data(0)
+        wait_for(lambda: not qc._queue)
+        for i in range(1, 10):
+            qc.write_data(i)
+        c.gate.set()
+        wait_for(lambda: len(c.data) == 4)
+        self.assertEquals([0, 7, 8, 9], c.data)
+
+        # errors are raised on the next write
+        qc.write_data(b'error')
+        wait_for(lambda: qc._error is not None)
+        try:
+            qc.write_data(10)
+            self.fail("should have raised")
+        except rospy.exceptions.TransportTerminated:
+            pass
+
+    def test_QueuedConnection_blocked(self):
+        import threading
+        from rospy.impl.tcpros_pubsub import QueuedConnection, _SenderPool
+
+        class SocketConnection(object):
+            # subscriber connection whose peer never reads
+            def __init__(self):
+                self.done = False
+                self.socket, self.peer = socket.socketpair()
+                self.sent = []
+            def set_cleanup_callback(self, cb):
+                pass
+            def write_data(self, data):
+                self.socket.sendall(data)
+                self.sent.append(data)
+
+        def wait_for(fn):
+            for _ in range(100):
+                if fn():
+                    return True
+                time.sleep(0.1)
+            return False
+
+        pool = _SenderPool(max_threads=2)
+        blocked = [SocketConnection() for _ in range(2)]
+        try:
+            # block every pool thread on a full socket buffer
+            for c in blocked:
+                QueuedConnection(c, 0, pool=pool).write_data(b'x' * (16 * 1024 * 1024))
+            self.assert_(wait_for(lambda: pool._num_threads == 2 and not pool._ready))
+
+            # other connections keep draining
+            conns = [SocketConnection() for _ in range(3)]
+            for c in conns:
+                qc = QueuedConnection(c, 0, pool=pool)
+                for i in range(3):
+                    qc.write_data(b'%d'%i)
+            for c in conns:
+                self.assert_(wait_for(lambda: len(c.sent) == 3))
+                self.assertEquals(b'012', c.peer.recv(3))
+            self.assertEquals([], blocked[0].sent)
+        finally:
+            for c in blocked:
+                c.peer.close()
+        # threads started for blocked connections exit once idle
+        self.assert_(wait_for(lambda: pool._num_threads == 2))
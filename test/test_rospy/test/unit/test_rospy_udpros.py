@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2008, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import socket
+import struct
+import unittest
+
+class TestRospyUdpros(unittest.TestCase):
+
+    def test_header(self):
+        from rospy.impl.udpros import _encode_header, _decode_header
+        try:
+            from xmlrpc.client import Binary
+        except ImportError:
+            from xmlrpclib import Binary
+        fields = {'topic': '/chatter', 'md5sum': '*', 'callerid': '/node'}
+        data = _encode_header(fields)
+        # no length of the whole header, as for roscpp
+        self.assertEquals(len('topic=/chatter'), struct.unpack('<I', data[:4])[0])
+        self.assertEquals(fields, _decode_header(data))
+        self.assertEquals(fields, _decode_header(Binary(data)))
+
+    def _sockets(self):
+        from rospy.impl.transport import INBOUND, OUTBOUND
+        from rospy.impl.udpros import UDPROSTransport
+        from std_msgs.msg import String
+        sub_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sub_sock.bind(('127.0.0.1', 0))
+        sub_sock.settimeout(1.0)
+        pub_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        pub_sock.connect(sub_sock.getsockname())
+        pub = UDPROSTransport(OUTBOUND, '/chatter', pub_sock, 7, 20)
+        sub = UDPROSTransport(INBOUND, '/chatter', sub_sock, 7, 20, String, {'callerid': '/pub', 'latching': '1'})
+        return pub, sub
+
+    def _serialize(self, msg):
+        try:
+            from cStringIO import StringIO
+        except ImportError:
+            from io import BytesIO as StringIO
+        from rospy.msg import serialize_message
+        b = StringIO()
+        serialize_message(b, 0, msg)
+        return b.getvalue()
+
+    def test_fragmentation(self):
+        from std_msgs.msg import String
+        pub, sub = self._sockets()
+        try:
+            data = self._serialize(String('hello world, this is a long message'))
+            pub.write_data(data)
+            self.assertEquals(len(data), pub.stat_bytes)
+            self.assertEquals(1, pub.stat_num_msg)
+            msgs = sub.receive_once()
+            self.assertEquals(['hello world, this is a long message'], [m.data for m in msgs])
+            self.assertEquals({'callerid': '/pub', 'latching': '1'}, msgs[0]._connection_header)
+            self.assertEquals(msgs[0], sub.latch)
+            self.assertEquals(1, sub.stat_num_msg)
+            self.assertEquals(0, sub.stat_dropped)
+
+            # datagrams of other connections are ignored
+            other = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            other.sendto(struct.pack('<IBBH', 8, 0, 1, 1) + data, sub.socket.getsockname())
+            other.close()
+            pub.write_data(self._serialize(String('x')))
+            self.assertEquals(['x'], [m.data for m in sub.receive_once()])
+        finally:
+            pub.close()
+            sub.close()
+        self.assert_(pub.done)
+        self.assertEquals(None, pub.socket)
+
+    def test_drop(self):
+        from std_msgs.msg import String
+        pub, sub = self._sockets()
+        try:
+            data = self._serialize(String('twenty characters...'))
+            # lose the second datagram of the message
+            header = struct.Struct('<IBBH')
+            pub.socket.send(header.pack(7, 0, 1, 3) + data[:12])
+            pub.socket.send(header.pack(7, 1, 1, 2) + data[24:36])
+            # start of the next message
+            pub.socket.send(header.pack(7, 0, 2, 3) + data[:12])
+            pub.socket.send(header.pack(7, 1, 2, 1) + data[12:24])
+            pub.socket.send(header.pack(7, 1, 2, 2) + data[24:])
+            msgs = sub.receive_once()
+            self.assertEquals(['twenty characters...'], [m.data for m in msgs])
+            self.assertEquals(1, sub.stat_dropped)
+        finally:
+            pub.close()
+            sub.close()
+
+    def test_drop_full_buffer(self):
+        import threading
+        from rospy.impl.transport import OUTBOUND
+        from rospy.impl.udpros import UDPROSTransport
+        if not hasattr(socket, 'AF_UNIX'):
+            return
+        # datagram socket whose peer never reads
+        pub_sock, sub_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        pub = UDPROSTransport(OUTBOUND, '/chatter', pub_sock, 7, 1500)
+        self.assertEquals(0.0, pub_sock.gettimeout())
+        def publish():
+            for _ in range(10000):
+                pub.write_data(b'x' * 1000)
+        try:
+            t = threading.Thread(target=publish)
+            t.daemon = True
+            t.start()
+            t.join(10.0)
+            # messages are dropped instead of blocking the publisher
+            self.failIf(t.is_alive())
+            self.assert_(pub.stat_dropped > 0)
+            self.assertEquals(10000, pub.stat_num_msg + pub.stat_dropped)
+            self.failIf(pub.done)
+        finally:
+            pub.close()
+            sub_sock.close()
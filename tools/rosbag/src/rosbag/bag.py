@@ -38,10 +38,14 @@ Provides serialization of bag files.
 
 from __future__ import print_function
 
+import array
 import bisect
 import bz2
 import collections
 import heapq
+import itertools
+import mmap
+import operator
 import os
 import re
 import struct
@@ -55,6 +59,16 @@ try:
 except ImportError:
     from io import BytesIO as StringIO  # Python 3.x
 
+try:
+    import Queue as queue  # Python 2.x
+except ImportError:
+    import queue  # Python 3.x
+
+try:
+    from itertools import imap, izip  # Python 2.x
+except ImportError:
+    imap, izip = map, zip  # Python 3.x
+
 import genmsg
 import genpy
 import genpy.dynamic
@@ -109,7 +123,8 @@ class Bag(object):
     """
     Bag serialize messages to and from a single file on disk using the bag format.
     """
-    def __init__(self, f, mode='r', compression=Compression.NONE, chunk_threshold=768 * 1024, allow_unindexed=False, options=None, skip_index=False):
+    def __init__(self, f, mode='r', compression=Compression.NONE, chunk_threshold=768 * 1024, allow_unindexed=False, options=None, skip_index=False,
+                 chunk_cache_size=8 * 1024 * 1024, compression_threads=0, max_pending_chunks=4, index_cache=False):
         """
         Open a bag file.  The mode can be 'r', 'w', or 'a' for reading (default),
         writing or appending.  The file will be created if it doesn't exist
@@ -130,6 +145,16 @@ class Bag(object):
         @type  options: dict
         @param skip_index: if True, don't read the connection index records on open [2.0+]
         @type  skip_index: bool
+        @param chunk_cache_size: maximum number of bytes of decompressed chunks to keep in memory when reading [2.0+]
+        @type  chunk_cache_size: int
+        @param compression_threads: number of background threads compressing chunks when writing, or 0 to compress
+            inline as messages are written
+        @type  compression_threads: int
+        @param max_pending_chunks: maximum number of chunks waiting on the compression threads before writing blocks
+        @type  max_pending_chunks: int
+        @param index_cache: if True, save the bag index to a sidecar file (the bag filename with .idx appended) when
+            the bag is first opened, and read it from there on later opens while the bag is unchanged [2.0+, reading only]
+        @type  index_cache: bool
         @raise ValueError: if any argument is invalid
         @raise ROSBagException: if an error occurs opening file
         @raise ROSBagFormatException: if bag format is corrupted
@@ -158,6 +183,20 @@ class Bag(object):
         self._chunk_threshold = chunk_threshold
 
         self._skip_index = skip_index
+        self._index_cache = index_cache
+
+        if chunk_cache_size < 0:
+            raise ValueError('chunk_cache_size must be greater than or equal to zero')
+        self._chunk_cache_size = chunk_cache_size
+
+        if compression_threads < 0:
+            raise ValueError('compression_threads must be greater than or equal to zero')
+        if max_pending_chunks < 1:
+            raise ValueError('max_pending_chunks must be greater than zero')
+        self._compression_threads = compression_threads
+        self._max_pending_chunks  = max_pending_chunks
+        self._compression_pool    = None
+        self._pending_chunks      = collections.deque()   # (job, ChunkInfo, uncompressed_size, connection indexes) in file order
 
         self._reader          = None
 
@@ -250,7 +289,8 @@ class Bag(object):
         
     chunk_threshold = property(_get_chunk_threshold, _set_chunk_threshold)
 
-    def read_messages(self, topics=None, start_time=None, end_time=None, connection_filter=None, raw=False):
+    def read_messages(self, topics=None, start_time=None, end_time=None, connection_filter=None, raw=False, order='time',
+                      executor=None, prefetch_chunks=8):
         """
         Read messages from the bag, optionally filtered by topic, timestamp and connection details.
         @param topics: list of topics or a single topic. if an empty list is given all topics will be read [optional]
@@ -263,19 +303,35 @@ class Bag(object):
         @type  connection_filter: function taking (topic, datatype, md5sum, msg_def, header) and returning bool
         @param raw: if True, then generate tuples of (datatype, (data, md5sum, position), pytype)
         @type  raw: bool
+        @param order: 'time' to return messages in timestamp order, or 'file' to return them in the order they are
+            stored, reading each chunk once sequentially.  In 'file' order messages from different chunks are not
+            merged by timestamp [optional, 2.0+]
+        @type  order: str
+        @param executor: executor (e.g. a concurrent.futures.ThreadPoolExecutor or ProcessPoolExecutor) on which to
+            decompress upcoming chunks ahead of the consumer.  Messages are still returned in the requested order [optional, 2.0+]
+        @type  executor: concurrent.futures.Executor
+        @param prefetch_chunks: maximum number of chunks to decompress ahead when an executor is given [optional]
+        @type  prefetch_chunks: int
         @return: generator of BagMessage(topic, message, timestamp) namedtuples for each message in the bag file
         @rtype:  generator of tuples of (str, U{genpy.Message}, U{genpy.Time}) [not raw] or (str, (str, str, str, tuple, class), U{genpy.Time}) [raw]
+        @raise ValueError: if order is invalid
         """
+        if order not in ('time', 'file'):
+            raise ValueError('order must be one of: time, file')
+        if prefetch_chunks < 1:
+            raise ValueError('prefetch_chunks must be greater than zero')
+
         self.flush()
 
         if topics and type(topics) is str:
             topics = [topics]
         
-        return self._reader.read_messages(topics, start_time, end_time, connection_filter, raw)
+        return self._reader.read_messages(topics, start_time, end_time, connection_filter, raw, order, executor, prefetch_chunks)
 
     def flush(self):
         """
         Write the open chunk to disk so subsequent reads will read all messages.
+        Waits for any chunks being compressed in the background to be written.
         @raise ValueError: if bag is closed 
         """
         if not self._file:
@@ -284,6 +340,9 @@ class Bag(object):
         if self._chunk_open:
             self._stop_writing_chunk()
 
+        while self._pending_chunks:
+            self._write_pending_chunk()
+
     def write(self, topic, msg, t=None, raw=False):
         """
         Write a message to the bag.
@@ -329,7 +388,7 @@ class Bag(object):
             connection_info = self._topic_connections[topic]
             conn_id = connection_info.id
         else:
-            conn_id = len(self._connections)
+            conn_id = max(self._connections) + 1 if self._connections else 0
 
             if raw:
                 if pytype is None:
@@ -355,6 +414,163 @@ class Bag(object):
             self._connections[conn_id] = connection_info
             self._topic_connections[topic] = connection_info
 
+        if not raw:
+            # Serialize the message to the buffer
+            self._buffer.seek(0)
+            self._buffer.truncate(0)
+            msg.serialize(self._buffer)
+            serialized_bytes = self._buffer.getvalue()
+
+        self._write_message(conn_id, t, serialized_bytes)
+
+    def copy_messages(self, inbag, topics=None, start_time=None, end_time=None, message_filter=None):
+        """
+        Copy messages from another bag to this bag without deserializing them.  Chunks in which every message is
+        copied are written as they are, without being decompressed.  The messages keep their connections, so this
+        bag must not already have different connections with the same ids.  Yields position of each chunk for progress.
+        @param inbag: bag to copy messages from [2.0 only]
+        @type  inbag: Bag
+        @param topics: list of topics or a single topic. if an empty list is given all topics will be copied [optional]
+        @type  topics: list(str) or str
+        @param start_time: earliest timestamp of message to copy [optional]
+        @type  start_time: U{genpy.Time}
+        @param end_time: latest timestamp of message to copy [optional]
+        @type  end_time: U{genpy.Time}
+        @param message_filter: function which takes (topic, t) and returns whether to copy the message [optional]
+        @type  message_filter: function
+        @raise ValueError: if either bag is closed, or the bags can't be copied between
+        """
+        if not self._file or not inbag._file:
+            raise ValueError('I/O operation on closed bag')
+        if self._mode not in 'wa':
+            raise ValueError('bag not open for writing')
+        if inbag._version != 200:
+            raise ValueError('can only copy messages from a version 2.0 bag')
+
+        if topics and type(topics) is str:
+            topics = [topics]
+
+        connections = dict((c.id, c) for c in inbag._get_connections(topics))
+        for connection_info in connections.values():
+            existing = self._connections.get(connection_info.id)
+            if existing and (existing.topic != connection_info.topic or existing.header != connection_info.header):
+                raise ValueError('connection %d on topic %s differs between the bags' % (connection_info.id, connection_info.topic))
+
+        # The connection record is in the first chunk with a message on the connection
+        chunk_infos = sorted(inbag._chunks, key=lambda c: c.pos)
+        connection_chunk_pos = {}
+        for chunk_info in chunk_infos:
+            for connection_id in chunk_info.connection_counts:
+                connection_chunk_pos.setdefault(connection_id, chunk_info.pos)
+
+        reader = inbag._reader
+        for chunk_info in chunk_infos:
+            yield chunk_info.pos
+
+            if not any(connection_id in connections for connection_id in chunk_info.connection_counts):
+                continue
+            if (start_time and chunk_info.end_time < start_time) or (end_time and chunk_info.start_time > end_time):
+                continue
+
+            # Find the messages to copy from the chunk's index
+            chunk_indexes = reader.read_chunk_connection_indexes(chunk_info)
+            copied_offsets = set()
+            for connection_id, index in chunk_indexes.items():
+                connection_info = connections.get(connection_id)
+                if connection_info is None:
+                    continue
+                lo, hi = _get_index_bounds(index, start_time, end_time)
+                if message_filter is None:
+                    copied_offsets.update(index.offsets[lo:hi])
+                else:
+                    copied_offsets.update(index.offsets[i] for i in range(lo, hi) if message_filter(connection_info.topic, index[i].time))
+            if not copied_offsets:
+                continue
+
+            copy_chunk = len(copied_offsets) == sum(chunk_info.connection_counts.values())
+            for connection_id in chunk_info.connection_counts:
+                if connection_id not in self._connections and connection_chunk_pos[connection_id] != chunk_info.pos:
+                    # The connection record isn't in this chunk; write the messages so it's written too
+                    copy_chunk = False
+
+            if copy_chunk:
+                self._copy_chunk(inbag, chunk_info, chunk_indexes, connections)
+            else:
+                self._copy_chunk_messages(inbag, chunk_info, copied_offsets, connections)
+
+    def _copy_chunk(self, inbag, chunk_info, chunk_indexes, connections):
+        # Close the current chunk, and write out any being compressed, so this chunk is written after them
+        self.flush()
+        self._file.seek(0, os.SEEK_END)
+
+        chunk_header = inbag._chunk_headers[chunk_info.pos]
+
+        chunk_pos = self._file.tell()
+        self._write_chunk_header(_ChunkHeader(chunk_header.compression, chunk_header.compressed_size, chunk_header.uncompressed_size))
+        data_pos = self._file.tell()
+
+        inbag._file.seek(chunk_header.data_pos)
+        remaining = chunk_header.compressed_size
+        while remaining > 0:
+            data = _read(inbag._file, min(remaining, _COPY_BUFFER_SIZE))
+            self._file.write(data)
+            remaining -= len(data)
+
+        copied_chunk_info = _ChunkInfo(chunk_pos, chunk_info.start_time, chunk_info.end_time)
+        copied_chunk_info.connection_counts = dict(chunk_info.connection_counts)
+        self._chunks.append(copied_chunk_info)
+        self._chunk_headers[chunk_pos] = _ChunkHeader(chunk_header.compression, chunk_header.compressed_size, chunk_header.uncompressed_size, data_pos)
+
+        for connection_id, index in chunk_indexes.items():
+            copied_index = _ConnectionIndex200()
+            copied_index.times.extend(index.times)
+            copied_index.chunk_positions.extend(array.array(_UINT64_TYPECODE, [chunk_pos]) * len(index))
+            copied_index.offsets.extend(index.offsets)
+
+            self._write_connection_index_record(connection_id, copied_index)
+
+            if connection_id not in self._connections:
+                connection_info = connections[connection_id]
+                self._connections[connection_id] = connection_info
+                self._topic_connections.setdefault(connection_info.topic, connection_info)
+
+            connection_index = self._connection_indexes.get(connection_id)
+            if connection_index is None:
+                self._connection_indexes[connection_id] = copied_index
+            else:
+                unsorted = connection_index and copied_index.times[0] < connection_index.times[-1]
+                connection_index.extend(copied_index)
+                if unsorted:
+                    connection_index.sort()
+
+    def _copy_chunk_messages(self, inbag, chunk_info, offsets, connections):
+        chunk_header = inbag._chunk_headers[chunk_info.pos]
+        inbag._file.seek(chunk_header.data_pos)
+        chunk = _read(inbag._file, chunk_header.compressed_size)
+        if chunk_header.compression != Compression.NONE:
+            chunk = inbag._reader._decompress_chunk(chunk_header, chunk)
+
+        chunk_file = StringIO(chunk)
+        for offset in sorted(offsets):
+            chunk_file.seek(offset)
+            header = _read_header(chunk_file, _OP_MSG_DATA)
+            connection_id = _read_uint32_field(header, 'conn')
+            t             = _read_time_field  (header, 'time')
+            data          = _read_record_data(chunk_file)
+
+            self._file.seek(0, os.SEEK_END)
+            if not self._chunk_open:
+                self._start_writing_chunk(t)
+
+            if connection_id not in self._connections:
+                connection_info = connections[connection_id]
+                self._write_connection_record(connection_info)
+                self._connections[connection_id] = connection_info
+                self._topic_connections.setdefault(connection_info.topic, connection_info)
+
+            self._write_message(connection_id, t, data)
+
+    def _write_message(self, conn_id, t, serialized_bytes):
         # Create an index entry
         index_entry = _IndexEntry200(t, self._curr_chunk_info.pos, self._get_chunk_offset())
 
@@ -373,10 +589,9 @@ class Bag(object):
 
             self._curr_chunk_info.connection_counts[conn_id] += 1
 
-        if conn_id not in self._connection_indexes:
-            self._connection_indexes[conn_id] = [index_entry]
-        else:
-            bisect.insort_right(self._connection_indexes[conn_id], index_entry)
+        # Chunks being compressed in the background are added to the connection indexes once their position is known
+        if not self._curr_chunk_background:
+            self._add_to_connection_index(conn_id, index_entry)
 
         # Update the chunk start/end times
         if t > self._curr_chunk_info.end_time:
@@ -384,13 +599,6 @@ class Bag(object):
         elif t < self._curr_chunk_info.start_time:
             self._curr_chunk_info.start_time = t
 
-        if not raw:
-            # Serialize the message to the buffer
-            self._buffer.seek(0)
-            self._buffer.truncate(0)
-            msg.serialize(self._buffer)
-            serialized_bytes = self._buffer.getvalue()
-
         # Write message data record
         self._write_message_data_record(conn_id, t, serialized_bytes)
         
@@ -411,9 +619,19 @@ class Bag(object):
         Close the bag file.  Closing an already closed bag does nothing.
         """
         if self._file:
-            if self._mode in 'wa':
-                self._stop_writing()
-            
+            try:
+                if self._mode in 'wa':
+                    self._stop_writing()
+            finally:
+                if self._compression_pool:
+                    self._compression_pool.shutdown()
+                    self._compression_pool = None
+
+                index_cache = getattr(self._reader, 'index_cache', None)
+                if index_cache is not None:
+                    self._reader.index_cache = None
+                    index_cache.close()
+
             self._close_file()
             
     def get_compression_info(self):
@@ -459,6 +677,22 @@ class Bag(object):
                                                            "uncompressed", "compressed"])(compression=compression,
                                                                                           uncompressed=uncompressed, compressed=compressed)
     
+    def get_chunk_cache_info(self):
+        """
+        Returns information about the cache of decompressed chunks used when reading the bag
+        @return: ChunkCacheTuple(hits, misses, size, capacity) giving the number of chunk reads served from the
+            cache, the number of chunks decompressed, the size of the cached chunks in Bytes and the maximum size
+            of the cache in Bytes
+        @rtype: ChunkCacheTuple of (int, int, int, int)
+        """
+        ChunkCacheTuple = collections.namedtuple("ChunkCacheTuple", ["hits", "misses", "size", "capacity"])
+
+        if isinstance(self._reader, _BagReader200):
+            cache = self._reader.chunk_cache
+            return ChunkCacheTuple(hits=cache.hits, misses=cache.misses, size=cache.size, capacity=cache.capacity)
+
+        return ChunkCacheTuple(hits=0, misses=0, size=0, capacity=self._chunk_cache_size)
+
     def get_message_count(self, topic_filters=None):
         """
         Returns the number of messages in the bag. Can be filtered by Topic
@@ -964,6 +1198,13 @@ class Bag(object):
 
     ### Internal API ###
 
+    @property
+    def _index_cache_filename(self):
+        if not self._index_cache or self._mode != 'r' or not self._filename:
+            return None
+
+        return self._filename + '.idx'
+
     @property
     def _has_compressed_chunks(self):
         if not self._chunk_headers:
@@ -1008,22 +1249,28 @@ class Bag(object):
         """
         Yield index entries on the given connections in the given time range.
         """
-        for entry, _ in _mergesort(self._get_indexes(connections), key=lambda entry: entry.time):
-            if start_time and entry.time < start_time:
-                continue
-            if end_time and entry.time > end_time:
-                return
+        indexes = list(self._get_indexes(connections))
+        if all(isinstance(index, _ConnectionIndex200) for index in indexes):
+            for entry in _merge_connection_indexes(indexes, start_time, end_time):
+                yield entry
+            return
+
+        indexes = (_get_index_range(index, start_time, end_time) for index in indexes)
+        for entry, _ in _mergesort(indexes, key=lambda entry: entry.time):
             yield entry
 
     def _get_entries_reverse(self, connections=None, start_time=None, end_time=None):
         """
         Yield index entries on the given connections in the given time range in reverse order.
         """
-        for entry, _ in _mergesort((reversed(index) for index in self._get_indexes(connections)), key=lambda entry: -entry.time.to_sec()):
-            if end_time and entry.time > end_time:
-                continue
-            if start_time and entry.time < start_time:
-                return
+        indexes = list(self._get_indexes(connections))
+        if all(isinstance(index, _ConnectionIndex200) for index in indexes):
+            for entry in _merge_connection_indexes(indexes, start_time, end_time, reverse=True):
+                yield entry
+            return
+
+        indexes = (_get_index_range(index, start_time, end_time, reverse=True) for index in indexes)
+        for entry, _ in _mergesort(indexes, key=lambda entry: -entry.time.to_sec()):
             yield entry
 
     def _get_entry(self, t, connections=None):
@@ -1032,12 +1279,10 @@ class Bag(object):
         """
         indexes = self._get_indexes(connections)
 
-        entry = _IndexEntry(t)
-
         first_entry = None
 
         for index in indexes:
-            i = bisect.bisect_right(index, entry) - 1
+            i = _bisect_index_right(index, t) - 1
             if i >= 0:
                 index_entry = index[i]
                 if first_entry is None or index_entry > first_entry:
@@ -1051,12 +1296,10 @@ class Bag(object):
         """
         indexes = self._get_indexes(connections)
 
-        entry = _IndexEntry(t)
-
         first_entry = None
 
         for index in indexes:
-            i = bisect.bisect_right(index, entry) 
+            i = _bisect_index_right(index, t)
             if i <= len(index) - 1:
                 index_entry = index[i]
                 if first_entry is None or index_entry < first_entry:
@@ -1093,6 +1336,7 @@ class Bag(object):
         self._curr_chunk_info               = None
         self._curr_chunk_data_pos           = None
         self._curr_chunk_connection_indexes = {}
+        self._curr_chunk_background         = False
     
     def _open(self, f, mode, allow_unindexed):
         if not f:
@@ -1293,19 +1537,41 @@ class Bag(object):
         self._file.seek(0, os.SEEK_END)
 
     def _start_writing_chunk(self, t):
-        self._curr_chunk_info = _ChunkInfo(self._file.tell(), t, t)
-        self._write_chunk_header(_ChunkHeader(self._compression, 0, 0))
-        self._curr_chunk_data_pos = self._file.tell()
-        self._set_compression_mode(self._compression)
+        if self._compression_threads > 0 and self._compression != Compression.NONE:
+            # Buffer the chunk in memory; its position is assigned once it's compressed and written
+            if self._compression_pool is None:
+                self._compression_pool = _CompressionPool(self._compression_threads)
+            self._curr_chunk_info = _ChunkInfo(None, t, t)
+            self._curr_chunk_data_pos = 0
+            self._output_file = StringIO()
+            self._curr_chunk_background = True
+        else:
+            self._curr_chunk_info = _ChunkInfo(self._file.tell(), t, t)
+            self._write_chunk_header(_ChunkHeader(self._compression, 0, 0))
+            self._curr_chunk_data_pos = self._file.tell()
+            self._set_compression_mode(self._compression)
+            self._curr_chunk_background = False
         self._chunk_open = True
     
+    def _add_to_connection_index(self, conn_id, index_entry):
+        if conn_id not in self._connection_indexes:
+            self._connection_indexes[conn_id] = _ConnectionIndex200([index_entry])
+        else:
+            self._connection_indexes[conn_id].insort(index_entry)
+
     def _get_chunk_offset(self):
-        if self._compression == Compression.NONE:
+        if self._curr_chunk_background:
+            return self._output_file.tell()
+        elif self._compression == Compression.NONE:
             return self._file.tell() - self._curr_chunk_data_pos
         else:
             return self._output_file.compressed_bytes_in
 
     def _stop_writing_chunk(self):
+        if self._curr_chunk_background:
+            self._stop_writing_chunk_background()
+            return
+
         # Add this chunk to the index
         self._chunks.append(self._curr_chunk_info)
 
@@ -1330,6 +1596,48 @@ class Bag(object):
         # Flag that we're starting a new chunk
         self._chunk_open = False
 
+    def _stop_writing_chunk_background(self):
+        # Hand the chunk to the compression threads
+        uncompressed_chunk = self._output_file.getvalue()
+        self._output_file = self._file
+
+        job = self._compression_pool.submit(self._compression, uncompressed_chunk)
+        self._pending_chunks.append((job, self._curr_chunk_info, len(uncompressed_chunk), self._curr_chunk_connection_indexes))
+        self._curr_chunk_connection_indexes = {}
+
+        # Flag that we're starting a new chunk
+        self._chunk_open = False
+
+        # Block if too many chunks are waiting, then write out any which are ready (in order)
+        while len(self._pending_chunks) > self._max_pending_chunks:
+            self._write_pending_chunk()
+        while self._pending_chunks and self._pending_chunks[0][0].done():
+            self._write_pending_chunk()
+
+    def _write_pending_chunk(self):
+        job, chunk_info, uncompressed_size, connection_indexes = self._pending_chunks.popleft()
+
+        compressed_chunk = job.result()
+
+        self._file.seek(0, os.SEEK_END)
+
+        # Write the chunk now that its position and size are known
+        chunk_info.pos = self._file.tell()
+        self._write_chunk_header(_ChunkHeader(job.compression, len(compressed_chunk), uncompressed_size))
+        chunk_header = _ChunkHeader(job.compression, len(compressed_chunk), uncompressed_size, self._file.tell())
+        self._file.write(compressed_chunk)
+
+        # Add this chunk to the index
+        self._chunks.append(chunk_info)
+        self._chunk_headers[chunk_info.pos] = chunk_header
+
+        # Point the index entries at the chunk and write out the connection indexes
+        for connection_id, entries in connection_indexes.items():
+            for entry in entries:
+                entry.chunk_pos = chunk_info.pos
+                self._add_to_connection_index(connection_id, entry)
+            self._write_connection_index_record(connection_id, entries)
+
     def _set_compression_mode(self, compression):
         # Flush the compressor, if needed
         if self._curr_compression != Compression.NONE:
@@ -1396,9 +1704,14 @@ class Bag(object):
         buffer = self._buffer
         buffer.seek(0)
         buffer.truncate(0)            
-        for entry in entries:
-            buffer.write(_pack_time  (entry.time))
-            buffer.write(_pack_uint32(entry.offset))
+        if isinstance(entries, _ConnectionIndex200):
+            for ns, offset in izip(entries.times, entries.offsets):
+                secs, nsecs = divmod(ns, 1000000000)
+                buffer.write(struct.pack('<LLL', secs, nsecs, offset))
+        else:
+            for entry in entries:
+                buffer.write(_pack_time  (entry.time))
+                buffer.write(_pack_uint32(entry.offset))
             
         _write_record(self._file, header, buffer.getvalue())            
 
@@ -1448,6 +1761,10 @@ _FILE_HEADER_LENGTH  = 4096
 _INDEX_VERSION       = 1
 _CHUNK_INDEX_VERSION = 1
 
+_COPY_BUFFER_SIZE    = 1024 * 1024
+
+_INDEX_CACHE_VERSION = '#ROSBAG INDEX V1.2'
+
 class _ConnectionInfo(object):
     def __init__(self, id, topic, header):
         try:
@@ -1563,7 +1880,108 @@ class _IndexEntry200(_IndexEntry):
 
     def __str__(self):
         return '%d.%d: %d+%d' % (self.time.secs, self.time.nsecs, self.chunk_pos, self.offset)
-    
+
+try:
+    array.array('q')
+    _INT64_TYPECODE, _UINT64_TYPECODE = 'q', 'Q'
+except ValueError:
+    _INT64_TYPECODE, _UINT64_TYPECODE = 'l', 'L'  # Python 2.x has no long long arrays; long is 64-bit on LP64 platforms
+
+# Connection indexes are cached as their arrays' bytes, so a cache is only valid for the same byte order and item sizes
+_INDEX_CACHE_LAYOUT = '%s %d %d %d' % (sys.byteorder, array.array(_INT64_TYPECODE).itemsize,
+                                       array.array(_UINT64_TYPECODE).itemsize, array.array('I').itemsize)
+
+def _array_frombytes(values, data):
+    if hasattr(values, 'frombytes'):
+        values.frombytes(data)
+    else:
+        values.fromstring(data)  # Python 2.x
+
+def _array_tobytes(values):
+    if hasattr(values, 'tobytes'):
+        return values.tobytes()
+    return values.tostring()  # Python 2.x
+
+class _ConnectionIndex200(object):
+    """
+    Sorted index of the messages on a connection, stored in packed arrays rather than as a list of _IndexEntry200.
+    Entries are created on demand when indexed, so this can be used in place of the list.
+    """
+    __slots__ = ['times', 'chunk_positions', 'offsets']
+
+    def __init__(self, entries=None):
+        self.times           = array.array(_INT64_TYPECODE)   # nanoseconds
+        self.chunk_positions = array.array(_UINT64_TYPECODE)
+        self.offsets         = array.array('I')
+
+        if entries:
+            self.extend(entries)
+
+    def add(self, t, chunk_pos, offset):
+        """
+        Append an entry.  Callers are responsible for keeping the index sorted.
+        """
+        self.times.append(t.secs * 1000000000 + t.nsecs)
+        self.chunk_positions.append(chunk_pos)
+        self.offsets.append(offset)
+
+    def append(self, entry):
+        self.add(entry.time, entry.chunk_pos, entry.offset)
+
+    def extend(self, entries):
+        if isinstance(entries, _ConnectionIndex200):
+            self.times.extend(entries.times)
+            self.chunk_positions.extend(entries.chunk_positions)
+            self.offsets.extend(entries.offsets)
+        else:
+            for entry in entries:
+                self.append(entry)
+
+    def insort(self, entry):
+        """
+        Insert an entry after any entries with the same time.
+        """
+        ns = entry.time.secs * 1000000000 + entry.time.nsecs
+        if not self.times or ns >= self.times[-1]:
+            # Entries are usually added chronologically.  Can skip binary search if so.
+            self.times.append(ns)
+            self.chunk_positions.append(entry.chunk_pos)
+            self.offsets.append(entry.offset)
+        else:
+            i = bisect.bisect_right(self.times, ns)
+            self.times.insert(i, ns)
+            self.chunk_positions.insert(i, entry.chunk_pos)
+            self.offsets.insert(i, entry.offset)
+
+    def sort(self):
+        """
+        Stable sort of the entries by time.
+        """
+        order = sorted(range(len(self.times)), key=self.times.__getitem__)
+        for name in self.__slots__:
+            values = getattr(self, name)
+            setattr(self, name, array.array(values.typecode, imap(values.__getitem__, order)))
+
+    def bisect_left(self, t):
+        return bisect.bisect_left(self.times, t.secs * 1000000000 + t.nsecs)
+
+    def bisect_right(self, t):
+        return bisect.bisect_right(self.times, t.secs * 1000000000 + t.nsecs)
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self.times)))]
+
+        secs, nsecs = divmod(self.times[i], 1000000000)
+        return _IndexEntry200(rospy.Time(secs, nsecs), self.chunk_positions[i], self.offsets[i])
+
+    def __iter__(self):
+        for i in range(len(self.times)):
+            yield self[i]
+
 def _get_message_type(info):
     message_type = _message_types.get(info.md5sum)
     if message_type is None:
@@ -1725,7 +2143,7 @@ class _BagReader(object):
     def start_reading(self):
         raise NotImplementedError()
 
-    def read_messages(self, topics, start_time, end_time, connection_filter, raw):
+    def read_messages(self, topics, start_time, end_time, connection_filter, raw, order, executor, prefetch_chunks):
         raise NotImplementedError()
 
     def reindex(self):
@@ -1790,7 +2208,7 @@ class _BagReader102_Unindexed(_BagReader):
             
             offset = f.tell()
 
-    def read_messages(self, topics, start_time, end_time, topic_filter, raw):
+    def read_messages(self, topics, start_time, end_time, topic_filter, raw, order, executor, prefetch_chunks):
         f = self.bag._file
 
         f.seek(self.bag._file_header_pos)
@@ -1892,7 +2310,8 @@ class _BagReader102_Indexed(_BagReader102_Unindexed):
     def __init__(self, bag):
         _BagReader.__init__(self, bag)
 
-    def read_messages(self, topics, start_time, end_time, connection_filter, raw):
+    def read_messages(self, topics, start_time, end_time, connection_filter, raw, order, executor, prefetch_chunks):
+        # Messages are always read via the index, so 'file' order isn't distinguished
         connections = self.bag._get_connections(topics, connection_filter)
         for entry in self.bag._get_entries(connections, start_time, end_time):
             yield self.seek_and_read_message_data_record(entry.offset, raw)
@@ -2082,6 +2501,11 @@ class _BagReader200(_BagReader):
         self.decompressed_chunk     = None
         self.decompressed_chunk_io  = None
 
+        self.chunk_cache = _ChunkCache(bag._chunk_cache_size)
+
+        self.index_cache           = None    # memory-mapped index cache, until the connection indexes are read from it
+        self.index_cache_index_pos = None
+
     def reindex(self):
         """
         Generates all bag index information by rereading the chunks.
@@ -2089,6 +2513,8 @@ class _BagReader200(_BagReader):
         """
         f = self.bag._file
 
+        self.chunk_cache.clear()
+
         f.seek(0, os.SEEK_END)
         total_bytes = f.tell()
 
@@ -2135,13 +2561,9 @@ class _BagReader200(_BagReader):
             compressed_chunk = _read(f, chunk_header.compressed_size)
 
             # Decompress it
-            if chunk_header.compression == Compression.BZ2:
-                self.decompressed_chunk = bz2.decompress(compressed_chunk)
-            elif chunk_header.compression == Compression.LZ4 and found_lz4:
-                self.decompressed_chunk = roslz4.decompress(compressed_chunk)
-            else:
-                raise ROSBagException('unsupported compression type: %s' % chunk_header.compression)
+            self.decompressed_chunk = self._decompress_chunk(chunk_header, compressed_chunk)
 
+            self.decompressed_chunk_pos = None
             if self.decompressed_chunk_io:
                 self.decompressed_chunk_io.close()
             self.decompressed_chunk_io = StringIO(self.decompressed_chunk)
@@ -2167,7 +2589,7 @@ class _BagReader200(_BagReader):
                 if connection_info.id not in self.bag._connections:
                     self.bag._connections[connection_info.id] = connection_info
                 if connection_info.id not in self.bag._connection_indexes:
-                    self.bag._connection_indexes[connection_info.id] = []
+                    self.bag._connection_indexes[connection_info.id] = _ConnectionIndex200()
 
             elif op == _OP_MSG_DATA:
                 # Read the connection id and timestamp from the header
@@ -2195,7 +2617,7 @@ class _BagReader200(_BagReader):
                 # Insert the message entry (in order) into the connection index
                 if connection_id not in self.bag._connection_indexes:
                     raise ROSBagException('connection id (id=%d) in chunk at position %d not preceded by connection record' % (connection_id, chunk_pos))
-                bisect.insort_right(self.bag._connection_indexes[connection_id], _IndexEntry200(t, chunk_pos, offset)) 
+                self.bag._connection_indexes[connection_id].insort(_IndexEntry200(t, chunk_pos, offset))
 
                 expected_index_length += 1
 
@@ -2246,7 +2668,7 @@ class _BagReader200(_BagReader):
                 connection_info = r.read_connection_record(f)
 
                 b._connections[connection_info.id] = connection_info
-                b._connection_indexes[connection_info.id] = []
+                b._connection_indexes[connection_info.id] = _ConnectionIndex200()
 
                 next_op = _peek_next_header_op(f)
                 if next_op != _OP_CONNECTION:
@@ -2285,7 +2707,12 @@ class _BagReader200(_BagReader):
             # Check if the index position has been written, i.e. the bag was closed successfully
             if self.bag._index_data_pos == 0:
                 raise ROSBagUnindexedException()
-    
+
+            if self._read_index_cache():
+                if not self.bag._skip_index:
+                    self._read_connection_index_records()
+                return
+
             # Seek to the end of the chunks
             self.bag._file.seek(self.bag._index_data_pos)
 
@@ -2294,7 +2721,7 @@ class _BagReader200(_BagReader):
             for i in range(self.bag._connection_count):
                 connection_info = self.read_connection_record(self.bag._file)
                 self.bag._connections[connection_info.id] = connection_info
-                self.bag._connection_indexes[connection_info.id] = []
+                self.bag._connection_indexes[connection_info.id] = _ConnectionIndex200()
 
             # Read the chunk info records
             self.bag._chunks = [self.read_chunk_info_record() for i in range(self.bag._chunk_count)]
@@ -2305,13 +2732,19 @@ class _BagReader200(_BagReader):
                 self.bag._file.seek(chunk_info.pos)
                 self.bag._chunk_headers[chunk_info.pos] = self.read_chunk_header()
 
-            if not self.bag._skip_index:
+            # The index cache can only be written once the connection indexes have been read
+            if not self.bag._skip_index or self.bag._index_cache_filename:
                 self._read_connection_index_records()
 
         except Exception as ex:
             raise ROSBagUnindexedException()
 
     def _read_connection_index_records(self):
+        if self.index_cache is not None:
+            self._read_connection_index_records_from_index_cache()
+            return
+
+        unsorted_connection_ids = set()
         for chunk_info in self.bag._chunks:
             self.bag._file.seek(chunk_info.pos)
             _skip_record(self.bag._file)
@@ -2319,7 +2752,14 @@ class _BagReader200(_BagReader):
             self.bag._curr_chunk_info = chunk_info
             for i in range(len(chunk_info.connection_counts)):
                 connection_id, index = self.read_connection_index_record()
-                self.bag._connection_indexes[connection_id].extend(index)
+                connection_index = self.bag._connection_indexes[connection_id]
+                if connection_index and index and index.times[0] < connection_index.times[-1]:
+                    # Chunks overlap in time: keep the index sorted so it can be bisected
+                    unsorted_connection_ids.add(connection_id)
+                connection_index.extend(index)
+
+        for connection_id in unsorted_connection_ids:
+            self.bag._connection_indexes[connection_id].sort()
 
         # Remove any connections with no entries
         # This is a workaround for a bug where connection records were being written for
@@ -2331,10 +2771,306 @@ class _BagReader200(_BagReader):
 
         self.bag._connection_indexes_read = True
 
-    def read_messages(self, topics, start_time, end_time, connection_filter, raw):
+        if self.bag._index_cache_filename:
+            self._write_index_cache()
+
+    def _get_index_cache_key(self):
+        # The index cache is only valid for the bag it was written from, unchanged since
+        st = os.fstat(self.bag._file.fileno())
+        return {
+            'size':        str(st.st_size),
+            'mtime':       repr(st.st_mtime),
+            'index_pos':   str(self.bag._index_data_pos),
+            'conn_count':  str(self.bag._connection_count),
+            'chunk_count': str(self.bag._chunk_count),
+            'layout':      _INDEX_CACHE_LAYOUT
+        }
+
+    def _read_index_cache(self):
+        """
+        Read the connections and chunks from the index cache, if there's a valid one for the bag.
+        The cache is memory-mapped and its connection indexes are read later, when needed.
+        @return: True if the index cache was read
+        """
+        filename = self.bag._index_cache_filename
+        if not filename or not os.path.isfile(filename):
+            return False
+
+        try:
+            with open(filename, 'rb') as f:
+                index_cache = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            return False
+
+        try:
+            if index_cache.readline().rstrip().decode() != _INDEX_CACHE_VERSION:
+                raise ROSBagFormatException('unsupported index cache version')
+
+            header = _read_header(index_cache, _OP_FILE_HEADER)
+            for field, value in self._get_index_cache_key().items():
+                if _read_str_field(header, field) != value:
+                    raise ROSBagFormatException('index cache is out of date')
+            connection_count = _read_uint32_field(header, 'cache_conn_count')
+            _skip_sized(index_cache)
+
+            connections = [self.read_connection_record(index_cache) for i in range(connection_count)]
+            chunks = [self.read_chunk_info_record(index_cache) for i in range(self.bag._chunk_count)]
+
+            chunk_headers = {}
+            for i in range(self.bag._chunk_count):
+                header = _read_header(index_cache, _OP_CHUNK)
+                chunk_pos = _read_uint64_field(header, 'chunk_pos')
+                chunk_headers[chunk_pos] = _ChunkHeader(_read_str_field   (header, 'compression'),
+                                                        _read_uint32_field(header, 'compressed_size'),
+                                                        _read_uint32_field(header, 'size'),
+                                                        _read_uint64_field(header, 'data_pos'))
+                _skip_sized(index_cache)
+
+        except (ROSBagException, struct.error, UnicodeDecodeError):
+            index_cache.close()
+            return False
+
+        self.bag._connection_indexes = {}
+        for connection_info in connections:
+            self.bag._connections[connection_info.id] = connection_info
+            self.bag._connection_indexes[connection_info.id] = _ConnectionIndex200()
+        self.bag._chunks        = chunks
+        self.bag._chunk_headers = chunk_headers
+
+        self.index_cache           = index_cache
+        self.index_cache_index_pos = index_cache.tell()
+
+        return True
+
+    def _read_connection_index_records_from_index_cache(self):
+        index_cache = self.index_cache
+        index_cache.seek(self.index_cache_index_pos)
+
+        for i in range(len(self.bag._connection_indexes)):
+            header = _read_header(index_cache, _OP_INDEX_DATA)
+            connection_id = _read_uint32_field(header, 'conn')
+            size = _read_uint32(index_cache)
+
+            # The data is the index's times, then its chunk positions, then its offsets
+            index = self.bag._connection_indexes[connection_id]
+            values_list = (index.times, index.chunk_positions, index.offsets)
+            count = size // sum(values.itemsize for values in values_list)
+            pos = index_cache.tell()
+            for values in values_list:
+                end = pos + count * values.itemsize
+                _array_frombytes(values, index_cache[pos:end])
+                pos = end
+            index_cache.seek(pos)
+
+        self.index_cache = None
+        index_cache.close()
+
+        self.bag._connection_indexes_read = True
+
+    def _write_index_cache(self):
+        filename = self.bag._index_cache_filename
+
+        # Write to a temporary file first, so a concurrent reader never sees a partial cache
+        temp_filename = '%s.%d.tmp' % (filename, os.getpid())
+        try:
+            with open(temp_filename, 'wb') as f:
+                f.write((_INDEX_CACHE_VERSION + '\n').encode())
+
+                header = {
+                    'op':               _pack_uint8(_OP_FILE_HEADER),
+                    'cache_conn_count': _pack_uint32(len(self.bag._connections))
+                }
+                header.update(self._get_index_cache_key())
+                _write_record(f, header)
+
+                for connection_info in self.bag._connections.values():
+                    _write_header(f, { 'op': _pack_uint8(_OP_CONNECTION), 'topic': connection_info.topic, 'conn': _pack_uint32(connection_info.id) })
+                    _write_header(f, connection_info.header)
+
+                for chunk_info in self.bag._chunks:
+                    header = {
+                        'op':         _pack_uint8 (_OP_CHUNK_INFO),
+                        'ver':        _pack_uint32(_CHUNK_INDEX_VERSION),
+                        'chunk_pos':  _pack_uint64(chunk_info.pos),
+                        'start_time': _pack_time(chunk_info.start_time),
+                        'end_time':   _pack_time(chunk_info.end_time),
+                        'count':      _pack_uint32(len(chunk_info.connection_counts))
+                    }
+                    data = b''.join(_pack_uint32(connection_id) + _pack_uint32(count) for connection_id, count in chunk_info.connection_counts.items())
+                    _write_record(f, header, data)
+
+                for chunk_info in self.bag._chunks:
+                    chunk_header = self.bag._chunk_headers[chunk_info.pos]
+                    header = {
+                        'op':              _pack_uint8(_OP_CHUNK),
+                        'chunk_pos':       _pack_uint64(chunk_info.pos),
+                        'compression':     chunk_header.compression,
+                        'size':            _pack_uint32(chunk_header.uncompressed_size),
+                        'compressed_size': _pack_uint32(chunk_header.compressed_size),
+                        'data_pos':        _pack_uint64(chunk_header.data_pos)
+                    }
+                    _write_record(f, header)
+
+                for connection_id, index in self.bag._connection_indexes.items():
+                    header = {
+                        'op':   _pack_uint8(_OP_INDEX_DATA),
+                        'conn': _pack_uint32(connection_id)
+                    }
+                    data = b''.join(_array_tobytes(values) for values in (index.times, index.chunk_positions, index.offsets))
+                    _write_record(f, header, data)
+
+            os.rename(temp_filename, filename)
+
+        except EnvironmentError:
+            # The cache is only an optimization, e.g. the bag may be in a read-only directory
+            try:
+                os.remove(temp_filename)
+            except OSError:
+                pass
+
+    def read_messages(self, topics, start_time, end_time, connection_filter, raw, order, executor, prefetch_chunks):
         connections = self.bag._get_connections(topics, connection_filter)
-        for entry in self.bag._get_entries(connections, start_time, end_time):
-            yield self.seek_and_read_message_data_record((entry.chunk_pos, entry.offset), raw)
+        if order == 'file':
+            for msg in self._read_messages_in_file_order(connections, start_time, end_time, raw, executor, prefetch_chunks):
+                yield msg
+        else:
+            entries = self.bag._get_entries(connections, start_time, end_time)
+            if executor is not None:
+                entries = self._prefetch_entry_chunks(entries, executor, prefetch_chunks)
+            for entry in entries:
+                yield self.seek_and_read_message_data_record((entry.chunk_pos, entry.offset), raw)
+
+    def _prefetch_entry_chunks(self, entries, executor, prefetch_chunks):
+        """
+        Pass through index entries, decompressing the chunks of upcoming entries on the executor
+        ahead of the consumer.  At most prefetch_chunks chunks are looked ahead.
+        """
+        lookahead        = collections.deque()
+        lookahead_counts = {}    # chunk_pos -> number of entries in lookahead
+        pending          = {}    # chunk_pos -> future of decompressed chunk
+
+        entries = iter(entries)
+        try:
+            while True:
+                while len(lookahead_counts) <= prefetch_chunks:
+                    entry = next(entries, None)
+                    if entry is None:
+                        break
+                    lookahead.append(entry)
+
+                    count = lookahead_counts.get(entry.chunk_pos, 0)
+                    if count == 0:
+                        self._submit_chunk_decompression(entry.chunk_pos, executor, pending)
+                    lookahead_counts[entry.chunk_pos] = count + 1
+
+                if not lookahead:
+                    break
+
+                entry = lookahead.popleft()
+                if lookahead_counts[entry.chunk_pos] == 1:
+                    del lookahead_counts[entry.chunk_pos]
+                else:
+                    lookahead_counts[entry.chunk_pos] -= 1
+
+                future = pending.pop(entry.chunk_pos, None)
+                if future is not None:
+                    self.chunk_cache.put(entry.chunk_pos, future.result())
+
+                yield entry
+        finally:
+            for future in pending.values():
+                future.cancel()
+
+    def _submit_chunk_decompression(self, chunk_pos, executor, pending):
+        if chunk_pos in pending or chunk_pos == self.decompressed_chunk_pos or chunk_pos in self.chunk_cache:
+            return
+
+        chunk_header = self.bag._chunk_headers.get(chunk_pos)
+        if chunk_header is None or chunk_header.compression == Compression.NONE:
+            return
+
+        self.bag._file.seek(chunk_header.data_pos)
+        compressed_chunk = _read(self.bag._file, chunk_header.compressed_size)
+
+        pending[chunk_pos] = executor.submit(_decompress, chunk_header.compression, compressed_chunk)
+        self.chunk_cache.misses += 1
+
+    def _read_messages_in_file_order(self, connections, start_time, end_time, raw, executor, prefetch_chunks):
+        """
+        Read messages chunk by chunk in the order they're stored.  Each chunk is read with a
+        single sequential read, and chunks holding no wanted connections or times are skipped.
+        """
+        connection_ids = set(c.id for c in connections)
+
+        chunk_infos = []
+        for chunk_info in sorted(self.bag._chunks, key=lambda c: c.pos):
+            if not any(connection_id in connection_ids for connection_id in chunk_info.connection_counts):
+                continue
+            if start_time and chunk_info.end_time < start_time:
+                continue
+            if end_time and chunk_info.start_time > end_time:
+                continue
+            chunk_infos.append(chunk_info)
+
+        for chunk_info, chunk in self._read_chunks(chunk_infos, executor, prefetch_chunks):
+            chunk_size = len(chunk)
+            chunk_file = StringIO(chunk)
+            while True:
+                offset = chunk_file.tell()
+                if offset >= chunk_size:
+                    break
+
+                header = _read_header(chunk_file)
+                op = _read_uint8_field(header, 'op')
+                if op != _OP_MSG_DATA:
+                    _skip_sized(chunk_file)
+                    continue
+
+                connection_id = _read_uint32_field(header, 'conn')
+                if connection_id not in connection_ids:
+                    _skip_sized(chunk_file)
+                    continue
+
+                t = _read_time_field(header, 'time')
+                if (start_time and t < start_time) or (end_time and t > end_time):
+                    _skip_sized(chunk_file)
+                    continue
+
+                yield self._read_message_data_record(chunk_file, connection_id, t, (chunk_info.pos, offset), raw)
+
+    def _read_chunks(self, chunk_infos, executor, prefetch_chunks):
+        """
+        Yield (chunk_info, decompressed chunk data) for each of the given chunks.  If an executor is given, up to
+        prefetch_chunks chunks are decompressed on it ahead of the consumer.
+        """
+        pending = collections.deque()
+        try:
+            for chunk_info in chunk_infos:
+                chunk_header = self.bag._chunk_headers.get(chunk_info.pos)
+                if chunk_header is None:
+                    raise ROSBagException('no chunk at position %d' % chunk_info.pos)
+
+                self.bag._file.seek(chunk_header.data_pos)
+                chunk = _read(self.bag._file, chunk_header.compressed_size)
+
+                if chunk_header.compression == Compression.NONE:
+                    pending.append((chunk_info, None, chunk))
+                elif executor is None:
+                    pending.append((chunk_info, None, self._decompress_chunk(chunk_header, chunk)))
+                else:
+                    pending.append((chunk_info, executor.submit(_decompress, chunk_header.compression, chunk), None))
+
+                while pending and (executor is None or len(pending) > prefetch_chunks):
+                    chunk_info, future, chunk = pending.popleft()
+                    yield chunk_info, (chunk if future is None else future.result())
+
+            while pending:
+                chunk_info, future, chunk = pending.popleft()
+                yield chunk_info, (chunk if future is None else future.result())
+        finally:
+            for _, future, _ in pending:
+                if future is not None:
+                    future.cancel()
 
     ###
 
@@ -2359,8 +3095,9 @@ class _BagReader200(_BagReader):
 
         return _ConnectionInfo(conn_id, topic, connection_header)
 
-    def read_chunk_info_record(self):
-        f = self.bag._file
+    def read_chunk_info_record(self, f=None):
+        if f is None:
+            f = self.bag._file
         
         header = _read_header(f, _OP_CHUNK_INFO)
 
@@ -2398,6 +3135,22 @@ class _BagReader200(_BagReader):
 
         return _ChunkHeader(compression, compressed_size, uncompressed_size, data_pos)
 
+    def read_chunk_connection_indexes(self, chunk_info):
+        """
+        Read the index records which follow a chunk.
+        @return: dict of connection id -> L{_ConnectionIndex200} of the messages in the chunk
+        """
+        chunk_header = self.bag._chunk_headers[chunk_info.pos]
+        self.bag._file.seek(chunk_header.data_pos + chunk_header.compressed_size)
+
+        self.bag._curr_chunk_info = chunk_info
+        chunk_indexes = {}
+        for i in range(len(chunk_info.connection_counts)):
+            connection_id, index = self.read_connection_index_record()
+            chunk_indexes[connection_id] = index
+
+        return chunk_indexes
+
     def read_connection_index_record(self):
         f = self.bag._file
 
@@ -2412,13 +3165,16 @@ class _BagReader200(_BagReader):
     
         record_size = _read_uint32(f) # skip the record data size
 
-        index = []
-                
-        for i in range(count):
-            time   = _read_time  (f)
-            offset = _read_uint32(f)
-            
-            index.append(_IndexEntry200(time, self.bag._curr_chunk_info.pos, offset))
+        # Each entry is (secs, nsecs, offset) as little-endian uint32s
+        values = array.array('I')
+        _array_frombytes(values, _read(f, count * 12))
+        if sys.byteorder == 'big':
+            values.byteswap()
+
+        index = _ConnectionIndex200()
+        index.times           = array.array(_INT64_TYPECODE, imap(operator.add, imap(operator.mul, values[0::3], itertools.repeat(1000000000)), values[1::3]))
+        index.chunk_positions = array.array(_UINT64_TYPECODE, [self.bag._curr_chunk_info.pos]) * count
+        index.offsets         = values[2::3]
 
         return (connection_id, index)
 
@@ -2434,22 +3190,23 @@ class _BagReader200(_BagReader):
             f.seek(chunk_header.data_pos + offset)
         else:
             if self.decompressed_chunk_pos != chunk_pos:
-                # Seek to the chunk data, read and decompress
-                self.bag._file.seek(chunk_header.data_pos)
-                compressed_chunk = _read(self.bag._file, chunk_header.compressed_size)
+                self.decompressed_chunk = self.chunk_cache.get(chunk_pos)
+                if self.decompressed_chunk is None:
+                    # Seek to the chunk data, read and decompress
+                    self.bag._file.seek(chunk_header.data_pos)
+                    compressed_chunk = _read(self.bag._file, chunk_header.compressed_size)
+
+                    self.decompressed_chunk = self._decompress_chunk(chunk_header, compressed_chunk)
+
+                    self.chunk_cache.put(chunk_pos, self.decompressed_chunk)
 
-                if chunk_header.compression == Compression.BZ2:
-                    self.decompressed_chunk = bz2.decompress(compressed_chunk)
-                elif chunk_header.compression == Compression.LZ4 and found_lz4:
-                    self.decompressed_chunk = roslz4.decompress(compressed_chunk)
-                else:
-                    raise ROSBagException('unsupported compression type: %s' % chunk_header.compression)
-                
                 self.decompressed_chunk_pos = chunk_pos
 
                 if self.decompressed_chunk_io:
                     self.decompressed_chunk_io.close()
                 self.decompressed_chunk_io = StringIO(self.decompressed_chunk)
+            else:
+                self.chunk_cache.hits += 1
 
             f = self.decompressed_chunk_io
             f.seek(offset)
@@ -2469,6 +3226,9 @@ class _BagReader200(_BagReader):
         connection_id = _read_uint32_field(header, 'conn')
         t             = _read_time_field  (header, 'time')
 
+        return self._read_message_data_record(f, connection_id, t, position, raw)
+
+    def _read_message_data_record(self, f, connection_id, t, position, raw):
         # Get the message type
         connection_info = self.bag._connections[connection_id]
         try:
@@ -2481,13 +3241,75 @@ class _BagReader200(_BagReader):
         
         # Deserialize the message
         if raw:
-            msg = connection_info.datatype, data, connection_info.md5sum, (chunk_pos, offset), msg_type
+            msg = connection_info.datatype, data, connection_info.md5sum, position, msg_type
         else:
             msg = msg_type()
             msg.deserialize(data)
         
         return BagMessage(connection_info.topic, msg, t)
 
+    def _decompress_chunk(self, chunk_header, compressed_chunk):
+        return _decompress(chunk_header.compression, compressed_chunk)
+
+def _decompress(compression, compressed_chunk):
+    # Module-level so that it can be run on a process pool
+    if compression == Compression.BZ2:
+        return bz2.decompress(compressed_chunk)
+    elif compression == Compression.LZ4 and found_lz4:
+        return roslz4.decompress(compressed_chunk)
+    else:
+        raise ROSBagException('unsupported compression type: %s' % compression)
+
+def _bisect_index_left(index, t):
+    if isinstance(index, _ConnectionIndex200):
+        return index.bisect_left(t)
+    return bisect.bisect_left(index, _IndexEntry(t))
+
+def _bisect_index_right(index, t):
+    if isinstance(index, _ConnectionIndex200):
+        return index.bisect_right(t)
+    return bisect.bisect_right(index, _IndexEntry(t))
+
+def _get_index_bounds(index, start_time=None, end_time=None):
+    lo = _bisect_index_left(index, start_time) if start_time else 0
+    hi = _bisect_index_right(index, end_time) if end_time else len(index)
+
+    return lo, hi
+
+def _get_index_range(index, start_time=None, end_time=None, reverse=False):
+    """
+    Iterate over the entries of a sorted index which lie in the given time range.
+    The bounds are located by bisection so that no entries outside the range are visited.
+    """
+    lo, hi = _get_index_bounds(index, start_time, end_time)
+
+    if reverse:
+        return (index[i] for i in range(hi - 1, lo - 1, -1))
+    else:
+        return (index[i] for i in range(lo, hi))
+
+def _merge_connection_indexes(indexes, start_time=None, end_time=None, reverse=False):
+    """
+    Merge the entries of L{_ConnectionIndex200}s in the given time range, in time order (stable across indexes).
+    The merge is done on tuples of integers from the index arrays, so entries are only created as they're yielded.
+    """
+    keys = []
+    for n, index in enumerate(indexes):
+        lo, hi = _get_index_bounds(index, start_time, end_time)
+        if lo >= hi:
+            continue
+
+        if reverse:
+            # Merge on (-time, n, -i) to iterate each index backwards
+            times = itertools.islice(reversed(index.times), len(index) - hi, len(index) - lo)
+            keys.append(izip(imap(operator.neg, times), itertools.repeat(n), range(1 - hi, 1 - lo)))
+        else:
+            times = itertools.islice(index.times, lo, hi)
+            keys.append(izip(times, itertools.repeat(n), range(lo, hi)))
+
+    for _, n, i in heapq.merge(*keys):
+        yield indexes[n][-i if reverse else i]
+
 def _time_to_str(secs):
     secs_frac = secs - int(secs) 
     secs_frac_str = ('%.2f' % secs_frac)[1:]
@@ -2577,6 +3399,48 @@ def _mergesort(list_of_lists, key=None):
             except StopIteration:
                 heapq.heappop(heap)
 
+class _ChunkCache(object):
+    """
+    A least-recently-used cache of decompressed chunks, bounded by the total number of bytes held.
+    The most recently added chunk is always kept, even if it alone exceeds the capacity.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.size     = 0
+        self.hits     = 0
+        self.misses   = 0
+
+        self._chunks = collections.OrderedDict()   # chunk_pos -> decompressed chunk
+
+    def get(self, chunk_pos):
+        data = self._chunks.pop(chunk_pos, None)
+        if data is None:
+            self.misses += 1
+            return None
+
+        self._chunks[chunk_pos] = data
+        self.hits += 1
+        return data
+
+    def put(self, chunk_pos, data):
+        old_data = self._chunks.pop(chunk_pos, None)
+        if old_data is not None:
+            self.size -= len(old_data)
+
+        self._chunks[chunk_pos] = data
+        self.size += len(data)
+
+        while self.size > self.capacity and len(self._chunks) > 1:
+            _, evicted = self._chunks.popitem(last=False)
+            self.size -= len(evicted)
+
+    def __contains__(self, chunk_pos):
+        return chunk_pos in self._chunks
+
+    def clear(self):
+        self._chunks.clear()
+        self.size = 0
+
 class _CompressorFileFacade(object):
     """
     A file facade for sequential compressors (e.g., bz2.BZ2Compressor).
@@ -2597,6 +3461,69 @@ class _CompressorFileFacade(object):
         if len(compressed) > 0:
             self.file.write(compressed)
 
+def _compress(compression, uncompressed_chunk):
+    if compression == Compression.BZ2:
+        return bz2.compress(uncompressed_chunk)
+    elif compression == Compression.LZ4 and found_lz4:
+        return roslz4.compress(uncompressed_chunk)
+    else:
+        raise ROSBagException('unsupported compression type: %s' % compression)
+
+class _CompressionJob(object):
+    def __init__(self, compression, uncompressed_chunk):
+        self.compression        = compression
+        self.uncompressed_chunk = uncompressed_chunk
+        self.compressed_chunk   = None
+        self.error              = None
+        self.finished           = threading.Event()
+
+    def done(self):
+        return self.finished.is_set()
+
+    def result(self):
+        self.finished.wait()
+        if self.error is not None:
+            raise self.error
+        return self.compressed_chunk
+
+class _CompressionPool(object):
+    """
+    A pool of threads compressing chunks in the background.  Jobs may finish in any order;
+    the caller is responsible for writing them out in the order they were submitted.
+    """
+    def __init__(self, thread_count):
+        self._jobs    = queue.Queue()
+        self._threads = []
+        for i in range(thread_count):
+            thread = threading.Thread(target=self._run, name='rosbag compression %d' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, compression, uncompressed_chunk):
+        job = _CompressionJob(compression, uncompressed_chunk)
+        self._jobs.put(job)
+        return job
+
+    def shutdown(self):
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            try:
+                job.compressed_chunk = _compress(job.compression, job.uncompressed_chunk)
+            except Exception as ex:
+                job.error = ex
+            job.uncompressed_chunk = None
+            job.finished.set()
+
 def _median(values):
     values_len = len(values)
     if values_len == 0:
@@ -32,6 +32,9 @@
 
 from __future__ import print_function
 
+import ast
+import functools
+import multiprocessing
 import optparse
 import os
 import shutil
@@ -44,6 +47,8 @@ try:
 except ImportError:
     from collections import UserDict  # Python 3.x
 
+import genpy
+import genpy.dynamic
 import roslib.message
 import roslib.packages
 
@@ -147,6 +152,7 @@ def info_cmd(argv):
     parser.add_option('-y', '--yaml', dest='yaml', default=False, action='store_true', help='print information in YAML format')
     parser.add_option('-k', '--key',  dest='key',  default=None,  action='store',      help='print information on the given key')
     parser.add_option(      '--freq', dest='freq', default=False, action='store_true', help='display topic message frequency statistics')
+    parser.add_option(      '--index-cache', dest='index_cache', default=False, action='store_true', help='save the bag index to a sidecar .idx file, and read it from there when unchanged')
     (options, args) = parser.parse_args(argv)
 
     if len(args) == 0:
@@ -156,7 +162,7 @@ def info_cmd(argv):
 
     for i, arg in enumerate(args):
         try:
-            b = Bag(arg, 'r', skip_index=not options.freq)
+            b = Bag(arg, 'r', skip_index=not options.freq, index_cache=options.index_cache)
             if options.yaml:
                 info = b._get_yaml_info(key=options.key)
                 if info is not None:
@@ -292,34 +298,126 @@ def play_cmd(argv):
     process.wait()
 
 
+def _get_message_fields(expr):
+    """
+    Get the message fields used by a filter expression.
+    @return: set of the names of the top-level fields of m which are used (empty if m isn't used), or None if the
+        whole message is needed
+    @rtype: set(str)
+    """
+    try:
+        tree = ast.parse(expr, mode='eval')
+    except SyntaxError:
+        return None
+
+    fields = set()
+    field_nodes = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == 'm':
+            fields.add(node.attr)
+            field_nodes.add(node.value)
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == 'm' and node not in field_nodes:
+            # m is used other than by accessing a field
+            return None
+
+    return fields
+
+def _truncate_message_definition(msg_def, fields):
+    """
+    Remove the fields after the last of the given fields from the top-level message of a definition.
+    @return: truncated message definition, or None if any of the fields aren't in the message
+    @rtype: str
+    """
+    lines = msg_def.split('\n')
+
+    remaining = set(fields)
+    truncated = []
+    for i, line in enumerate(lines):
+        if line.startswith('=' * 10):
+            # The rest of the definition is the dependencies
+            break
+
+        if remaining:
+            tokens = line.split('#')[0].split()
+            if len(tokens) >= 2 and '=' not in line.split('#')[0]:
+                remaining.discard(tokens[1])
+            truncated.append(line)
+    else:
+        i = len(lines)
+
+    if remaining:
+        return None
+
+    return '\n'.join(truncated + lines[i:])
+
+_projected_message_types = {}
+
+def _get_projected_message_type(pytype, fields):
+    """
+    Get a message type which only deserializes a message up to the given top-level fields, so that any large fields
+    after them, e.g. image data, aren't read.  Instances are incomplete so shouldn't be serialized.
+    @return: projected message type, or None if the message can't be projected
+    """
+    key = (pytype._md5sum, frozenset(fields))
+    if key not in _projected_message_types:
+        projected_type = None
+
+        msg_def = _truncate_message_definition(pytype._full_text, fields)
+        if msg_def is not None:
+            try:
+                projected_type = genpy.dynamic.generate_dynamic(pytype._type, msg_def)[pytype._type]
+            except Exception:
+                pass
+
+        _projected_message_types[key] = projected_type
+
+    return _projected_message_types[key]
+
 def filter_cmd(argv):
     def expr_eval(expr):
+        code = compile(expr, '<expression>', 'eval')
+        # The variables are passed as globals so that nested scopes, e.g. generator expressions, can use them
+        namespace = dict(globals())
         def eval_fn(topic, m, t):
-            return eval(expr)
+            namespace.update(topic=topic, m=m, t=t)
+            return eval(code, namespace)
         return eval_fn
 
-    parser = optparse.OptionParser(usage="""rosbag filter [options] INBAG OUTBAG EXPRESSION
+    parser = optparse.OptionParser(usage="""rosbag filter [options] INBAG OUTBAG [EXPRESSION]
 
 EXPRESSION can be any Python-legal expression.
 
 The following variables are available:
  * topic: name of topic
  * m: message
- * t: time of message (t.secs, t.nsecs)""",
+ * t: time of message (t.secs, t.nsecs)
+
+Messages are only deserialized up to the fields of m which are used, e.g.
+m.header.stamp.  If EXPRESSION doesn't use m, messages aren't deserialized,
+and if in addition no PRINT-EXPRESSION is given, chunks in which every
+message passes are copied without being decompressed.""",
                                    description='Filter the contents of the bag.')
+    parser.add_option(      '--no-projection', action='store_false', dest='projection', default=True, help='always deserialize whole messages, rather than only the fields used by the expressions')
     parser.add_option('-p', '--print', action='store', dest='verbose_pattern', default=None, metavar='PRINT-EXPRESSION', help='Python expression to print for verbose debugging. Uses same variables as filter-expression')
+    parser.add_option(      '--topics', action='store', dest='topics', default=None, metavar='TOPICS', help='only keep messages on these (comma-separated) topics')
+    parser.add_option(      '--start',  action='store', dest='start',  default=None, type='float', metavar='SEC', help='only keep messages at or after this time (in seconds)')
+    parser.add_option(      '--end',    action='store', dest='end',    default=None, type='float', metavar='SEC', help='only keep messages at or before this time (in seconds)')
 
     options, args = parser.parse_args(argv)
+    has_predicates = options.topics is not None or options.start is not None or options.end is not None
     if len(args) == 0:
         parser.error('You must specify an in bag, an out bag, and an expression.')
     if len(args) == 1:
         parser.error('You must specify an out bag and an expression.')
-    if len(args) == 2:
+    if len(args) == 2 and not has_predicates:
         parser.error("You must specify an expression.")
     if len(args) > 3:
         parser.error("Too many arguments.")
 
-    inbag_filename, outbag_filename, expr = args
+    inbag_filename, outbag_filename = args[:2]
+    expr = args[2] if len(args) == 3 else 'True'
 
     if not os.path.isfile(inbag_filename):
         print('Cannot locate input bag file [%s]' % inbag_filename, file=sys.stderr)
@@ -329,48 +427,71 @@ The following variables are available:
         print('Cannot use same file as input and output [%s]' % inbag_filename, file=sys.stderr)
         sys.exit(3)
 
-    filter_fn = expr_eval(expr)
+    topics     = [topic for topic in options.topics.split(',') if topic] if options.topics is not None else None
+    start_time = genpy.Time.from_sec(options.start) if options.start is not None else None
+    end_time   = genpy.Time.from_sec(options.end)   if options.end   is not None else None
+
+    try:
+        filter_fn = expr_eval(expr)
+        if options.verbose_pattern:
+            verbose_pattern = expr_eval(options.verbose_pattern)
+    except SyntaxError as ex:
+        parser.error('Invalid expression: %s' % ex)
+
+    fields = _get_message_fields(expr)
+    if fields is not None and options.verbose_pattern:
+        verbose_fields = _get_message_fields(options.verbose_pattern)
+        fields = fields | verbose_fields if verbose_fields is not None else None
+    deserialize = fields != set()
+    if not options.projection:
+        fields = None
 
-    outbag = Bag(outbag_filename, 'w')
-    
     try:
         inbag = Bag(inbag_filename)
     except ROSBagUnindexedException as ex:
         print('ERROR bag unindexed: %s.  Run rosbag reindex.' % inbag_filename, file=sys.stderr)
         sys.exit(1)
 
-    try:
-        meter = ProgressMeter(outbag_filename, inbag._uncompressed_size)
-        total_bytes = 0
-    
-        if options.verbose_pattern:
-            verbose_pattern = expr_eval(options.verbose_pattern)
-    
-            for topic, raw_msg, t in inbag.read_messages(raw=True):
-                msg_type, serialized_bytes, md5sum, pos, pytype = raw_msg
-                msg = pytype()
-                msg.deserialize(serialized_bytes)
+    copy_chunks = not deserialize and not options.verbose_pattern and inbag.version == 200
+    if copy_chunks:
+        outbag = Bag(outbag_filename, 'w', compression=inbag.get_compression_info().compression)
+    else:
+        outbag = Bag(outbag_filename, 'w')
 
-                if filter_fn(topic, msg, t):
-                    print('MATCH', verbose_pattern(topic, msg, t))
-                    outbag.write(topic, msg, t)
-                else:
-                    print('NO MATCH', verbose_pattern(topic, msg, t))          
+    try:
+        if copy_chunks:
+            meter = ProgressMeter(outbag_filename, inbag.size)
 
-                total_bytes += len(serialized_bytes) 
-                meter.step(total_bytes)
+            message_filter = None if len(args) == 2 else lambda topic, t: filter_fn(topic, None, t)
+            for chunk_pos in outbag.copy_messages(inbag, topics, start_time, end_time, message_filter):
+                meter.step(chunk_pos)
         else:
-            for topic, raw_msg, t in inbag.read_messages(raw=True):
+            meter = ProgressMeter(outbag_filename, inbag._uncompressed_size)
+            total_bytes = 0
+
+            for topic, raw_msg, t in inbag.read_messages(topics, start_time, end_time, raw=True):
                 msg_type, serialized_bytes, md5sum, pos, pytype = raw_msg
-                msg = pytype()
-                msg.deserialize(serialized_bytes)
+                if deserialize:
+                    projected_type = _get_projected_message_type(pytype, fields) if fields is not None else None
+                    msg = (projected_type or pytype)()
+                    msg.deserialize(serialized_bytes)
+                else:
+                    projected_type = None
+                    msg = None
 
                 if filter_fn(topic, msg, t):
-                    outbag.write(topic, msg, t)
+                    if options.verbose_pattern:
+                        print('MATCH', verbose_pattern(topic, msg, t))
+                    if msg is None or projected_type is not None:
+                        outbag.write(topic, raw_msg, t, raw=True)
+                    else:
+                        outbag.write(topic, msg, t)
+                elif options.verbose_pattern:
+                    print('NO MATCH', verbose_pattern(topic, msg, t))
 
                 total_bytes += len(serialized_bytes)
                 meter.step(total_bytes)
-        
+
         meter.finish()
 
     finally:
@@ -554,14 +675,17 @@ def compress_cmd(argv):
     parser.add_option('-q', '--quiet',      action='store_true',  dest='quiet',       help='suppress noncritical messages')
     parser.add_option('-j', '--bz2',        action='store_const', dest='compression', help='use BZ2 compression', const=Compression.BZ2, default=Compression.BZ2)
     parser.add_option(      '--lz4',        action='store_const', dest='compression', help='use lz4 compression', const=Compression.LZ4)
+    parser.add_option(      '--jobs',       action='store',       dest='jobs',        help='process up to N bag files in parallel', metavar='N', type='int', default=1)
     (options, args) = parser.parse_args(argv)
 
     if len(args) < 1:
         parser.error('You must specify at least one bag file.')
+    if options.jobs < 1:
+        parser.error('The number of jobs must be at least 1.')
 
-    op = lambda inbag, outbag, quiet: change_compression_op(inbag, outbag, options.compression, options.quiet)
+    op = functools.partial(change_compression_op, compression=options.compression)
 
-    bag_op(args, False, lambda b: False, op, options.output_dir, options.force, options.quiet)
+    bag_op(args, False, _never_copy, op, options.output_dir, options.force, options.quiet, options.jobs)
 
 def decompress_cmd(argv):
     parser = optparse.OptionParser(usage='rosbag decompress [options] BAGFILE1 [BAGFILE2 ...]',
@@ -569,15 +693,18 @@ def decompress_cmd(argv):
     parser.add_option(      '--output-dir', action='store',      dest='output_dir', help='write to directory DIR', metavar='DIR')
     parser.add_option('-f', '--force',      action='store_true', dest='force',      help='force overwriting of backup file if it exists')
     parser.add_option('-q', '--quiet',      action='store_true', dest='quiet',      help='suppress noncritical messages')
+    parser.add_option(      '--jobs',       action='store',      dest='jobs',       help='process up to N bag files in parallel', metavar='N', type='int', default=1)
 
     (options, args) = parser.parse_args(argv)
 
     if len(args) < 1:
         parser.error('You must specify at least one bag file.')
+    if options.jobs < 1:
+        parser.error('The number of jobs must be at least 1.')
     
-    op = lambda inbag, outbag, quiet: change_compression_op(inbag, outbag, Compression.NONE, options.quiet)
+    op = functools.partial(change_compression_op, compression=Compression.NONE)
     
-    bag_op(args, False, lambda b: False, op, options.output_dir, options.force, options.quiet)
+    bag_op(args, False, _never_copy, op, options.output_dir, options.force, options.quiet, options.jobs)
 
 def reindex_cmd(argv):
     parser = optparse.OptionParser(usage='rosbag reindex [options] BAGFILE1 [BAGFILE2 ...]',
@@ -585,105 +712,186 @@ def reindex_cmd(argv):
     parser.add_option(      '--output-dir', action='store',      dest='output_dir', help='write to directory DIR', metavar='DIR')
     parser.add_option('-f', '--force',      action='store_true', dest='force',      help='force overwriting of backup file if it exists')
     parser.add_option('-q', '--quiet',      action='store_true', dest='quiet',      help='suppress noncritical messages')
+    parser.add_option(      '--jobs',       action='store',      dest='jobs',       help='process up to N bag files in parallel', metavar='N', type='int', default=1)
 
     (options, args) = parser.parse_args(argv)
 
     if len(args) < 1:
         parser.error('You must specify at least one bag file.')
+    if options.jobs < 1:
+        parser.error('The number of jobs must be at least 1.')
     
-    op = lambda inbag, outbag, quiet: reindex_op(inbag, outbag, options.quiet)
+    bag_op(args, True, _is_version_2, reindex_op, options.output_dir, options.force, options.quiet, options.jobs)
+
+def _never_copy(bag):
+    return False
 
-    bag_op(args, True, lambda b: b.version > 102, op, options.output_dir, options.force, options.quiet)
+def _is_version_2(bag):
+    return bag.version > 102
+
+def bag_op(inbag_filenames, allow_unindexed, copy_fn, op, output_dir=None, force=False, quiet=False, jobs=1):
+    """
+    Perform an operation on each of the given bag files, writing to a new bag file.  If the output bag would overwrite
+    the input bag, the input is first moved (or copied, if copy_fn returns True) to a backup.
+    @param jobs: number of bag files to process in parallel.  op and copy_fn must be picklable if greater than 1
+    @type  jobs: int
+    """
+    if jobs > 1 and len(inbag_filenames) > 1:
+        _parallel_bag_op(inbag_filenames, allow_unindexed, copy_fn, op, output_dir, force, quiet, jobs)
+        return
 
-def bag_op(inbag_filenames, allow_unindexed, copy_fn, op, output_dir=None, force=False, quiet=False):
     for inbag_filename in inbag_filenames:
-        # Check we can read the file
+        if not _bag_op(inbag_filename, allow_unindexed, copy_fn, op, output_dir, force, quiet):
+            break
+
+_bag_op_stop = None
+
+def _init_bag_op_worker(stop):
+    global _bag_op_stop
+    _bag_op_stop = stop
+
+def _run_bag_op(args):
+    # Skip the remaining bags once interrupted
+    if not _bag_op_stop.is_set():
         try:
-            inbag = Bag(inbag_filename, 'r', allow_unindexed=allow_unindexed)
-        except ROSBagUnindexedException:
-            print('ERROR bag unindexed: %s.  Run rosbag reindex.' % inbag_filename, file=sys.stderr)
-            continue
-        except (ROSBagException, IOError) as ex:
-            print('ERROR reading %s: %s' % (inbag_filename, str(ex)), file=sys.stderr)
-            continue
+            if not _bag_op(*args):
+                _bag_op_stop.set()
+        except KeyboardInterrupt:
+            _bag_op_stop.set()
 
-        # Determine whether we should copy the bag    
-        copy = copy_fn(inbag)
-        
-        inbag.close()
+    return args[0]
 
-        # Determine filename for output bag
-        if output_dir is None:
-            outbag_filename = inbag_filename
-        else:
-            outbag_filename = os.path.join(output_dir, os.path.split(inbag_filename)[1])
+def _parallel_bag_op(inbag_filenames, allow_unindexed, copy_fn, op, output_dir, force, quiet, jobs):
+    # Each bag file can only be processed once at a time, as its backup is shared
+    unique_filenames = []
+    for inbag_filename in inbag_filenames:
+        if inbag_filename not in unique_filenames:
+            unique_filenames.append(inbag_filename)
 
-        backup_filename = None
-        if outbag_filename == inbag_filename:
-            # Rename the input bag to ###.orig.###, and open for reading
-            backup_filename = '%s.orig%s' % os.path.splitext(inbag_filename)
-            
-            if not force and os.path.exists(backup_filename):
-                if not quiet:
-                    print('Skipping %s. Backup path %s already exists.' % (inbag_filename, backup_filename), file=sys.stderr)
-                continue
-            
-            try:
-                if copy:
-                    shutil.copy(inbag_filename, backup_filename)
-                else:
-                    os.rename(inbag_filename, backup_filename)
-            except OSError as ex:
-                print('ERROR %s %s to %s: %s' % ('copying' if copy else 'moving', inbag_filename, backup_filename, str(ex)), file=sys.stderr)
-                continue
-            
-            source_filename = backup_filename
+    sizes = dict((f, os.path.getsize(f) if os.path.isfile(f) else 0) for f in unique_filenames)
+
+    # Progress is reported for all the bags together, as each is completed
+    if not quiet:
+        meter = ProgressMeter('%d bag files' % len(unique_filenames), sum(sizes.values()))
+
+    stop = multiprocessing.Event()
+    pool = multiprocessing.Pool(min(jobs, len(unique_filenames)), _init_bag_op_worker, (stop,))
+    try:
+        bytes_done = 0
+        for inbag_filename in pool.imap_unordered(_run_bag_op, [(f, allow_unindexed, copy_fn, op, output_dir, force, quiet, False) for f in unique_filenames]):
+            bytes_done += sizes[inbag_filename]
+            if not quiet:
+                meter.step(bytes_done)
+
+        if not quiet:
+            meter.finish()
+
+    except KeyboardInterrupt:
+        # The workers are also interrupted, and restore the backups of the bags they're processing
+        stop.set()
+        print('\nInterrupted: waiting for the current bag files to be restored', file=sys.stderr)
+
+    finally:
+        pool.close()
+        pool.join()
+
+def _bag_op(inbag_filename, allow_unindexed, copy_fn, op, output_dir, force, quiet, progress=True):
+    """
+    Perform an operation on a bag file.
+    @param progress: if False, op does not show its progress meter, even if not quiet
+    @type  progress: bool
+    @return: False if the operation was interrupted and the bag couldn't be restored from its backup
+    @rtype: bool
+    """
+    # Check we can read the file
+    try:
+        inbag = Bag(inbag_filename, 'r', allow_unindexed=allow_unindexed)
+    except ROSBagUnindexedException:
+        print('ERROR bag unindexed: %s.  Run rosbag reindex.' % inbag_filename, file=sys.stderr)
+        return True
+    except (ROSBagException, IOError) as ex:
+        print('ERROR reading %s: %s' % (inbag_filename, str(ex)), file=sys.stderr)
+        return True
+
+    # Determine whether we should copy the bag    
+    copy = copy_fn(inbag)
+    
+    inbag.close()
+
+    # Determine filename for output bag
+    if output_dir is None:
+        outbag_filename = inbag_filename
+    else:
+        outbag_filename = os.path.join(output_dir, os.path.split(inbag_filename)[1])
+
+    backup_filename = None
+    if outbag_filename == inbag_filename:
+        # Rename the input bag to ###.orig.###, and open for reading
+        backup_filename = '%s.orig%s' % os.path.splitext(inbag_filename)
+        
+        if not force and os.path.exists(backup_filename):
+            if not quiet:
+                print('Skipping %s. Backup path %s already exists.' % (inbag_filename, backup_filename), file=sys.stderr)
+            return True
+        
+        try:
+            if copy:
+                shutil.copy(inbag_filename, backup_filename)
+            else:
+                os.rename(inbag_filename, backup_filename)
+        except OSError as ex:
+            print('ERROR %s %s to %s: %s' % ('copying' if copy else 'moving', inbag_filename, backup_filename, str(ex)), file=sys.stderr)
+            return True
+        
+        source_filename = backup_filename
+    else:
+        if copy:
+            shutil.copy(inbag_filename, outbag_filename)
+            source_filename = outbag_filename
         else:
+            source_filename = inbag_filename
+
+    try:
+        inbag = Bag(source_filename, 'r', allow_unindexed=allow_unindexed)
+
+        # Open the output bag file for writing
+        try:
             if copy:
-                shutil.copy(inbag_filename, outbag_filename)
-                source_filename = outbag_filename
+                outbag = Bag(outbag_filename, 'a', allow_unindexed=allow_unindexed)
             else:
-                source_filename = inbag_filename
+                outbag = Bag(outbag_filename, 'w')
+        except (ROSBagException, IOError) as ex:
+            print('ERROR writing to %s: %s' % (outbag_filename, str(ex)), file=sys.stderr)
+            inbag.close()
+            return True
 
+        # Perform the operation
         try:
-            inbag = Bag(source_filename, 'r', allow_unindexed=allow_unindexed)
+            op(inbag, outbag, quiet=quiet or not progress)
+        except ROSBagException as ex:
+            print('\nERROR operating on %s: %s' % (source_filename, str(ex)), file=sys.stderr)
+            inbag.close()
+            outbag.close()
+            return True
+            
+        outbag.close()
+        inbag.close()
 
-            # Open the output bag file for writing
+    except KeyboardInterrupt:
+        if backup_filename is not None:
             try:
                 if copy:
-                    outbag = Bag(outbag_filename, 'a', allow_unindexed=allow_unindexed)
+                    os.remove(backup_filename)
                 else:
-                    outbag = Bag(outbag_filename, 'w')
-            except (ROSBagException, IOError) as ex:
-                print('ERROR writing to %s: %s' % (outbag_filename, str(ex)), file=sys.stderr)
-                inbag.close()
-                continue
-
-            # Perform the operation
-            try:
-                op(inbag, outbag, quiet=quiet)
-            except ROSBagException as ex:
-                print('\nERROR operating on %s: %s' % (source_filename, str(ex)), file=sys.stderr)
-                inbag.close()
-                outbag.close()
-                continue
-                
-            outbag.close()
-            inbag.close()
-
-        except KeyboardInterrupt:
-            if backup_filename is not None:
-                try:
-                    if copy:
-                        os.remove(backup_filename)
-                    else:
-                        os.rename(backup_filename, inbag_filename)
-                except OSError as ex:
-                    print('ERROR %s %s to %s: %s', ('removing' if copy else 'moving', backup_filename, inbag_filename, str(ex)), file=sys.stderr)
-                    break
+                    os.rename(backup_filename, inbag_filename)
+            except OSError as ex:
+                print('ERROR %s %s to %s: %s', ('removing' if copy else 'moving', backup_filename, inbag_filename, str(ex)), file=sys.stderr)
+                return False
     
-        except (ROSBagException, IOError) as ex:
-            print('ERROR operating on %s: %s' % (inbag_filename, str(ex)), file=sys.stderr)
+    except (ROSBagException, IOError) as ex:
+        print('ERROR operating on %s: %s' % (inbag_filename, str(ex)), file=sys.stderr)
+
+    return True
 
 def change_compression_op(inbag, outbag, compression, quiet):
     outbag.compression = compression
@@ -45,9 +45,9 @@ import random
 import logging
 import traceback
 try:
-    from xmlrpc.client import ServerProxy
+    from xmlrpc.client import Fault, ServerProxy
 except ImportError:
-    from xmlrpclib import ServerProxy
+    from xmlrpclib import Fault, ServerProxy
 import socket
 
 import rosgraph.masterapi
@@ -267,6 +267,9 @@ class Graph(object):
 
         # time we last contacted master
         self.last_master_refresh = 0
+        # version of the system state last retrieved from the master,
+        # None if the master does not support getSystemStateIfChanged
+        self.master_state_version = ''
         self.last_node_refresh = {}
         
         # time we last communicated with master
@@ -299,11 +302,14 @@ class Graph(object):
         logger.debug("master refresh: starting")
         updated = False
         try:
-            val = self.master.getSystemState()
+            val = self._get_system_state()
         except rosgraph.masterapi.MasterException as e:
             print("Unable to contact master", str(e), file=sys.stderr)
             logger.error("unable to contact master: %s", str(e))
             return False
+        if not val:
+            logger.debug("master refresh: done, system state unchanged")
+            return False
 
         pubs, subs, srvs = val
 
@@ -342,6 +348,20 @@ class Graph(object):
         logger.debug("master refresh: done, updated[%s]", updated)
         return updated
         
+    def _get_system_state(self):
+        """
+        @return: system state, or empty list if it has not changed
+        since the last call
+        """
+        if self.master_state_version is not None:
+            try:
+                self.master_state_version, val = self.master.getSystemStateIfChanged(self.master_state_version)
+                return val
+            except Fault:
+                # not supported by master
+                self.master_state_version = None
+        return self.master.getSystemState()
+        
     def _mark_bad_node(self, node, reason):
         try:
             # bad nodes are updated in a separate thread, so lock
@@ -479,3 +479,18 @@ class Master(object):
         @raise rosgraph.masterapi.Failure: if Master returns FAILURE.
         """
         return self._succeed(self.handle.getSystemState(self.caller_id))
+
+    def getSystemStateIfChanged(self, version):
+        """
+        Retrieve list representation of system state if it has
+        changed since version. Not all masters support this call.
+        @param version: version returned by the previous call, or ''
+        @type  version: str
+        @rtype: (str, [[str,[str]], [str,[str]], [str,[str]]])
+        @return: (version, systemState). systemState is as returned by
+        L{getSystemState()}, or an empty list if unchanged.
+        @raise rosgraph.masterapi.Error: if Master returns ERROR.
+        @raise rosgraph.masterapi.Failure: if Master returns FAILURE.
+        @raise xmlrpc.client.Fault: if Master does not support the call.
+        """
+        return self._succeed(self.handle.getSystemStateIfChanged(self.caller_id, version))
@@ -62,6 +62,12 @@ import threading
 import time
 import traceback
 
+from collections import OrderedDict
+try:
+    from xmlrpc.client import Fault, MultiCall
+except ImportError:
+    from xmlrpclib import Fault, MultiCall
+
 from rosgraph.xmlrpc import XmlRpcHandler
 
 import rosgraph.names
@@ -69,11 +75,12 @@ from rosgraph.names import resolve_name
 import rosmaster.paramserver
 import rosmaster.threadpool
 
-from rosmaster.util import xmlrpcapi
+from rosmaster.util import xmlrpcapi, ValueEncoder
 from rosmaster.registrations import RegistrationManager
 from rosmaster.validators import non_empty, non_empty_str, not_none, is_api, is_topic, is_service, valid_type_name, valid_name, empty_or_valid_name, ParameterInvalid
 
 NUM_WORKERS = 3 #number of threads we use to send publisher_update notifications
+STATS_LOG_INTERVAL = 60. #minimum time between logs of the notification queue statistics (in seconds)
 
 # Return code slots
 STATUS = 0
@@ -230,6 +237,34 @@ def service_update_task(api, service, uri):
     mloginfo("serviceUpdate[%s, %s] -> %s",service, uri, api)
     xmlrpcapi(api).serviceUpdate('/master', service, uri)
 
+class _PendingUpdates(object):
+    """
+    Notifications waiting to be sent to a node API. Only the latest
+    update of each topic or parameter is kept.
+    """
+    __slots__ = ['topics', 'params']
+
+    def __init__(self):
+        ## { topic : pub_uris }
+        self.topics = OrderedDict()
+        ## { param_key : (caller_id, param_value) }
+        self.params = OrderedDict()
+
+class _SystemStateSnapshot(object):
+    """
+    Immutable snapshot of the state returned by getSystemState() and
+    getPublishedTopics()
+    """
+    __slots__ = ['version', 'state', 'published_topics']
+
+    def __init__(self, version, state, published_topics):
+        ## opaque version string of the registrations
+        self.version = version
+        ## [publishers, subscribers, services]
+        self.state = state
+        ## [[topic, type]] of all published topics
+        self.published_topics = published_topics
+
 ###################################################
 # Master Implementation
 
@@ -253,10 +288,21 @@ class ROSMasterHandler(object):
         self.done = False
 
         self.thread_pool = rosmaster.threadpool.MarkedThreadPool(num_workers)
+        # notifications not yet sent: { node_api : _PendingUpdates }
+        self._pending_updates = {}
+        self._pending_lock = threading.Lock()
+        # time the thread pool statistics were last logged
+        self._stats_log_time = time.time()
         # pub/sub/providers: dict { topicName : [publishers/subscribers names] }
         self.ps_lock = threading.Condition(threading.Lock())
 
         self.reg_manager = RegistrationManager(self.thread_pool)
+        # latest _SystemStateSnapshot, replaced when registrations change
+        self._snapshot = None
+        # distinguishes versions of this master from those of earlier runs
+        self._snapshot_epoch = '%x'%int(time.time() * 1000)
+        # cached XML-RPC encoding of large parameter values
+        self._param_encoder = ValueEncoder()
 
         # maintain refs to reg_manager fields
         self.publishers  = self.reg_manager.publishers
@@ -265,12 +311,15 @@ class ROSMasterHandler(object):
         self.param_subscribers = self.reg_manager.param_subscribers
         
         self.topics_types = {} #dict { topicName : type }
+        # number of changes of topics_types, part of the snapshot version
+        self._topics_types_version = 0
 
         # parameter server dictionary
         self.param_server = rosmaster.paramserver.ParamDictionary(self.reg_manager)
 
     def _shutdown(self, reason=''):
         if self.thread_pool is not None:
+            self._log_thread_pool_stats(self.thread_pool)
             self.thread_pool.join_all(wait_for_tasks=False, wait_for_threads=False)
             self.thread_pool = None
         self.done = True
@@ -399,7 +448,7 @@ class ROSMasterHandler(object):
         """
         try:
             key = resolve_name(key, caller_id)
-            return 1, "Parameter [%s]"%key, self.param_server.get_param(key)
+            return 1, "Parameter [%s]"%key, self._param_encoder.encode(self.param_server.get_param(key))
         except KeyError as e: 
             return -1, "Parameter [%s] is not set"%key, 0
 
@@ -522,29 +571,54 @@ class ROSMasterHandler(object):
     ##################################################################################
     # NOTIFICATION ROUTINES
 
-    def _notify(self, registrations, task, key, value, node_apis):
+    def _get_pending_updates(self, thread_pool, node_api):
         """
-        Generic implementation of callback notification
-        @param registrations: Registrations
-        @type  registrations: L{Registrations}
-        @param task: task to queue
-        @type  task: fn
-        @param key: registration key
-        @type  key: str
-        @param value: value to pass to task
-        @type  value: Any
+        Get the notifications waiting to be sent to node_api,
+        queueing a task to send them if there are none yet. Caller
+        must hold _pending_lock.
+        @param node_api: XML-RPC URI of node
+        @type  node_api: str
+        @return: pending notifications
+        @rtype: L{_PendingUpdates}
         """
-        # cache thread_pool for thread safety
-        thread_pool = self.thread_pool
-        if not thread_pool:
+        pending = self._pending_updates.get(node_api)
+        if pending is None:
+            self._pending_updates[node_api] = pending = _PendingUpdates()
+            # use the api as a marker so that we limit one thread per
+            # subscriber. Notifications added until the task runs are
+            # sent along.
+            thread_pool.queue_task(node_api, self._send_updates_task, (node_api,))
+            now = time.time()
+            if now - self._stats_log_time >= STATS_LOG_INTERVAL:
+                self._stats_log_time = now
+                self._log_thread_pool_stats(thread_pool)
+        return pending
+
+    def _log_thread_pool_stats(self, thread_pool):
+        """
+        Log the queue depth and latency statistics of the notification thread pool
+        """
+        stats = thread_pool.get_stats()
+        mloginfo("notification queue: queued=%d, max_queued=%d, dispatched=%d, mean_latency=%.3fs, max_latency=%.3fs",
+                 stats['queued'], stats['max_queued'], stats['dispatched'], stats['mean_latency'], stats['max_latency'])
+
+    def _send_updates_task(self, node_api):
+        """
+        Send the notifications waiting for node_api
+        @param node_api: XML-RPC URI of node to contact
+        @type  node_api: str
+        """
+        with self._pending_lock:
+            pending = self._pending_updates.pop(node_api, None)
+        if pending is None:
             return
-        
-        try:            
-            for node_api in node_apis:
-                # use the api as a marker so that we limit one thread per subscriber
-                thread_pool.queue_task(node_api, task, (node_api, key, value))
-        except KeyError:
-            _logger.warn('subscriber data stale (key [%s], listener [%s]): node API unknown'%(key, s))
+        for topic, pub_uris in pending.topics.items():
+            try:
+                publisher_update_task(node_api, topic, pub_uris)
+            except Exception:
+                _logger.error(traceback.format_exc())
+        if pending.params:
+            self.param_updates_task(node_api, [(caller_id, key, value) for key, (caller_id, value) in pending.params.items()])
         
     def _notify_param_subscribers(self, updates):
         """
@@ -557,10 +631,14 @@ class ROSMasterHandler(object):
         if not thread_pool:
             return
 
-        for subscribers, key, value in updates:
-            # use the api as a marker so that we limit one thread per subscriber
-            for caller_id, caller_api in subscribers:
-                self.thread_pool.queue_task(caller_api, self.param_update_task, (caller_id, caller_api, key, value))
+        with self._pending_lock:
+            for subscribers, key, value in updates:
+                for caller_id, caller_api in subscribers:
+                    params = self._get_pending_updates(thread_pool, caller_api).params
+                    # the latest update of key is sent after any
+                    # updates it overrides
+                    params.pop(key, None)
+                    params[key] = (caller_id, value)
 
     def param_update_task(self, caller_id, caller_api, param_key, param_value):
         """
@@ -577,15 +655,59 @@ class ROSMasterHandler(object):
         mloginfo("paramUpdate[%s]", param_key)
         code, _, _ = xmlrpcapi(caller_api).paramUpdate('/master', param_key, param_value)
         if code == -1:
+            self._unsubscribe_stale_param(caller_api, param_key)
+
+    def param_updates_task(self, caller_api, updates):
+        """
+        Contact api.paramUpdate with specified parameters, using a
+        single system.multicall if the node supports it.
+        @param caller_api: XML-RPC URI of node to contact
+        @type  caller_api: str
+        @param updates: parameter updates
+        @type  updates: [(caller_id, param_key, param_value)]
+        """
+        if len(updates) == 1:
+            self.param_update_task(updates[0][0], caller_api, updates[0][1], updates[0][2])
+            return
+        mloginfo("paramUpdate[%s]", ', '.join([key for _, key, _ in updates]))
+        multicall = MultiCall(xmlrpcapi(caller_api))
+        for _, key, value in updates:
+            multicall.paramUpdate('/master', key, value)
+        try:
+            results = multicall()
+        except Fault:
+            # system.multicall not supported by node
+            for caller_id, key, value in updates:
+                self.param_update_task(caller_id, caller_api, key, value)
+            return
+        # a fault of one update does not affect the others, which the
+        # node has already applied
+        for i, (_, key, _) in enumerate(updates):
             try:
-                # ps_lock is required due to potential self.reg_manager modification
-                self.ps_lock.acquire()
-                # reverse lookup to figure out who we just called
-                matches = self.reg_manager.reverse_lookup(caller_api)
-                for m in matches:
-                    retval = self.param_server.unsubscribe_param(param_key, (m.id, caller_api))
-            finally:
-                self.ps_lock.release()
+                code, _, _ = results[i]
+            except Fault as f:
+                mlogwarn("paramUpdate[%s] to [%s] failed: %s", key, caller_api, f.faultString)
+                continue
+            if code == -1:
+                self._unsubscribe_stale_param(caller_api, key)
+
+    def _unsubscribe_stale_param(self, caller_api, param_key):
+        """
+        Unsubscribe node from parameter it reports not to be subscribed to
+        @param caller_api: XML-RPC URI of node
+        @type  caller_api: str
+        @param param_key: parameter key
+        @type  param_key: str
+        """
+        try:
+            # ps_lock is required due to potential self.reg_manager modification
+            self.ps_lock.acquire()
+            # reverse lookup to figure out who we just called
+            matches = self.reg_manager.reverse_lookup(caller_api)
+            for m in matches:
+                retval = self.param_server.unsubscribe_param(param_key, (m.id, caller_api))
+        finally:
+            self.ps_lock.release()
 
     def _notify_topic_subscribers(self, topic, pub_uris, sub_uris):
         """
@@ -595,7 +717,15 @@ class ROSMasterHandler(object):
         @param pub_uris: list of URIs of publishers.
         @type  pub_uris: [str]
         """
-        self._notify(self.subscribers, publisher_update_task, topic, pub_uris, sub_uris)
+        # cache thread_pool for thread safety
+        thread_pool = self.thread_pool
+        if not thread_pool:
+            return
+
+        with self._pending_lock:
+            for node_api in sub_uris:
+                # only the latest publisher list is sent
+                self._get_pending_updates(thread_pool, node_api).topics[topic] = pub_uris
 
     ##################################################################################
     # SERVICE PROVIDER
@@ -697,7 +827,7 @@ class ROSMasterHandler(object):
             # ROS 1.1: subscriber can now set type if it is not already set
             #  - don't let '*' type squash valid typing
             if not topic in self.topics_types and topic_type != rosgraph.names.ANYTYPE:
-                self.topics_types[topic] = topic_type
+                self._set_topic_type(topic, topic_type)
 
             mloginfo("+SUB [%s] %s %s",topic, caller_id, caller_api)
             pub_uris = self.publishers.get_apis(topic)
@@ -752,7 +882,7 @@ class ROSMasterHandler(object):
             self.reg_manager.register_publisher(topic, caller_id, caller_api)
             # don't let '*' type squash valid typing
             if topic_type != rosgraph.names.ANYTYPE or not topic in self.topics_types:
-                self.topics_types[topic] = topic_type
+                self._set_topic_type(topic, topic_type)
             pub_uris = self.publishers.get_apis(topic)
             sub_uris = self.subscribers.get_apis(topic)
             self._notify_topic_subscribers(topic, pub_uris, sub_uris)
@@ -831,16 +961,16 @@ class ROSMasterHandler(object):
         @return: (code, msg, [[topic1, type1]...[topicN, typeN]])
         @rtype: (int, str, [[str, str],])
         """
-        try:
-            self.ps_lock.acquire()
-            # force subgraph to be a namespace with trailing slash
-            if subgraph and subgraph[-1] != rosgraph.names.SEP:
-                subgraph = subgraph + rosgraph.names.SEP
-            #we don't bother with subscribers as subscribers don't report topic types. also, the intended
-            #use case is for subscribe-by-topic-type
-            retval = [[t, self.topics_types[t]] for t in self.publishers.iterkeys() if t.startswith(subgraph)]
-        finally:
-            self.ps_lock.release()
+        # force subgraph to be a namespace with trailing slash
+        if subgraph and subgraph[-1] != rosgraph.names.SEP:
+            subgraph = subgraph + rosgraph.names.SEP
+        #we don't bother with subscribers as subscribers don't report topic types. also, the intended
+        #use case is for subscribe-by-topic-type
+        published_topics = self._get_snapshot().published_topics
+        if subgraph:
+            retval = [x for x in published_topics if x[0].startswith(subgraph)]
+        else:
+            retval = published_topics
         return 1, "current topics", retval
     
     @apivalidate([])
@@ -880,10 +1010,57 @@ class ROSMasterHandler(object):
            services is of the form::
              [ [service1, [service1Provider1...service1ProviderN]] ... ]
         """
-        edges = []
+        return 1, "current system state", self._get_snapshot().state
+
+    @apivalidate([], (None,))
+    def getSystemStateIfChanged(self, caller_id, version):
+        """
+        Retrieve list representation of system state if it has
+        changed since version, for clients polling the system state.
+        @param caller_id: ROS caller id    
+        @type  caller_id: str
+        @param version: version returned by the last call, or '' 
+        @type  version: str
+        @rtype: (int, str, [str, [[str,[str]], [str,[str]], [str,[str]]]])
+        @return: (code, statusMessage, [version, systemState]).
+           systemState is as returned by L{getSystemState()}, or an
+           empty list if it has not changed since version.
+        """
+        snapshot = self._get_snapshot()
+        if snapshot.version == version:
+            return 1, "system state unchanged", [snapshot.version, []]
+        return 1, "current system state", [snapshot.version, snapshot.state]
+
+    def _get_snapshot(self):
+        """
+        Get the snapshot of the current system state, which is only
+        rebuilt if registrations have changed since the last call.
+        @rtype: L{_SystemStateSnapshot}
+        """
+        registrations = (self.publishers, self.subscribers, self.services)
+        snapshot = self._snapshot
+        # versions only increase, so their sum identifies the registrations
+        if snapshot is not None and snapshot.version == self._get_snapshot_version(registrations):
+            return snapshot
         try: 
             self.ps_lock.acquire()
-            retval = [r.get_state() for r in (self.publishers, self.subscribers, self.services)]
+            version = self._get_snapshot_version(registrations)
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != version:
+                published_topics = [[t, self.topics_types[t]] for t in self.publishers.iterkeys()]
+                self._snapshot = snapshot = _SystemStateSnapshot(version, [r.get_state() for r in registrations], published_topics)
+            return snapshot
         finally:
             self.ps_lock.release()
-        return 1, "current system state", retval
+
+    def _get_snapshot_version(self, registrations):
+        return '%s.%d'%(self._snapshot_epoch, sum([r.version for r in registrations]) + self._topics_types_version)
+
+    def _set_topic_type(self, topic, topic_type):
+        """
+        Set the type of a topic, as returned by getPublishedTopics().
+        Caller must hold ps_lock.
+        """
+        if self.topics_types.get(topic) != topic_type:
+            self.topics_types[topic] = topic_type
+            self._topics_types_version += 1
@@ -52,7 +52,30 @@ def _get_param_names(names, key, d):
         else:
             names.append(ns_join(key, k))
 
+def _set_path(d, namespaces, value):
+    """
+    @return: copy of parameter tree d with namespaces set to
+    value. Only the dictionaries along namespaces are copied.
+    @rtype: dict
+    """
+    d = dict(d)
+    node = d
+    for ns in namespaces[:-1]:
+        val = node.get(ns)
+        # implicit type conversion of value to namespace
+        val = dict(val) if type(val) == dict else {}
+        node[ns] = val
+        node = val
+    node[namespaces[-1]] = value
+    return d
+
 class ParamDictionary(object):
+    """
+    Parameter tree. The tree is never modified in place: updates
+    replace the dictionaries along the path of the updated key, so
+    that readers get a consistent snapshot without locking. Values
+    returned and passed to notifications must not be modified.
+    """
     
     def __init__(self, reg_manager):
         """
@@ -60,6 +83,7 @@ class ParamDictionary(object):
         @param subscribers: parameter subscribers
         @type  subscribers: Registrations
         """
+        # serializes updates
         self.lock = RLock()
         self.parameters = {}
         self.reg_manager = reg_manager
@@ -71,12 +95,8 @@ class ParamDictionary(object):
         @return: [code, statusMessage, parameterNameList]
         @rtype: [int, str, [str]]
         """
-        try:
-            self.lock.acquire()
-            param_names = []
-            _get_param_names(param_names, '/', self.parameters)
-        finally:
-            self.lock.release()
+        param_names = []
+        _get_param_names(param_names, '/', self.parameters)
         return param_names
         
     def search_param(self, ns, key):
@@ -152,19 +172,16 @@ class ParamDictionary(object):
         @type  key: str
         @return: parameter value
         """
-        try:
-            self.lock.acquire()
-            val = self.parameters
-            if key != GLOBALNS:
-                # split by the namespace separator, ignoring empty splits
-                namespaces = [x for x in key.split(SEP)[1:] if x]
-                for ns in namespaces:
-                    if not type(val) == dict:
-                        raise KeyError(val)
-                    val = val[ns]
-            return val
-        finally:
-            self.lock.release()
+        # snapshot of the tree
+        val = self.parameters
+        if key != GLOBALNS:
+            # split by the namespace separator, ignoring empty splits
+            namespaces = [x for x in key.split(SEP)[1:] if x]
+            for ns in namespaces:
+                if not type(val) == dict:
+                    raise KeyError(val)
+                val = val[ns]
+        return val
     
     def set_param(self, key, value, notify_task=None):
         """
@@ -187,24 +204,7 @@ class ParamDictionary(object):
                 self.parameters = value
             else:
                 namespaces = [x for x in key.split(SEP) if x]
-                # - last namespace is the actual key we're storing in
-                value_key = namespaces[-1]
-                namespaces = namespaces[:-1]
-                d = self.parameters
-                # - descend tree to the node we're setting
-                for ns in namespaces:
-                    if not ns in d:
-                        new_d = {}
-                        d[ns] = new_d
-                        d = new_d
-                    else:
-                        val = d[ns]
-                        # implicit type conversion of value to namespace
-                        if type(val) != dict:
-                            d[ns] = val = {}
-                        d = val
-
-                d[value_key] = value
+                self.parameters = _set_path(self.parameters, namespaces, value)
 
             # ParamDictionary needs to queue updates so that the updates are thread-safe
             if notify_task:
@@ -272,19 +272,16 @@ class ParamDictionary(object):
                 namespaces = [x for x in key.split(SEP) if x]
                 # - last namespace is the actual key we're deleting
                 value_key = namespaces[-1]
-                namespaces = namespaces[:-1]
-                d = self.parameters
-                # - descend tree to the node we're setting
-                for ns in namespaces:
-                    if type(d) != dict or not ns in d:
-                        raise KeyError(key)
-                    else:
-                        d = d[ns]
-
-                if not value_key in d:
+                d = self.get_param(SEP + SEP.join(namespaces[:-1]))
+                if type(d) != dict or not value_key in d:
                     raise KeyError(key)
                 else:
+                    d = dict(d)
                     del d[value_key]
+                    if namespaces[:-1]:
+                        self.parameters = _set_path(self.parameters, namespaces[:-1], d)
+                    else:
+                        self.parameters = d
                     
                 # ParamDictionary needs to queue updates so that the updates are thread-safe
                 if notify_task:
@@ -311,27 +308,6 @@ class ParamDictionary(object):
         except KeyError:
             return False
     
-def _compute_all_keys(param_key, param_value, all_keys=None):
-    """
-    Compute which subscribers should be notified based on the parameter update
-    @param param_key: key of updated parameter
-    @type  param_key: str
-    @param param_value: value of updated parameter
-    @param all_keys: (internal use only) list of parameter keys
-        to append to for recursive calls.
-    @type  all_keys: [str]
-    @return: list of parameter keys. All keys will be canonicalized with trailing slash.
-    @rtype: [str]
-    """
-    if all_keys is None:
-        all_keys = []
-    for k, v in param_value.items():
-        new_k = ns_join(param_key, k) + SEP 
-        all_keys.append(new_k)
-        if type(v) == dict:
-            _compute_all_keys(new_k, v, all_keys)
-    return all_keys
-
 def compute_param_updates(subscribers, param_key, param_value):
     """
     Compute subscribers that should be notified based on the parameter update
@@ -348,46 +324,28 @@ def compute_param_updates(subscribers, param_key, param_value):
     if not subscribers:
         return []
     
-    # end with a trailing slash to optimize startswith check from
-    # needing an extra equals check
+    # end with a trailing slash to match subscription keys
     if param_key != SEP:
         param_key = canonicalize_name(param_key) + SEP    
+    namespaces = [x for x in param_key.split(SEP) if x]
 
-    # compute all the updated keys
-    if type(param_value) == dict:
-        all_keys = _compute_all_keys(param_key, param_value)
-    else:
-        all_keys = None
-        
-    updates = []
-    
-    # subscriber gets update if anything in the subscribed namespace is updated or if its deleted
-    for sub_key in subscribers.iterkeys():
-        ns_key = sub_key
-        if ns_key[-1] != SEP:
-            ns_key = sub_key + SEP
-        if param_key.startswith(ns_key):
-            node_apis = subscribers[sub_key]
-            updates.append((node_apis, param_key, param_value))
-        elif all_keys is not None and ns_key.startswith(param_key) \
-             and not sub_key in all_keys:
-            # parameter was deleted
-            node_apis = subscribers[sub_key]
-            updates.append((node_apis, sub_key, {}))
+    # only the subscriptions along the path of the key and in its
+    # namespace are affected
+    keys, index = subscribers.get_namespace_index().find(namespaces)
 
-    # add updates for exact matches within tree
-    if all_keys is not None:
-        # #586: iterate over parameter tree for notification
-        for key in all_keys:
-            if key in subscribers:
-                # compute actual update value
-                sub_key = key[len(param_key):]
-                namespaces = [x for x in sub_key.split(SEP) if x]
-                val = param_value
-                for ns in namespaces:
-                    val = val[ns]
+    # subscriber gets update if anything in the subscribed namespace is updated
+    updates = [(subscribers[sub_key], param_key, param_value) for sub_key in keys]
 
-                updates.append((subscribers[key], key, val))
+    # #586: subscribers within the updated tree get the actual update
+    # value, or the empty dictionary if their parameter was deleted
+    if index is not None and type(param_value) == dict:
+        for sub_namespaces, sub_key in index.iter_subkeys():
+            val = param_value
+            for ns in sub_namespaces:
+                if type(val) != dict or not ns in val:
+                    val = {}
+                    break
+                val = val[ns]
+            updates.append((subscribers[sub_key], sub_key, val))
 
     return updates
-        
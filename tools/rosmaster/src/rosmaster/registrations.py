@@ -130,6 +130,92 @@ def shutdown_node_task(api, caller_id, reason):
         pass #expected in many common cases
     remove_server_proxy(api)
     
+class NamespaceIndex(object):
+    """
+    Index of registration keys by namespace, for finding the
+    parameter subscriptions affected by an update without scanning
+    all of them. Keys are canonical parameter keys with a trailing
+    slash, as stored for PARAM_SUBSCRIPTIONS.
+    """
+
+    __slots__ = ['children', 'key']
+
+    def __init__(self):
+        ## { namespace : NamespaceIndex }
+        self.children = {}
+        ## registration key of this namespace, if registered
+        self.key = None
+
+    def add(self, key):
+        """
+        @param key: registration key
+        @type  key: str
+        """
+        node = self
+        for ns in key.split('/'):
+            if ns:
+                try:
+                    node = node.children[ns]
+                except KeyError:
+                    node.children[ns] = node = NamespaceIndex()
+        node.key = key
+
+    def remove(self, key):
+        """
+        @param key: registration key
+        @type  key: str
+        """
+        path = [self]
+        for ns in key.split('/'):
+            if ns:
+                node = path[-1].children.get(ns)
+                if node is None:
+                    return
+                path.append(node)
+        path[-1].key = None
+        # prune namespaces without registrations
+        namespaces = [ns for ns in key.split('/') if ns]
+        for i in range(len(namespaces), 0, -1):
+            node = path[i]
+            if node.key is not None or node.children:
+                break
+            del path[i-1].children[namespaces[i-1]]
+
+    def find(self, namespaces):
+        """
+        @param namespaces: namespaces of a key
+        @type  namespaces: [str]
+        @return: registration keys of the key and its parent
+        namespaces, and the index of the key, or None if no key is
+        registered in its namespace
+        @rtype: [str], L{NamespaceIndex}
+        """
+        keys = []
+        node = self
+        if node.key is not None:
+            keys.append(node.key)
+        for ns in namespaces:
+            node = node.children.get(ns)
+            if node is None:
+                return keys, None
+            if node.key is not None:
+                keys.append(node.key)
+        return keys, node
+
+    def iter_subkeys(self, namespaces=()):
+        """
+        Iterate over registration keys in the namespace of this
+        index, excluding its own.
+        @return: iterator of (namespaces relative to this index, key)
+        @rtype: iter((str,), str)
+        """
+        for ns, node in self.children.items():
+            sub = namespaces + (ns,)
+            if node.key is not None:
+                yield sub, node.key
+            for x in node.iter_subkeys(sub):
+                yield x
+
 class Registrations(object):
     """
     All calls may result in access/modifications to node registrations
@@ -162,6 +248,17 @@ class Registrations(object):
         ## { key: [(caller_id, caller_api)] }
         self.map = {} 
         self.service_api_map = None
+        # NamespaceIndex of self.map keys, created on first use
+        self._index = None
+        self._index_map = None
+        ## incremented on every registration change
+        self.version = 0
+        # get_state() entries: { key : [key, [caller_id]] }, rebuilt
+        # for changed keys only
+        self._state = None
+        self._state_entries = {}
+        self._state_changed = set()
+        self._state_map = None
 
     def __bool__(self):
         """
@@ -182,6 +279,21 @@ class Registrations(object):
         """
         return self.map.keys()
 
+    def get_namespace_index(self):
+        """
+        @return: index of registration keys by namespace. Only valid
+        if type==PARAM_SUBSCRIPTIONS.
+        @rtype: L{NamespaceIndex}
+        """
+        # rebuild if map has been replaced
+        if self._index is None or self._index_map is not self.map:
+            index = NamespaceIndex()
+            for key in self.map:
+                index.add(key)
+            self._index = index
+            self._index_map = self.map
+        return self._index
+
     def get_service_api(self, service):
         """
         Lookup service API URI. NOTE: this should only be valid if type==SERVICE as
@@ -235,15 +347,37 @@ class Registrations(object):
         """
         return key in self.map
     
+    def _changed(self, key):
+        """
+        Record change to the registrations of key
+        """
+        self.version += 1
+        self._state = None
+        self._state_changed.add(key)
+
     def get_state(self):
         """
-        @return: state in getSystemState()-friendly format [ [key, [callerId1...callerIdN]] ... ]
+        @return: state in getSystemState()-friendly format [ [key, [callerId1...callerIdN]] ... ].
+        The state is shared until registrations change, and must not be modified.
         @rtype: [str, [str]...]
         """
-        retval = []
-        for k in self.map.keys():
-            retval.append([k, [id for id, _ in self.map[k]]])
-        return retval
+        if self._state_map is not self.map:
+            # map has been replaced
+            self._state_entries = {}
+            self._state_changed = set(self.map)
+            self._state_map = self.map
+            self._state = None
+        if self._state is None:
+            entries = self._state_entries
+            for k in self._state_changed:
+                providers = self.map.get(k)
+                if providers:
+                    entries[k] = [k, [id for id, _ in providers]]
+                else:
+                    entries.pop(k, None)
+            self._state_changed.clear()
+            self._state = list(entries.values())
+        return self._state
 
     def register(self, key, caller_id, caller_api, service_api=None):
         """
@@ -262,18 +396,29 @@ class Registrations(object):
         @type  service_api: str
         """
         map = self.map
+        # re-registrations do not change the version
+        changed = False
         if key in map and not service_api:
             providers = map[key]
             if not (caller_id, caller_api) in providers:
                 providers.append((caller_id, caller_api))
-        else:
+                changed = True
+        elif map.get(key) != [(caller_id, caller_api)]:
             map[key] = providers = [(caller_id, caller_api)]
+            if self._index is not None:
+                self._index.add(key)
+            changed = True
 
         if service_api:
             if self.service_api_map is None:
                self.service_api_map = {}
-            self.service_api_map[key] = (caller_id, service_api)
-        elif self.type == Registrations.SERVICE:
+            if self.service_api_map.get(key) != (caller_id, service_api):
+                self.service_api_map[key] = (caller_id, service_api)
+                changed = True
+        if changed:
+            self._changed(key)
+
+        if not service_api and self.type == Registrations.SERVICE:
             raise rosmaster.exceptions.InternalException("service_api must be specified for Registrations.SERVICE")            
                    
     def unregister_all(self, caller_id):
@@ -292,10 +437,14 @@ class Registrations(object):
             # purge them
             for r in to_remove:
                 providers.remove(r)
+            if to_remove:
+                self._changed(key)
             if not providers:
                 dead_keys.append(key)
         for k in dead_keys:
             del self.map[k]
+            if self._index is not None:
+                self._index.remove(k)
         if self.type == Registrations.SERVICE and self.service_api_map:
             del dead_keys[:]
             for key, val in self.service_api_map.items():
@@ -330,6 +479,7 @@ class Registrations(object):
             else:
                 del self.service_api_map[key]
                 del self.map[key]
+                self._changed(key)
             # caller_api is None for unregister service, so we can't validate as well
             return 1, "Unregistered [%s] as provider of [%s]"%(caller_id, key), 1
         elif self.type == Registrations.SERVICE:
@@ -338,8 +488,11 @@ class Registrations(object):
             providers = self.map.get(key, [])
             if (caller_id, caller_api) in providers:
                 providers.remove((caller_id, caller_api))
+                self._changed(key)
                 if not providers:
                     del self.map[key]
+                    if self._index is not None:
+                        self._index.remove(key)
                 return 1, "Unregistered [%s] as provider of [%s]"%(caller_id, key), 1
             else:
                 return 1, "[%s] is not a known provider of [%s]"%(caller_id, key), 0
@@ -41,10 +41,16 @@ Added a 'marker' to tasks so that multiple tasks with the same
 marker are not executed. As we are using the thread pool for i/o
 tasks, the marker is set to the i/o name. This prevents a slow i/o
 for gobbling up all of our threads
+
+Tasks with the same marker wait in a FIFO queue for that marker
+while one of them executes. Tasks that can execute right away are
+kept in a ready queue, which idle threads wait on, so that queueing
+and retrieving a task takes constant time.
 """
 
 import threading, logging, traceback
-from time import sleep
+from collections import deque
+from time import time
 
 class MarkedThreadPool(object):
 
@@ -59,9 +65,22 @@ class MarkedThreadPool(object):
         self.__threads = []
         self.__resizeLock = threading.Condition(threading.Lock())
         self.__taskLock = threading.Condition(threading.Lock())
-        self.__tasks = []
+        # tasks that can be executed: (marker, task, args, callback, queue time)
+        self.__ready = deque()
+        # { marker : deque of tasks }, for markers of executing or ready tasks
+        self.__queues = {}
+        # markers of executing or ready tasks
         self.__markers = set()
+        # number of tasks not yet retrieved by a thread
+        self.__num_queued = 0
         self.__isJoining = False
+
+        # STATS
+        self.__max_queued = 0
+        self.__num_dispatched = 0
+        self.__total_latency = 0.
+        self.__max_latency = 0.
+
         self.set_thread_count(numThreads)
 
     def set_thread_count(self, newNumThreads):
@@ -93,9 +112,16 @@ class MarkedThreadPool(object):
             self.__threads.append(newThread)
             newThread.start()
         # If we need to shrink the pool, do so
-        while newNumThreads < len(self.__threads):
-            self.__threads[0].go_away()
-            del self.__threads[0]
+        if newNumThreads < len(self.__threads):
+            while newNumThreads < len(self.__threads):
+                self.__threads[0].go_away()
+                del self.__threads[0]
+            # wake up idle threads so that they can exit
+            self.__taskLock.acquire()
+            try:
+                self.__taskLock.notify_all()
+            finally:
+                self.__taskLock.release()
 
     def get_thread_count(self):
         """@return: number of threads in the pool."""
@@ -117,7 +143,23 @@ class MarkedThreadPool(object):
         
         self.__taskLock.acquire()
         try:
-            self.__tasks.append((marker, task, args, taskCallback))
+            t = (marker, task, args, taskCallback, time())
+            if marker is None:
+                self.__ready.append(t)
+            elif marker in self.__markers:
+                # wait for the task with the same marker to complete
+                try:
+                    self.__queues[marker].append(t)
+                except KeyError:
+                    self.__queues[marker] = deque([t])
+            else:
+                self.__markers.add(marker)
+                self.__ready.append(t)
+            self.__num_queued += 1
+            if self.__num_queued > self.__max_queued:
+                self.__max_queued = self.__num_queued
+            if self.__ready:
+                self.__taskLock.notify()
             return True
         finally:
             self.__taskLock.release()
@@ -129,31 +171,67 @@ class MarkedThreadPool(object):
             return
         self.__taskLock.acquire()        
         try:
-            self.__markers.remove(marker)
+            queue = self.__queues.get(marker)
+            if queue:
+                # next task with this marker can now execute
+                self.__ready.append(queue.popleft())
+                if not queue:
+                    del self.__queues[marker]
+                self.__taskLock.notify()
+            else:
+                self.__markers.discard(marker)
         finally:
             self.__taskLock.release()            
     
-    def get_next_task(self):
+    def get_next_task(self, thread=None):
 
-        """ Retrieve the next task from the task queue.  For use
-        only by ThreadPoolThread objects contained in the pool."""
+        """ Retrieve the next task from the task queue, waiting for
+        one if there is none.  For use only by ThreadPoolThread
+        objects contained in the pool.
+        @param thread: if set, stop waiting once this thread has
+        been told to go away
+        @type  thread: L{ThreadPoolThread}
+        @return: (marker, task, args, callback). task is None if
+        no task was retrieved."""
         
         self.__taskLock.acquire()
         try:
-            retval = None
-            for marker, task, args, callback in self.__tasks:
-                # unmarked or not currently executing
-                if marker is None or marker not in self.__markers:
-                    retval = (marker, task, args, callback)
-                    break
-            if retval:
-                # add the marker so we don't do any similar tasks
-                self.__tasks.remove(retval)
-                if marker is not None:
-                    self.__markers.add(marker)
-                return retval
-            else:
-                return (None, None, None, None)
+            while not self.__ready:
+                if thread is None or thread.is_dying():
+                    return (None, None, None, None)
+                self.__taskLock.wait()
+            marker, task, args, callback, queued = self.__ready.popleft()
+            self.__num_queued -= 1
+            if not self.__num_queued:
+                # join_all() may be waiting for the queue to empty
+                self.__taskLock.notify_all()
+            latency = time() - queued
+            self.__num_dispatched += 1
+            self.__total_latency += latency
+            if latency > self.__max_latency:
+                self.__max_latency = latency
+            return (marker, task, args, callback)
+        finally:
+            self.__taskLock.release()
+
+    def get_stats(self):
+        """
+        @return: queue and latency statistics: 'queued', number of
+        tasks waiting for a thread, 'max_queued', highest number of
+        waiting tasks, 'dispatched', number of tasks retrieved by a
+        thread, and 'mean_latency'/'max_latency', time between
+        queueing and retrieving tasks, in seconds.
+        @rtype: dict
+        """
+        self.__taskLock.acquire()
+        try:
+            return {
+                'queued': self.__num_queued,
+                'max_queued': self.__max_queued,
+                'dispatched': self.__num_dispatched,
+                'mean_latency': self.__total_latency / self.__num_dispatched if self.__num_dispatched else 0.,
+                'max_latency': self.__max_latency,
+                }
         finally:
             self.__taskLock.release()
     
@@ -166,20 +244,24 @@ class MarkedThreadPool(object):
 
         # Wait for tasks to finish
         if wait_for_tasks:
-            while self.__tasks != []:
-                sleep(.1)
+            self.__taskLock.acquire()
+            try:
+                while self.__num_queued:
+                    self.__taskLock.wait()
+            finally:
+                self.__taskLock.release()
 
         # Tell all the threads to quit
         self.__resizeLock.acquire()
         try:
+            threads = list(self.__threads)
             self.__set_thread_count_nolock(0)
             self.__isJoining = True
 
             # Wait until all threads have exited
             if wait_for_threads:
-                for t in self.__threads:
+                for t in threads:
                     t.join()
-                    del t
 
             # Reset the pool for potential reuse
             self.__isJoining = False
@@ -193,8 +275,6 @@ class ThreadPoolThread(threading.Thread):
     Pooled thread class.
     """
     
-    threadSleepTime = 0.1
-
     def __init__(self, pool):
         """Initialize the thread and remember the pool."""
         threading.Thread.__init__(self)
@@ -208,20 +288,22 @@ class ThreadPoolThread(threading.Thread):
         it, calling the callback if any.  
         """
         while self.__isDying == False:
-            marker, cmd, args, callback = self.__pool.get_next_task()
-            # If there's nothing to do, just sleep a bit
+            marker, cmd, args, callback = self.__pool.get_next_task(self)
             if cmd is None:
-                sleep(ThreadPoolThread.threadSleepTime)
-            else:
+                continue
+            try:
                 try:
-                    try:
-                        result = cmd(*args)
-                    finally:
-                        self.__pool.remove_marker(marker)
-                    if callback is not None:
-                        callback(result)
-                except Exception as e:
-                    logging.getLogger('rosmaster.threadpool').error(traceback.format_exc())
+                    result = cmd(*args)
+                finally:
+                    self.__pool.remove_marker(marker)
+                if callback is not None:
+                    callback(result)
+            except Exception as e:
+                logging.getLogger('rosmaster.threadpool').error(traceback.format_exc())
+
+    def is_dying(self):
+        """@return: True if the thread has been told to quit"""
+        return self.__isDying
     
     def go_away(self):
         """ Exit the run loop next time through."""
@@ -41,9 +41,9 @@ try:
 except ImportError:
     from urlparse import urlparse
 try:
-    from xmlrpc.client import ServerProxy
+    from xmlrpc.client import Marshaller, ServerProxy, escape
 except ImportError:
-    from xmlrpclib import ServerProxy
+    from xmlrpclib import Marshaller, ServerProxy, escape
 
 from defusedxml.xmlrpc import monkey_patch
 monkey_patch()
@@ -51,6 +51,7 @@ del monkey_patch
 
 import errno
 import socket
+import threading
 
 _proxies = {} #cache ServerProxys
 def xmlrpcapi(uri):
@@ -88,3 +89,143 @@ def close_half_closed_sockets():
 def remove_server_proxy(uri):
     if uri in _proxies:
         del _proxies[uri]
+
+
+class EncodedValue(object):
+    """
+    XML-RPC value that has already been marshaled. Returned from
+    master APIs in place of the value it encodes.
+    """
+    __slots__ = ['data']
+
+    def __init__(self, data):
+        ## <value> element of the encoded value
+        self.data = data
+
+def _dump_encoded(marshaller, value, write):
+    write(value.data)
+Marshaller.dispatch[EncodedValue] = _dump_encoded
+
+def _dump(marshaller, value, write):
+    try:
+        dump = Marshaller.dispatch[type(value)]
+    except KeyError:
+        # types only handled by Marshaller.dumps(), e.g. Binary
+        data = marshaller.dumps((value,))
+        write(data[len('<params>\n<param>\n'):-len('</param>\n</params>\n')])
+    else:
+        dump(marshaller, value, write)
+
+try:
+    _string_types = (str, unicode)
+except NameError:
+    _string_types = (str,)
+
+# approximate encoded size of the tags around an XML-RPC value or struct member
+_TAGS_SIZE = 32
+
+def _estimate_size(value, limit):
+    """
+    @return: approximate encoded size of value, which is only
+    computed up to limit
+    @rtype: int
+    """
+    size = 0
+    values = [value]
+    while values and size < limit:
+        v = values.pop()
+        if type(v) == dict:
+            for k, item in v.items():
+                size += len(k) + _TAGS_SIZE
+                values.append(item)
+        elif type(v) in (list, tuple):
+            values.extend(v)
+        elif isinstance(v, _string_types):
+            size += len(v) + _TAGS_SIZE
+        else:
+            size += _TAGS_SIZE
+    return size
+
+class ValueEncoder(object):
+    """
+    Caches the XML-RPC encoding of large parameter values, so that
+    values such as robot_description are not marshaled again for
+    every request. Values are identified by object identity, which
+    requires that they are never modified once encoded, as is the
+    case for the parameter tree of L{rosmaster.paramserver.ParamDictionary}.
+    Parameter trees that share unchanged subtrees share their
+    cached encodings as well.
+    """
+
+    def __init__(self, min_size=16384, max_cache_size=64 * 1024 * 1024):
+        """
+        @param min_size: minimum encoded size of the values to cache
+        @type  min_size: int
+        @param max_cache_size: total encoded size at which the cache
+        is emptied
+        @type  max_cache_size: int
+        """
+        self.min_size = min_size
+        self.max_cache_size = max_cache_size
+        self._lock = threading.Lock()
+        # { id(value) : (value, encoded) }, where encoded is None for
+        # dictionaries too small to be cached. Holding value keeps its
+        # id valid
+        self._cache = {}
+        self._cache_size = 0
+
+    def encode(self, value):
+        """
+        @return: encoded value if it is large enough to be cached,
+        otherwise value itself
+        @rtype: L{EncodedValue} or XMLRPCLegalValue
+        """
+        if type(value) == dict:
+            entry = self._cache.get(id(value))
+            if entry is not None and entry[0] is value:
+                return value if entry[1] is None else EncodedValue(entry[1])
+            # small values are only marshaled by the XML-RPC server
+            size = _estimate_size(value, self.min_size)
+            if size < self.min_size:
+                self._add(value, None, size)
+                return value
+        elif not (isinstance(value, _string_types) and len(value) >= self.min_size):
+            return value
+        # returned even if smaller than estimated, not to encode it again
+        return EncodedValue(self._encode(value, Marshaller(allow_none=True)))
+
+    def _encode(self, value, marshaller):
+        entry = self._cache.get(id(value))
+        if entry is not None and entry[0] is value and entry[1] is not None:
+            return entry[1]
+
+        if type(value) == dict:
+            out = ['<value><struct>\n']
+            for k, v in value.items():
+                if not isinstance(k, _string_types):
+                    raise TypeError("dictionary key must be string")
+                out.append('<member>\n<name>%s</name>\n' % escape(k))
+                if type(v) == dict or isinstance(v, _string_types):
+                    out.append(self._encode(v, marshaller))
+                else:
+                    _dump(marshaller, v, out.append)
+                out.append('</member>\n')
+            out.append('</struct></value>\n')
+            data = ''.join(out)
+        else:
+            out = []
+            _dump(marshaller, value, out.append)
+            data = ''.join(out)
+
+        if len(data) >= self.min_size:
+            self._add(value, data, len(data))
+        return data
+
+    def _add(self, value, data, size):
+        with self._lock:
+            if self._cache_size + size > self.max_cache_size:
+                self._cache.clear()
+                self._cache_size = 0
+            if id(value) not in self._cache:
+                self._cache[id(value)] = (value, data)
+                self._cache_size += size
@@ -0,0 +1,280 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2008, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import threading
+import unittest
+
+try:
+    from xmlrpc.client import dumps, loads
+    from xmlrpc.server import SimpleXMLRPCServer
+except ImportError:
+    from xmlrpclib import dumps, loads
+    from SimpleXMLRPCServer import SimpleXMLRPCServer
+
+class ThreadPoolMock(object):
+    def __init__(self):
+        self.tasks = []
+    def queue_task(self, marker, task, args=None, taskCallback=None):
+        self.tasks.append((marker, task, args))
+    def join_all(self, *args, **kwds):
+        pass
+    def get_stats(self):
+        return {'queued': len(self.tasks), 'max_queued': len(self.tasks), 'dispatched': 0,
+                'mean_latency': 0., 'max_latency': 0.}
+
+class NodeMock(object):
+    def __init__(self):
+        self.updates = []
+    def paramUpdate(self, caller_id, key, value):
+        self.updates.append((key, value))
+        if key == '/fault/':
+            raise ValueError(key)
+        return 1, '', 0
+
+class TestRosmasterMasterApi(unittest.TestCase):
+
+    def _start_node(self, multicall):
+        node = NodeMock()
+        server = SimpleXMLRPCServer(('localhost', 0), logRequests=False)
+        if multicall:
+            server.register_multicall_functions()
+        server.register_instance(node)
+        t = threading.Thread(target=server.serve_forever)
+        t.daemon = True
+        t.start()
+        self.addCleanup(server.shutdown)
+        return node, 'http://localhost:%s/' % server.server_address[1]
+
+    def test_notification_coalescing(self):
+        from rosmaster.master_api import ROSMasterHandler
+        m = ROSMasterHandler(num_workers=1)
+        m.thread_pool.join_all(False, False)
+        m.thread_pool = pool = ThreadPoolMock()
+
+        m._notify_topic_subscribers('/t', ['http://pub1:1'], ['http://n1:1', 'http://n2:1'])
+        m._notify_topic_subscribers('/t', ['http://pub1:1', 'http://pub2:1'], ['http://n1:1'])
+        m._notify_topic_subscribers('/u', [], ['http://n1:1'])
+        m._notify_param_subscribers([([('n1', 'http://n1:1')], '/a/', 1), ([('n2', 'http://n2:1')], '/b/', 2)])
+        m._notify_param_subscribers([([('n1', 'http://n1:1')], '/c/', 3)])
+        m._notify_param_subscribers([([('n1', 'http://n1:1')], '/a/', 4)])
+
+        # one task per node api, with the api as marker
+        self.assertEquals(['http://n1:1', 'http://n2:1'], [marker for marker, _, _ in pool.tasks])
+        pending = m._pending_updates['http://n1:1']
+        self.assertEquals([('/t', ['http://pub1:1', 'http://pub2:1']), ('/u', [])], list(pending.topics.items()))
+        # latest update of a key is sent after the updates it overrides
+        self.assertEquals([('/c/', ('n1', 3)), ('/a/', ('n1', 4))], list(pending.params.items()))
+        pending = m._pending_updates['http://n2:1']
+        self.assertEquals([('/t', ['http://pub1:1'])], list(pending.topics.items()))
+        self.assertEquals([('/b/', ('n2', 2))], list(pending.params.items()))
+
+        # sending takes the pending updates: new notifications queue a new task
+        node, api = self._start_node(True)
+        m._notify_param_subscribers([([('n3', api)], '/a/', 1), ([('n3', api)], '/b/', 2)])
+        marker, task, args = pool.tasks[-1]
+        self.assertEquals(api, marker)
+        task(*args)
+        self.assertEquals([('/a/', 1), ('/b/', 2)], node.updates)
+        self.failIf(api in m._pending_updates)
+        m._notify_param_subscribers([([('n3', api)], '/c/', 3)])
+        self.assertEquals(api, pool.tasks[-1][0])
+        self.assertEquals(4, len(pool.tasks))
+
+    def test_thread_pool_stats(self):
+        import logging
+        import rosmaster.master_api
+        from rosmaster.master_api import ROSMasterHandler
+        records = []
+        class Handler(logging.Handler):
+            def emit(self, record):
+                if record.getMessage().startswith('notification queue:'):
+                    records.append(record.getMessage())
+        handler = Handler()
+        logger = logging.getLogger('rosmaster.master')
+        logger.addHandler(handler)
+        level = logger.level
+        logger.setLevel(logging.INFO)
+        self.addCleanup(logger.setLevel, level)
+        self.addCleanup(logger.removeHandler, handler)
+
+        m = ROSMasterHandler(num_workers=1)
+        m.thread_pool.join_all(False, False)
+        m.thread_pool = ThreadPoolMock()
+        # logged at most every STATS_LOG_INTERVAL while notifications are queued
+        m._notify_topic_subscribers('/t', [], ['http://n1:1'])
+        self.assertEquals([], records)
+        m._stats_log_time -= rosmaster.master_api.STATS_LOG_INTERVAL
+        m._notify_topic_subscribers('/t', [], ['http://n2:1'])
+        m._notify_topic_subscribers('/t', [], ['http://n3:1'])
+        self.assertEquals(['notification queue: queued=2, max_queued=2, dispatched=0, mean_latency=0.000s, max_latency=0.000s'], records)
+        # and on shutdown
+        m._shutdown('test')
+        self.assertEquals(2, len(records))
+        self.assert_(records[1].startswith('notification queue: queued=3,'))
+
+    def test_param_updates_task(self):
+        from rosmaster.master_api import ROSMasterHandler
+        m = ROSMasterHandler(num_workers=1)
+        m.thread_pool.join_all(False, False)
+        updates = [('n1', '/a/', 1), ('n1', '/b/', {'c': 2})]
+        for multicall in [True, False]:
+            node, api = self._start_node(multicall)
+            m.param_updates_task(api, updates)
+            self.assertEquals([('/a/', 1), ('/b/', {'c': 2})], node.updates)
+
+        # a fault of one update is not taken for lack of multicall
+        # support, which would send the others twice
+        node, api = self._start_node(True)
+        m.param_updates_task(api, [('n1', '/a/', 1), ('n1', '/fault/', 2), ('n1', '/b/', 3)])
+        self.assertEquals([('/a/', 1), ('/fault/', 2), ('/b/', 3)], node.updates)
+
+    def test_getSystemStateIfChanged(self):
+        from rosmaster.master_api import ROSMasterHandler
+        m = ROSMasterHandler(num_workers=1)
+        m.thread_pool.join_all(False, False)
+        m.thread_pool = ThreadPoolMock()
+
+        code, _, (version, state) = m.getSystemStateIfChanged('/caller', '')
+        self.assertEquals(1, code)
+        self.assertEquals([[], [], []], state)
+        self.assertEquals([version, []], m.getSystemStateIfChanged('/caller', version)[2])
+
+        m.registerPublisher('/node1', '/topic1', 'std_msgs/String', 'http://node1:1234')
+        m.registerSubscriber('/node2', '/topic1', 'std_msgs/String', 'http://node2:1234')
+        m.registerPublisher('/node1', '/ns/topic2', 'std_msgs/Int32', 'http://node1:1234')
+        code, _, (new_version, state) = m.getSystemStateIfChanged('/caller', version)
+        self.assertNotEquals(version, new_version)
+        self.assertEquals(m.getSystemState('/caller')[2], state)
+        self.assertEquals([['/ns/topic2', ['/node1']], ['/topic1', ['/node1']]], sorted(state[0]))
+        self.assertEquals([['/topic1', ['/node2']]], state[1])
+        self.assertEquals([new_version, []], m.getSystemStateIfChanged('/caller', new_version)[2])
+        self.assertEquals([['/ns/topic2', 'std_msgs/Int32'], ['/topic1', 'std_msgs/String']],
+                          sorted(m.getPublishedTopics('/caller', '')[2]))
+        self.assertEquals([['/ns/topic2', 'std_msgs/Int32']], m.getPublishedTopics('/caller', '/ns')[2])
+
+        m.unregisterSubscriber('/node2', '/topic1', 'http://node2:1234')
+        code, _, (version, state) = m.getSystemStateIfChanged('/caller', new_version)
+        self.assertNotEquals(version, new_version)
+        self.assertEquals([], state[1])
+
+        # re-registering with another type changes the published types
+        m.registerPublisher('/node1', '/topic1', 'std_msgs/String', 'http://node1:1234')
+        self.assertEquals([version, []], m.getSystemStateIfChanged('/caller', version)[2])
+        m.registerPublisher('/node1', '/topic1', 'std_msgs/Int32', 'http://node1:1234')
+        self.assertEquals([['/ns/topic2', 'std_msgs/Int32'], ['/topic1', 'std_msgs/Int32']],
+                          sorted(m.getPublishedTopics('/caller', '')[2]))
+        self.assertNotEquals(version, m.getSystemStateIfChanged('/caller', version)[2][0])
+
+    def test_getParam_encoded(self):
+        from rosmaster.master_api import ROSMasterHandler
+        from rosmaster.util import EncodedValue
+        m = ROSMasterHandler(num_workers=1)
+        m.thread_pool.join_all(False, False)
+        m.thread_pool = ThreadPoolMock()
+
+        description = '<robot name="r">%s</robot>' % ('<link name="l"/>' * 4096)
+        m.setParam('/caller', '/robot_description', description)
+        m.setParam('/caller', '/ns/a', [1, 2.0, 'three', True])
+        m.setParam('/caller', '/ns/b', 'b & <c>')
+        m.setParam('/caller', '/ns/c', {'d': 1})
+
+        def check(key, value):
+            result = m.getParam('/caller', key)
+            self.assertEquals(1, result[0])
+            self.assertEquals(([1, result[1], value],), loads(dumps((result,), methodresponse=True))[0])
+            return result[2]
+
+        # small values are returned as is
+        self.assertEquals('b & <c>', check('/ns/b', 'b & <c>'))
+        self.assertEquals({'a': [1, 2.0, 'three', True], 'b': 'b & <c>', 'c': {'d': 1}}, check('/ns', {'a': [1, 2.0, 'three', True], 'b': 'b & <c>', 'c': {'d': 1}}))
+
+        val = check('/robot_description', description)
+        self.assert_(isinstance(val, EncodedValue))
+        self.assert_(val.data is check('/robot_description', description).data)
+
+        tree = {'robot_description': description, 'ns': {'a': [1, 2.0, 'three', True], 'b': 'b & <c>', 'c': {'d': 1}}}
+        self.assert_(isinstance(check('/', tree), EncodedValue))
+
+        # updates of other parameters reuse the encoding of robot_description
+        m.setParam('/caller', '/ns/b', 'e')
+        tree['ns']['b'] = 'e'
+        self.assert_(val.data in check('/', tree).data)
+        m.setParam('/caller', '/robot_description', description + ' ')
+        check('/robot_description', description + ' ')
+
+    def test_ValueEncoder(self):
+        from rosmaster.util import EncodedValue, ValueEncoder
+        encoder = ValueEncoder(min_size=1024)
+        encoded = []
+        _encode = encoder._encode
+        def count(value, marshaller):
+            encoded.append(value)
+            return _encode(value, marshaller)
+        encoder._encode = count
+
+        # small values are not encoded, the XML-RPC server does it
+        small = {'a': 1, 'b': {'c': 'd'}, 'e': [1, 2, 3]}
+        self.assert_(encoder.encode(small) is small)
+        self.assert_(encoder.encode('x' * 1023) == 'x' * 1023)
+        self.assertEquals([], encoded)
+        # nor estimated again
+        self.assert_(encoder._cache[id(small)][0] is small)
+        self.assert_(encoder.encode(small) is small)
+        # but still encoded when nested in a larger value
+        small_large = {'small': small, 'large': 'x' * 2048}
+        self.assertEquals(((small_large,), None),
+                          loads(dumps((encoder.encode(small_large),))))
+        del encoded[:]
+
+        # large values are encoded once
+        large = {'a': 'x' * 2048, 'b': {'c': 'd'}}
+        val = encoder.encode(large)
+        self.assert_(isinstance(val, EncodedValue))
+        self.assertEquals(1, len([v for v in encoded if v is large]))
+        del encoded[:]
+        self.assert_(encoder.encode(large).data is val.data)
+        self.assertEquals([], encoded)
+        self.assertEquals(((large,), None), loads(dumps((val,))))
+        # values found to be smaller than estimated are returned encoded
+        # rather than encoded again, but not cached
+        from rosmaster.util import _estimate_size
+        many = dict(('k%d'%i, i) for i in range(64))
+        size = len(ValueEncoder(min_size=0).encode(many).data)
+        self.assert_(_estimate_size(many, 1 << 20) > size)
+        encoder.min_size = size + 1
+        del encoded[:]
+        val = encoder.encode(many)
+        self.assert_(isinstance(val, EncodedValue))
+        self.assertEquals([many], encoded)
+        self.assertEquals(((many,), None), loads(dumps((val,))))
+        self.assertEquals(None, encoder._cache.get(id(many)))
@@ -682,6 +682,35 @@ class TestRospyParamServer(unittest.TestCase):
         self.assertEquals('a', param_server.get_param('/baz/a'))
         self.assertEquals('a', param_server.get_param('/baz/a/'))
 
+    def test_copy_on_write(self):
+        from rosmaster.registrations import RegistrationManager
+        from rosmaster.paramserver import ParamDictionary
+        param_server = ParamDictionary(RegistrationManager(ThreadPoolMock()))
+        param_server.set_param('/a/b/c', 1)
+        param_server.set_param('/a/d/e', 2)
+        root = param_server.get_param('/')
+        a_d = param_server.get_param('/a/d')
+
+        # updates leave values already returned untouched
+        param_server.set_param('/a/b/c', 3)
+        param_server.set_param('/a/b/f', 4)
+        param_server.delete_param('/a/d/e')
+        self.assertEquals({'a': {'b': {'c': 1}, 'd': {'e': 2}}}, root)
+        self.assertEquals({'e': 2}, a_d)
+        self.assertEquals({'a': {'b': {'c': 3, 'f': 4}, 'd': {}}}, param_server.get_param('/'))
+
+        # unchanged subtrees are shared with the new tree
+        a_b = param_server.get_param('/a/b')
+        param_server.set_param('/a/d/g', 5)
+        self.assert_(a_b is param_server.get_param('/a/b'))
+        self.assertEquals({'g': 5}, param_server.get_param('/a/d'))
+
+        # implicit conversion of value to namespace
+        param_server.set_param('/a/d/g/h', 6)
+        self.assertEquals({'h': 6}, param_server.get_param('/a/d/g'))
+        param_server.delete_param('/a')
+        self.assertEquals({}, param_server.get_param('/'))
+
     # test_param_values: test storage of all XML-RPC compatible types"""
     def test_param_values(self):
         import math
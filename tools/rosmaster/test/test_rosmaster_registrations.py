@@ -677,3 +677,88 @@ class TestRosmasterRegistrations(unittest.TestCase):
         self.assert_(not r) #test nonzero
         self.assertEquals([], r.get_state())
         
+
+    def test_Registrations_namespace_index(self):
+        from rosmaster.registrations import Registrations
+        r = Registrations(Registrations.PARAM_SUBSCRIPTIONS)
+        r.register('/a/', 'n1', 'http://n1:1')
+        index = r.get_namespace_index()
+        self.assertEquals((['/a/'], index.children['a']), index.find(['a']))
+        # index is kept up to date
+        r.register('/a/b/c/', 'n1', 'http://n1:1')
+        r.register('/a/b/c/', 'n2', 'http://n2:1')
+        r.register('/', 'n3', 'http://n3:1')
+        self.assert_(index is r.get_namespace_index())
+        keys, sub_index = index.find(['a', 'b'])
+        self.assertEquals(['/', '/a/'], keys)
+        self.assertEquals([(('c',), '/a/b/c/')], list(sub_index.iter_subkeys()))
+        self.assertEquals((['/', '/a/'], None), index.find(['a', 'x']))
+        self.assertEquals(['/', '/a/', '/a/b/c/'], index.find(['a', 'b', 'c', 'd'])[0])
+
+        r.unregister('/a/b/c/', 'n1', 'http://n1:1')
+        self.assertEquals(['/', '/a/', '/a/b/c/'], index.find(['a', 'b', 'c'])[0])
+        r.unregister_all('n2')
+        # empty namespaces are pruned
+        self.assertEquals((['/', '/a/'], None), index.find(['a', 'b']))
+        self.assertEquals(['a'], list(index.children.keys()))
+        r.unregister('/a/', 'n1', 'http://n1:1')
+        self.assertEquals({}, index.children)
+        self.assertEquals('/', index.key)
+
+        # index is rebuilt if the map is replaced
+        r.map = {'/x/y/': [('n4', 'http://n4:1')]}
+        self.assertEquals(['/x/y/'], r.get_namespace_index().find(['x', 'y', 'z'])[0])
+
+    def test_Registrations_get_state(self):
+        from rosmaster.registrations import Registrations
+        r = Registrations(Registrations.TOPIC_PUBLICATIONS)
+        self.assertEquals([], r.get_state())
+        version = r.version
+        r.register('topic1', 'node1', 'http://node1:5678')
+        r.register('topic2', 'node1', 'http://node1:5678')
+        self.assert_(r.version > version)
+        state = r.get_state()
+        self.assertEquals(sorted([['topic1', ['node1']], ['topic2', ['node1']]]), sorted(state))
+        # shared until registrations change
+        self.assert_(state is r.get_state())
+
+        version = r.version
+        r.register('topic1', 'node2', 'http://node2:5678')
+        self.assert_(r.version > version)
+        # re-registration
+        version = r.version
+        r.register('topic1', 'node2', 'http://node2:5678')
+        self.assertEquals(version, r.version)
+        self.assert_(state is not r.get_state())
+        state = r.get_state()
+        r.register('topic1', 'node1', 'http://node1:5678')
+        self.assertEquals(version, r.version)
+        self.assert_(state is r.get_state())
+        self.assertEquals(sorted([['topic1', ['node1', 'node2']], ['topic2', ['node1']]]), sorted(r.get_state()))
+        version = r.version
+        # no change
+        r.unregister('topic1', 'node3', 'http://node3:5678')
+        self.assertEquals(version, r.version)
+        r.unregister_all('node3')
+        self.assertEquals(version, r.version)
+        r.unregister_all('node1')
+        self.assert_(r.version > version)
+        self.assertEquals([['topic1', ['node2']]], r.get_state())
+        r.unregister('topic1', 'node2', 'http://node2:5678')
+        self.assertEquals([], r.get_state())
+
+        r = Registrations(Registrations.SERVICE)
+        r.register('service1', 'node1', 'http://node1:5678', 'rosrpc://node1:1234')
+        self.assertEquals([['service1', ['node1']]], r.get_state())
+        version = r.version
+        r.register('service1', 'node1', 'http://node1:5678', 'rosrpc://node1:1234')
+        self.assertEquals(version, r.version)
+        r.register('service1', 'node1', 'http://node1:5678', 'rosrpc://node1:4321')
+        self.assert_(r.version > version)
+        self.assertEquals('rosrpc://node1:4321', r.get_service_api('service1'))
+        version = r.version
+        r.register('service1', 'node2', 'http://node2:5678', 'rosrpc://node1:4321')
+        self.assert_(r.version > version)
+        self.assertEquals([['service1', ['node2']]], r.get_state())
+        r.unregister('service1', 'node2', None, 'rosrpc://node1:4321')
+        self.assertEquals([], r.get_state())
@@ -0,0 +1,99 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2008, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import threading
+import time
+import unittest
+
+class TestRosmasterThreadpool(unittest.TestCase):
+
+    def test_MarkedThreadPool(self):
+        from rosmaster.threadpool import MarkedThreadPool
+        pool = MarkedThreadPool(3)
+        self.assertEquals(3, pool.get_thread_count())
+        self.failIf(pool.queue_task('m', 'not callable'))
+
+        lock = threading.Lock()
+        running = {}
+        max_running = {}
+        order = []
+        done = threading.Event()
+        def task(marker, i):
+            with lock:
+                running[marker] = running.get(marker, 0) + 1
+                max_running[marker] = max(max_running.get(marker, 0), running[marker])
+            time.sleep(0.01)
+            with lock:
+                running[marker] -= 1
+                order.append((marker, i))
+            return i
+        results = []
+        def callback(result):
+            results.append(result)
+            if len(results) == 30:
+                done.set()
+        for i in range(10):
+            for marker in ['a', 'b', None]:
+                self.assert_(pool.queue_task(marker, task, (marker, i), callback))
+        self.assert_(done.wait(10.))
+
+        # tasks with the same marker execute one at a time, in order
+        self.assertEquals(1, max_running['a'])
+        self.assertEquals(1, max_running['b'])
+        self.assertEquals(list(range(10)), [i for m, i in order if m == 'a'])
+        self.assertEquals(list(range(10)), [i for m, i in order if m == 'b'])
+        self.assertEquals(30, len(results))
+
+        stats = pool.get_stats()
+        self.assertEquals(0, stats['queued'])
+        self.assertEquals(30, stats['dispatched'])
+        self.assert_(stats['max_queued'] >= 10)
+        self.assert_(0. < stats['mean_latency'] <= stats['max_latency'])
+
+        # idle threads are woken up to exit
+        self.assert_(pool.set_thread_count(1))
+        self.assertEquals(1, pool.get_thread_count())
+        pool.join_all()
+        self.assertEquals(0, pool.get_thread_count())
+
+    def test_exception(self):
+        from rosmaster.threadpool import MarkedThreadPool
+        pool = MarkedThreadPool(1)
+        done = threading.Event()
+        def fail():
+            raise Exception("task failure")
+        # marker is released after a failure
+        pool.queue_task('m', fail, ())
+        pool.queue_task('m', done.set, ())
+        self.assert_(done.wait(5.))
+        pool.join_all()